@@ -0,0 +1,31 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne
+from adapters.mongo_client import get_mongo_client
+from config.settings import DB_NAME, COMPLIANCE_RESULTS_COLLECTION, MONGO_WRITE_BATCH_SIZE
+
+class ComplianceResultRepository:
+    """Latest rule results per shipment, one record per invoice key (the record's _id)"""
+
+    def __init__(self, collection_name: str = COMPLIANCE_RESULTS_COLLECTION):
+        self.client = get_mongo_client()
+        self.collection = self.client[DB_NAME][collection_name]
+
+    def save_encoded(self, records: List[Tuple[str, bytes]], batch_size: int = MONGO_WRITE_BATCH_SIZE) -> int:
+        """Replace the records of these shipments with unordered bulk upserts.
+
+        Records arrive already BSON-encoded (by the worker processes), so they are written as
+        RawBSONDocument without being decoded and re-encoded here.
+        """
+        written = 0
+        for start in range(0, len(records), max(1, batch_size)):
+            operations = [ReplaceOne({"_id": key}, RawBSONDocument(raw), upsert=True)
+                          for key, raw in records[start:start + batch_size]]
+            result = self.collection.bulk_write(operations, ordered=False)
+            written += result.upserted_count + result.matched_count
+        return written
+
+    def get_results(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Stored records by invoice key (all of them when keys is None)"""
+        query = {} if keys is None else {"_id": {"$in": list(keys)}}
+        return {record["_id"]: record for record in self.collection.find(query)}
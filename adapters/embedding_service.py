@@ -0,0 +1,73 @@
+import json
+import threading
+from typing import Any, Dict, List
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from adapters.embedding_cache import embedding_key, get_embedding_cache
+from adapters.quota_scheduler import get_scheduler, estimate_tokens
+from config.settings import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_CHARS, EMBEDDING_CACHE_ENABLED
+
+# Extraction/source metadata, derived fields, the Mongo _id and the embedding itself are not embedded
+EMBEDDING_EXCLUDED_FIELDS = frozenset({
+    "extraction_timestamp", "source_filename", "source_sha256", "_id", "embedding", "canonical", "typed", "link_keys",
+})
+
+def document_text_for_embedding(data: Dict[str, Any]) -> str:
+    """The extracted fields of a document as JSON, without EMBEDDING_EXCLUDED_FIELDS.
+    Deterministic for the same data, so it also keys the local embedding cache."""
+    filtered = {k: v for k, v in data.items() if k not in EMBEDDING_EXCLUDED_FIELDS}
+    return json.dumps(filtered, ensure_ascii=False, indent=2)
+
+_models: Dict[str, GoogleGenerativeAIEmbeddings] = {}
+_models_lock = threading.Lock()
+
+def get_embeddings_model(task_type: str = "RETRIEVAL_DOCUMENT") -> GoogleGenerativeAIEmbeddings:
+    """Return the shared Gemini embeddings client for a task type, creating it on first use"""
+    with _models_lock:
+        if task_type not in _models:
+            _models[task_type] = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL, task_type=task_type)
+        return _models[task_type]
+
+def make_batches(texts: List[str], batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_chars: int = EMBEDDING_BATCH_MAX_CHARS) -> List[List[int]]:
+    """Group text indexes into batches bounded by item count and total characters"""
+    batches, current, current_chars = [], [], 0
+    for i, text in enumerate(texts):
+        if current and (len(current) >= batch_size or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(i)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+def embed_texts(texts: List[str], task_type: str = "RETRIEVAL_DOCUMENT", use_cache: bool = EMBEDDING_CACHE_ENABLED) -> List[List[float]]:
+    """Embed many texts with one embed_documents call per batch instead of one call per text.
+    Texts already in the local embedding cache are served from disk without an API call."""
+    keys = [embedding_key(EMBEDDING_MODEL, task_type, text) for text in texts]
+    cached = get_embedding_cache().get_many(keys) if use_cache else {}
+    vectors: List[List[float]] = [cached.get(key) for key in keys]
+
+    # Embed each distinct missing text once
+    missing = {}
+    for i, key in enumerate(keys):
+        if vectors[i] is None:
+            missing.setdefault(key, texts[i])
+    if missing:
+        missing_keys = list(missing)
+        missing_texts = [missing[key] for key in missing_keys]
+        model = get_embeddings_model(task_type)
+        fresh = {}
+        for batch in make_batches(missing_texts):
+            batch_texts = [missing_texts[i] for i in batch]
+            tokens = sum(estimate_tokens(text) for text in batch_texts)
+            embedded = get_scheduler().call("embedding", model.embed_documents, batch_texts, tokens=tokens)
+            for i, vector in zip(batch, embedded):
+                fresh[missing_keys[i]] = vector
+        if use_cache:
+            get_embedding_cache().put_many(fresh)
+        vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+    return vectors
+
+def embed_text(text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> List[float]:
+    return embed_texts([text], task_type)[0]
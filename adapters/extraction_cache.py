@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from config.settings import EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_MB, EXTRACTION_CACHE_MAX_AGE_DAYS
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 of the file contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def prompt_version(prompt: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    """Short hash of a system prompt and the settings that shape the extraction (models, page
+    rendering); editing any of them invalidates the cached extractions"""
+    if settings is not None:
+        prompt += json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+class ExtractionCache:
+    """SQLite-backed cache of extractor output, keyed by (file hash, document type, prompt version)
+
+    The prompt version also covers the models and page settings (see use_cases.extract.extraction_version).
+    """
+
+    def __init__(self, path: str = EXTRACTION_CACHE_PATH, max_mb: int = EXTRACTION_CACHE_MAX_MB,
+                 max_age_days: int = EXTRACTION_CACHE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                file_sha256 TEXT NOT NULL,
+                doc_type TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (file_sha256, doc_type, prompt_version)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_extractions_accessed ON extractions (accessed_at)")
+        self.conn.commit()
+
+    def get(self, file_hash: str, doc_type: str, version: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data, created_at FROM extractions WHERE file_sha256 = ? AND doc_type = ? AND prompt_version = ?",
+                (file_hash, doc_type, version)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_seconds:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                "UPDATE extractions SET accessed_at = ? WHERE file_sha256 = ? AND doc_type = ? AND prompt_version = ?",
+                (now, file_hash, doc_type, version)
+            )
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, file_hash: str, doc_type: str, version: str, data: Dict[str, Any]):
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (file_hash, doc_type, version, payload, len(payload), now, now)
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float):
+        """Drop expired entries, then least recently used ones until the cache fits in max_bytes"""
+        self.conn.execute("DELETE FROM extractions WHERE created_at < ?", (now - self.max_age_seconds,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute(
+            "SELECT file_sha256, doc_type, prompt_version, size FROM extractions ORDER BY accessed_at"
+        ).fetchall()
+        for file_hash, doc_type, version, size in rows:
+            if total <= self.max_bytes:
+                break
+            self.conn.execute(
+                "DELETE FROM extractions WHERE file_sha256 = ? AND doc_type = ? AND prompt_version = ?",
+                (file_hash, doc_type, version)
+            )
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM extractions").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,59 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+from langchain.schema import HumanMessage, SystemMessage
+from adapters.mongo_repository import MongoRepository
+from adapters.pdf_rasterizer import page_message_content
+from adapters.quota_scheduler import get_scheduler, estimate_message_tokens
+from entities.document import Document
+
+# Shared by the per-type extractors in fallbacks/extract_invoice2-5.py
+
+def _json_object(response_text: str) -> Dict[str, Any]:
+    """Parse the JSON object of a model response, dropping code fences and text around it"""
+    json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
+    if json_match:
+        response_text = json_match.group(1)
+    if not response_text.strip().startswith('{'):
+        first_brace = response_text.find('{')
+        if first_brace != -1:
+            response_text = response_text[first_brace:]
+    if not response_text.strip().endswith('}'):
+        last_brace = response_text.rfind('}')
+        if last_brace != -1:
+            response_text = response_text[:last_brace+1]
+    return json.loads(response_text)
+
+def extract_page_json(page: Dict[str, str], system_prompt: str, instruction: str, label: str,
+                      text_model, vision_model) -> Dict[str, Any]:
+    """Extract one page (image or text layer) with Gemini: text pages go to text_model, images to vision_model.
+
+    Failures come back as {"error", "partial_response"} instead of raised, so one bad page
+    does not lose the others (see the combine_page_results of each extractor).
+    """
+    messages = [SystemMessage(content=system_prompt), HumanMessage(content=page_message_content(instruction, page))]
+    response = None
+    try:
+        endpoint, model = ("text", text_model) if page.get("text") else ("vision", vision_model)
+        response = get_scheduler().call(endpoint, model.invoke, messages, tokens=estimate_message_tokens(messages))
+        return _json_object(response.content)
+    except Exception as e:
+        print(f"Error processing {label} with Gemini: {e}")
+        # No response when the call itself failed (e.g. the scheduler gave up retrying)
+        partial_response = response.content[:500] if response is not None else ""
+        print(f"Response content: {partial_response}...")
+        return {"error": str(e), "partial_response": partial_response}
+
+def save_extracted_document(data: Dict[str, Any], doc_type: str, collection_name: str,
+                            embedding: Optional[List[float]] = None) -> Optional[str]:
+    """Save extracted data (and its embedding) to MongoDB; returns the document id, or None on failure"""
+    try:
+        if embedding is not None:
+            # Kept on the returned data so find_similar_* reuses it instead of embedding the document again
+            data["embedding"] = embedding
+        # Upserted on (source_sha256, document_type) through the repository, so re-running a file does not duplicate it
+        doc = Document(doc_id=data.get("source_filename"), doc_type=doc_type, data=data, embedding=embedding)
+        return MongoRepository(collection_name).save_document(doc)
+    except Exception as e:
+        print(f"Error saving to MongoDB: {e}")
+        return None
@@ -0,0 +1,138 @@
+import csv
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from config.settings import HS_CODE_TABLE_PATH
+
+# File layout: header (magic, entry count, digest of the source table), then the entries sorted by
+# code as fixed-width records, then the UTF-8 descriptions the records point into.
+MAGIC = b"HSC1"
+HEADER = struct.Struct("<4sI16s")
+CODE_WIDTH = 12
+RECORD_DTYPE = np.dtype([("code", f"S{CODE_WIDTH}"), ("offset", "<u4"), ("length", "<u2")])
+
+CODE_COLUMNS = ("hs_code", "HS code", "HS Code", "code", "Code", "hscode")
+DESCRIPTION_COLUMNS = ("description", "Description", "desc", "goods_description")
+
+def normalize_hs_code(code) -> str:
+    return re.sub(r"\D", "", str(code or ""))
+
+def _column(fieldnames: List[str], candidates: Tuple[str, ...]) -> Optional[str]:
+    return next((name for name in candidates if name in fieldnames), None)
+
+def compile_hs_table(csv_path: str, out_path: str = HS_CODE_TABLE_PATH) -> int:
+    """Compile a tariff CSV (an HS code column, optionally a description column) into the binary table.
+
+    Codes are reduced to their digits, deduplicated (the first description wins) and sorted.
+    The file is written next to its destination and renamed into place, so readers never see
+    a partial table. Returns the number of entries.
+    """
+    entries = {}
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames or []
+        code_column = _column(fieldnames, CODE_COLUMNS) or (fieldnames[0] if fieldnames else None)
+        description_column = _column(fieldnames, DESCRIPTION_COLUMNS)
+        if code_column is None:
+            raise ValueError(f"No HS code column in {csv_path}")
+        for row in reader:
+            code = normalize_hs_code(row.get(code_column))
+            if not code or len(code) > CODE_WIDTH:
+                continue
+            entries.setdefault(code, (row.get(description_column) or "").strip() if description_column else "")
+
+    codes = sorted(entries)
+    records = np.zeros(len(codes), dtype=RECORD_DTYPE)
+    blob = bytearray()
+    for i, code in enumerate(codes):
+        text = entries[code].encode("utf-8")[:0xFFFF]
+        records[i] = (code.encode("ascii"), len(blob), len(text))
+        blob += text
+    digest = hashlib.sha256(records.tobytes() + bytes(blob)).digest()[:16]
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(codes), digest))
+        f.write(records.tobytes())
+        f.write(blob)
+    os.replace(tmp_path, out_path)
+    return len(codes)
+
+class HSCodeTable:
+    """Read-only view of a compiled HS table.
+
+    The file is memory-mapped and the records are read in place (np.frombuffer), so opening
+    it costs nothing up front and every process mapping the same file shares its pages.
+    Lookups are binary searches over the sorted codes: O(log n), no per-process dict.
+    """
+
+    def __init__(self, path: str = HS_CODE_TABLE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, digest = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled HS code table")
+        self.digest = digest.hex()
+        self.records = np.frombuffer(self._map, dtype=RECORD_DTYPE, count=count, offset=HEADER.size)
+        self.codes = self.records["code"]
+        self._text_start = HEADER.size + count * RECORD_DTYPE.itemsize
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _description(self, index: int) -> str:
+        start = self._text_start + int(self.records["offset"][index])
+        return self._map[start:start + int(self.records["length"][index])].decode("utf-8")
+
+    def _first_at_or_after(self, code: str) -> int:
+        return int(np.searchsorted(self.codes, code.encode("ascii")))
+
+    def get(self, code: str) -> Optional[str]:
+        """Description of exactly this code, or None when it is not in the table"""
+        code = normalize_hs_code(code)
+        if not code or len(code) > CODE_WIDTH:
+            return None
+        index = self._first_at_or_after(code)
+        if index < len(self.codes) and self.codes[index] == code.encode("ascii"):
+            return self._description(index)
+        return None
+
+    def has_prefix(self, prefix: str) -> bool:
+        """Whether any code in the table starts with prefix"""
+        prefix = normalize_hs_code(prefix)
+        if not prefix or len(prefix) > CODE_WIDTH:
+            return False
+        index = self._first_at_or_after(prefix)
+        return index < len(self.codes) and bytes(self.codes[index]).startswith(prefix.encode("ascii"))
+
+    def longest_prefix(self, code: str, min_length: int = 1) -> Optional[Tuple[str, str]]:
+        """The longest prefix of code that is itself in the table, as (code, description)"""
+        code = normalize_hs_code(code)[:CODE_WIDTH]
+        for length in range(len(code), min_length - 1, -1):
+            description = self.get(code[:length])
+            if description is not None:
+                return code[:length], description
+        return None
+
+    def close(self):
+        self.records = self.codes = None
+        self._map.close()
+
+_table: Optional[HSCodeTable] = None
+_table_lock = threading.Lock()
+
+def get_hs_table(path: str = HS_CODE_TABLE_PATH) -> Optional[HSCodeTable]:
+    """The process-wide table, or None when no compiled table exists at HS_CODE_TABLE_PATH"""
+    global _table
+    if _table is None:
+        with _table_lock:
+            if _table is None and os.path.exists(path):
+                _table = HSCodeTable(path)
+    return _table
@@ -1,5 +1,6 @@
 from langchain_google_genai import GoogleGenerativeAI
 from langchain.prompts import PromptTemplate
+from adapters.quota_scheduler import get_scheduler, estimate_tokens, INTERACTIVE
 import os
 from dotenv import load_dotenv
 
@@ -7,7 +8,8 @@ class LLMService:
     def __init__(self, model_name: str = "gemini-1.5-pro"):
         load_dotenv()
         self.api_key = os.getenv("GOOGLE_API_KEY")
-        self.llm = GoogleGenerativeAI(model=model_name, google_api_key=self.api_key)
+        # Retries are handled by the quota scheduler
+        self.llm = GoogleGenerativeAI(model=model_name, google_api_key=self.api_key, max_retries=0)
 
     def generate_report(self, prompt_template: str, context: dict) -> str:
         prompt = PromptTemplate(
@@ -15,4 +17,6 @@ class LLMService:
             template=prompt_template
         )
         chain = prompt | self.llm
-        return chain.invoke(context) 
\ No newline at end of file
+        # Reports are interactive, so they jump ahead of bulk extraction when quota is tight
+        tokens = estimate_tokens(prompt.format(**context))
+        return get_scheduler().call("report", chain.invoke, context, tokens=tokens, priority=INTERACTIVE) 
\ No newline at end of file
@@ -0,0 +1,46 @@
+import threading
+from typing import Optional
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from config.settings import (
+    MONGO_URI, DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS
+)
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+def get_mongo_client() -> MongoClient:
+    """Return the process-wide pooled client, creating it on first use.
+
+    MongoClient is thread-safe and keeps its own connection pool, so every adapter shares
+    this one instance instead of paying connection setup (TLS, server selection) per call.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    MONGO_URI,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                )
+    return _client
+
+def get_database(db_name: str = DB_NAME) -> Database:
+    return get_mongo_client()[db_name]
+
+def get_collection(collection_name: str, db_name: str = DB_NAME) -> Collection:
+    return get_database(db_name)[collection_name]
+
+def close_mongo_client():
+    """Close the shared client (the next get_mongo_client call opens a new one)"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -1,35 +1,232 @@
 from entities.document import Document
-from typing import List, Dict, Any
-import pymongo
-import os
-from dotenv import load_dotenv
+from adapters.vector_codec import encode_vector, decode_vector
+from adapters.vector_index import get_vector_index, similar_doc_metadata
+from adapters.mongo_client import get_mongo_client
+from config.settings import DB_NAME, MONGO_WRITE_BATCH_SIZE, MONGO_READ_BATCH_SIZE
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from bson import ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+import threading
+
+# Natural key of an extracted document: the same PDF extracted as the same type is one record
+NATURAL_KEY_FIELDS = ("source_sha256", "document_type")
+
+# Normalized link keys stored under data["link_keys"] at ingest (see use_cases.compliance.compute_link_keys)
+LINK_KEY_FIELDS = ("invoice_no", "dec_no", "crn_no", "bill_no")
+
+_indexed_collections = set()
+_indexed_lock = threading.Lock()
 
 #replace the collection name with the one you want to use
 class MongoRepository:
     def __init__(self, collection_name: str = "invoices-test"):
-        load_dotenv()
-        self.mongo_uri = os.getenv("MONGO_URI")
-        self.db_name = "document_compliance" #You can change the database name to any other name.
+        self.db_name = DB_NAME #You can change the database name in config/settings.py
         self.collection_name = collection_name
-        self.client = pymongo.MongoClient(self.mongo_uri)
+        # Shared pooled client: creating repositories is cheap and opens no new connections
+        self.client = get_mongo_client()
         self.db = self.client[self.db_name]
         self.collection = self.db[self.collection_name]
 
-    def get_documents(self, filter_dict: Dict[str, Any] = None) -> List[Document]:
-        filter_dict = filter_dict or {}
-        docs = []
-        for doc in self.collection.find(filter_dict):
-            docs.append(Document(
+    def ensure_indexes(self):
+        """Create the natural-key unique index and the lookup indexes once per collection and process"""
+        key = (self.db_name, self.collection_name)
+        with _indexed_lock:
+            if key in _indexed_collections:
+                return
+            try:
+                # Partial, so legacy documents without a source hash are not constrained
+                self.collection.create_index(
+                    [(field, 1) for field in NATURAL_KEY_FIELDS],
+                    name="natural_key",
+                    unique=True,
+                    partialFilterExpression={"source_sha256": {"$exists": True}},
+                )
+            except Exception as e:
+                # e.g. duplicates written before upserts existed; writes still upsert, just without the guarantee
+                print(f"Could not create natural key index on {self.collection_name}: {e}")
+            for field in LINK_KEY_FIELDS:
+                self.collection.create_index(f"link_keys.{field}", name=f"link_keys_{field}", sparse=True)
+            self.collection.create_index("typed.invoice_date", name="typed_invoice_date", sparse=True)
+            _indexed_collections.add(key)
+
+    def backfill_derived_fields(self, batch_size: int = MONGO_WRITE_BATCH_SIZE) -> int:
+        """Store the derived fields on documents saved before they existed (no link_keys).
+
+        Indexed shipment lookups (find_shipment) only see documents with link keys. Updates are
+        $set-only bulk writes, so nothing else in the documents changes. Returns the count updated.
+        """
+        from use_cases.compliance import derived_fields
+        self.ensure_indexes()
+        updated, operations = 0, []
+        for doc in self.iter_documents({"link_keys": {"$exists": False}}):
+            operations.append(UpdateOne({"_id": doc.data["_id"]}, {"$set": derived_fields(doc.data)}))
+            if len(operations) >= batch_size:
+                updated += self.collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations:
+            updated += self.collection.bulk_write(operations, ordered=False).modified_count
+        return updated
+
+    def _projection(self, include_embedding: bool, fields: Optional[Iterable[str]]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Build a find() projection and the aliases used for field names a projection path cannot address"""
+        if fields is None:
+            return ({} if include_embedding else {"embedding": 0}), {}
+        projection: Dict[str, Any] = {"document_type": 1}
+        aliases = {}
+        for field in fields:
+            if "." in field or field.startswith("$"):
+                # Keys such as "Invoice No." would be read as a nested path, so fetch them by literal name
+                alias = f"_field{len(aliases)}"
+                projection[alias] = {"$getField": {"field": {"$literal": field}, "input": "$$ROOT"}}
+                aliases[alias] = field
+            else:
+                projection[field] = 1
+        if include_embedding:
+            projection["embedding"] = 1
+        return projection, aliases
+
+    def iter_documents(self, filter_dict: Dict[str, Any] = None, include_embedding: bool = False,
+                       fields: Optional[Iterable[str]] = None, batch_size: int = MONGO_READ_BATCH_SIZE) -> Iterator[Document]:
+        """Stream documents from a cursor. Embeddings are left out unless requested; `fields` limits
+        the document to those top-level fields (plus _id and document_type)."""
+        projection, aliases = self._projection(include_embedding, fields)
+        cursor = self.collection.find(filter_dict or {}, projection or None, batch_size=batch_size)
+        for doc in cursor:
+            for alias, field in aliases.items():
+                if alias in doc:
+                    doc[field] = doc.pop(alias)
+            # The embedding lives on Document.embedding only, so it never ends up in report prompts
+            embedding = doc.pop("embedding", None)
+            yield Document(
                 doc_id=str(doc.get("_id")),
                 doc_type=doc.get("document_type", "unknown"),
                 data=doc,
-                embedding=doc.get("embedding")
-            ))
-        return docs
+                embedding=decode_vector(embedding)
+            )
+
+    def get_documents(self, filter_dict: Dict[str, Any] = None, include_embedding: bool = False,
+                      fields: Optional[Iterable[str]] = None, batch_size: int = MONGO_READ_BATCH_SIZE) -> List[Document]:
+        return list(self.iter_documents(filter_dict, include_embedding, fields, batch_size))
+
+    def get_documents_by_id(self, doc_ids: Iterable[str], include_embedding: bool = False) -> Dict[str, Document]:
+        """Fetch documents by their string ids in one query, keyed by doc_id"""
+        ids = [ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id for doc_id in doc_ids]
+        if not ids:
+            return {}
+        return {doc.doc_id: doc for doc in self.iter_documents({"_id": {"$in": ids}}, include_embedding)}
+
+    def find_shipment(self, invoice_key: str, include_embedding: bool = False) -> List[Document]:
+        """Fetch an invoice by its normalized number and the documents its DEC/CRN/bill keys point to.
 
-    def save_document(self, doc: Document):
+        Uses equality queries on the link-key indexes; the invoice(s) come first in the result.
+        """
+        self.ensure_indexes()
+        invoices = self.get_documents({"link_keys.invoice_no": invoice_key}, include_embedding)
+        clauses = []
+        for field in ("dec_no", "crn_no", "bill_no"):
+            values = sorted({doc.data.get("link_keys", {}).get(field) for doc in invoices} - {None})
+            if values:
+                clauses.append({f"link_keys.{field}": {"$in": values}})
+        if not clauses:
+            return invoices
+        invoice_ids = [doc.data["_id"] for doc in invoices]
+        related = self.get_documents({"$or": clauses, "_id": {"$nin": invoice_ids}}, include_embedding)
+        return invoices + related
+
+    def link_key_values(self, field: str, filter_dict: Dict[str, Any] = None) -> List[str]:
+        """Every distinct stored value of one link key, over the documents matching filter_dict"""
+        self.ensure_indexes()
+        return [value for value in self.collection.distinct(f"link_keys.{field}", filter_dict or {}) if value]
+
+    def _write_data(self, doc: Document) -> Dict[str, Any]:
         data = doc.data.copy()
-        if doc.embedding:
-            data["embedding"] = doc.embedding
-        result = self.collection.insert_one(data)
-        return str(result.inserted_id) 
\ No newline at end of file
+        data.pop("_id", None)
+        data.pop("embedding", None)
+        data.setdefault("document_type", doc.doc_type)
+        # Recomputed from the raw data on every write, so the stored canonical/typed blocks and link
+        # keys never lag behind edited fields, the current schema, or documents from the fallback scripts
+        from use_cases.compliance import derived_fields
+        data.update(derived_fields(data))
+        if doc.embedding is not None:
+            data["embedding"] = encode_vector(doc.embedding)
+        return data
+
+    def save_documents(self, docs: List[Document], batch_size: int = MONGO_WRITE_BATCH_SIZE) -> Dict[str, int]:
+        """Write documents with unordered bulk upserts keyed on (source_sha256, document_type).
+
+        Re-ingesting a file replaces its existing record instead of adding a duplicate, so keys
+        from an earlier extraction do not survive; the stored embedding is kept when the new
+        data comes without one. Documents without a source hash are inserted. Each Document's
+        doc_id is set to its MongoDB _id.
+        """
+        self.ensure_indexes()
+        stats = {"inserted": 0, "upserted": 0, "updated": 0}
+        for start in range(0, len(docs), max(1, batch_size)):
+            batch = docs[start:start + batch_size]
+            payloads = [self._write_data(doc) for doc in batch]
+            self._carry_over_embeddings(payloads)
+            operations, op_keys, positions = [], [], {}
+            for data in payloads:
+                if not data.get("source_sha256"):
+                    operations.append(InsertOne(data))
+                    op_keys.append(None)
+                    continue
+                key = tuple(data[field] for field in NATURAL_KEY_FIELDS)
+                if key in positions:
+                    # The same file twice in one batch: the last copy wins
+                    operations[positions[key]] = ReplaceOne(dict(zip(NATURAL_KEY_FIELDS, key)), data, upsert=True)
+                    continue
+                positions[key] = len(operations)
+                operations.append(ReplaceOne(dict(zip(NATURAL_KEY_FIELDS, key)), data, upsert=True))
+                op_keys.append(key)
+            result = self.collection.bulk_write(operations, ordered=False)
+            stats["inserted"] += result.inserted_count
+            stats["upserted"] += result.upserted_count
+            stats["updated"] += result.matched_count
+            self._assign_ids(batch, payloads, op_keys, result.upserted_ids)
+            self._index_embeddings(batch, payloads)
+        return stats
+
+    def _carry_over_embeddings(self, payloads: List[Dict[str, Any]]):
+        """Copy the stored (encoded) embedding into keyed payloads that have none, in one query per batch"""
+        def key_of(data):
+            return tuple(data.get(field) for field in NATURAL_KEY_FIELDS)
+
+        missing = [data for data in payloads if data.get("source_sha256") and "embedding" not in data]
+        if not missing:
+            return
+        keys = {key_of(data) for data in missing}
+        stored = {}
+        query = {"$or": [dict(zip(NATURAL_KEY_FIELDS, key)) for key in keys], "embedding": {"$exists": True}}
+        for row in self.collection.find(query, {"embedding": 1, **{field: 1 for field in NATURAL_KEY_FIELDS}}):
+            stored[key_of(row)] = row["embedding"]
+        for data in missing:
+            if key_of(data) in stored:
+                data["embedding"] = stored[key_of(data)]
+
+    def _assign_ids(self, docs: List[Document], payloads: List[Dict[str, Any]], op_keys: List[Tuple],
+                    upserted_ids: Dict[int, Any]):
+        # InsertOne fills in data["_id"]; upserts report new ids by position; matched ones are looked up by key
+        ids = {op_keys[i]: _id for i, _id in upserted_ids.items()}
+        matched = [dict(zip(NATURAL_KEY_FIELDS, key)) for key in op_keys if key is not None and key not in ids]
+        if matched:
+            for row in self.collection.find({"$or": matched}, {field: 1 for field in NATURAL_KEY_FIELDS}):
+                ids[tuple(row.get(field) for field in NATURAL_KEY_FIELDS)] = row["_id"]
+        for doc, data in zip(docs, payloads):
+            if data.get("source_sha256"):
+                doc_id = ids.get(tuple(data[field] for field in NATURAL_KEY_FIELDS))
+            else:
+                doc_id = data.get("_id")
+            if doc_id is not None:
+                doc.doc_id = str(doc_id)
+
+    def _index_embeddings(self, docs: List[Document], payloads: List[Dict[str, Any]]):
+        items = [(doc.doc_id, doc.embedding, similar_doc_metadata(data))
+                 for doc, data in zip(docs, payloads) if doc.embedding is not None]
+        if items:
+            # No-op for Atlas, which indexes the collection itself; the local index is updated incrementally
+            get_vector_index(self.collection).add_many(items)
+
+    def save_document(self, doc: Document) -> str:
+        self.save_documents([doc])
+        return doc.doc_id
@@ -0,0 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+from config.settings import PAGE_CONCURRENCY
+
+def map_pages(func: Callable[[Any], Any], pages: Sequence[Any], max_workers: Optional[int] = None) -> List[Any]:
+    """Run func on every page with bounded concurrency and return the results in page order"""
+    max_workers = max_workers or PAGE_CONCURRENCY
+    if max_workers <= 1 or len(pages) <= 1:
+        return [func(page) for page in pages]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+        # executor.map yields results in submission order, so page order is preserved
+        return list(executor.map(func, pages))
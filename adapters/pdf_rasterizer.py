@@ -0,0 +1,125 @@
+import base64
+import mmap
+import os
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Union
+import fitz  # PyMuPDF
+from PIL import Image
+from adapters.text_layer import page_text_layer
+from config.settings import TEXT_LAYER_ENABLED
+
+PdfSource = Union[str, os.PathLike, bytes, bytearray, memoryview]
+
+# Render settings per document type. The old pipeline used fitz.Matrix(2, 2), i.e. 144 DPI PNG.
+# Printed documents compress well as JPEG; the handwritten waybill keeps a higher resolution.
+RENDER_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": {"dpi": 144, "format": "png", "quality": 90},
+    "leminar_invoice": {"dpi": 144, "format": "jpeg", "quality": 85},
+    "western_express": {"dpi": 200, "format": "jpeg", "quality": 90},
+    "customs_certificate": {"dpi": 144, "format": "jpeg", "quality": 85},
+    "customs_declaration": {"dpi": 144, "format": "jpeg", "quality": 85},
+    "ocr": {"dpi": 300, "format": "jpeg", "quality": 90},
+}
+
+MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+def get_render_profile(doc_type: Optional[str] = None) -> Dict[str, Any]:
+    """Return the render settings for a document type, falling back to the default profile"""
+    return RENDER_PROFILES.get(doc_type or "default", RENDER_PROFILES["default"])
+
+@contextmanager
+def open_pdf(source: PdfSource) -> Iterator[fitz.Document]:
+    """Open a PDF from a path (memory-mapped, no copy) or from an in-memory bytes buffer"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        doc = fitz.open(stream=source, filetype="pdf")
+        try:
+            yield doc
+        finally:
+            doc.close()
+        return
+    with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            doc = fitz.open(stream=view, filetype="pdf")
+            try:
+                yield doc
+            finally:
+                doc.close()
+        finally:
+            # The view must be released before the mapping can be closed
+            view.release()
+
+def render_page(page: fitz.Page, dpi: int = 144, image_format: str = "png", quality: int = 90) -> bytes:
+    """Render a single page straight to encoded image bytes, without touching the filesystem"""
+    image_format = image_format.lower()
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    if image_format == "png":
+        return pix.tobytes("png")
+    if image_format in ("jpeg", "jpg"):
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if image_format == "webp":
+        # MuPDF cannot encode WebP, so hand the raw samples to Pillow
+        buffer = BytesIO()
+        pixmap_to_image(pix).save(buffer, format="WEBP", quality=quality)
+        return buffer.getvalue()
+    raise ValueError(f"Unsupported image format: {image_format}")
+
+def pixmap_to_image(pix: fitz.Pixmap) -> Image.Image:
+    """Wrap a pixmap's samples in a PIL image"""
+    mode = "RGB" if pix.n >= 3 else "L"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+def render_page_image(page: fitz.Page, dpi: int = 300) -> Image.Image:
+    """Render a page to a PIL image (used by the OCR experiments in ocr-test)"""
+    return pixmap_to_image(page.get_pixmap(dpi=dpi, alpha=False))
+
+def pdf_page_count(source: PdfSource) -> int:
+    with open_pdf(source) as doc:
+        return doc.page_count
+
+def _image_payload(page: fitz.Page, profile: Dict[str, Any]) -> Dict[str, str]:
+    image_format = profile["format"].lower().replace("jpg", "jpeg")
+    image_bytes = render_page(page, profile["dpi"], image_format, profile["quality"])
+    return {
+        "image": base64.b64encode(image_bytes).decode("utf-8"),
+        "mime_type": MIME_TYPES[image_format],
+    }
+
+def rasterize_pdf(source: PdfSource, doc_type: Optional[str] = None) -> List[Dict[str, str]]:
+    """Render every page of a PDF to base64 image payloads ready for the Gemini vision API"""
+    profile = get_render_profile(doc_type)
+    with open_pdf(source) as doc:
+        return [_image_payload(page, profile) for page in doc]
+
+def load_pdf_pages(source: PdfSource, doc_type: Optional[str] = None, use_text_layer: bool = TEXT_LAYER_ENABLED) -> List[Dict[str, str]]:
+    """Prepare every page for extraction: born-digital pages as {"text"}, scanned pages as {"image", "mime_type"}"""
+    profile = get_render_profile(doc_type)
+    pages = []
+    with open_pdf(source) as doc:
+        for page in doc:
+            text = page_text_layer(page) if use_text_layer else None
+            pages.append({"text": text} if text else _image_payload(page, profile))
+    return pages
+
+def rasterize_pdf_images(source: PdfSource, dpi: int = 300) -> List[Image.Image]:
+    """Render every page of a PDF to PIL images (drop-in replacement for pdf2image.convert_from_path)"""
+    with open_pdf(source) as doc:
+        return [render_page_image(page, dpi) for page in doc]
+
+def page_data_url(page: Dict[str, str]) -> str:
+    """Build the data URL for a rasterized page payload"""
+    return f"data:{page['mime_type']};base64,{page['image']}"
+
+def page_message_content(instruction: str, page: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Build the human message content for a page: its text layer if it has one, otherwise the image"""
+    if page.get("text"):
+        return [{"type": "text", "text": f"{instruction} The document text (extracted from the PDF text layer) follows:\n\n{page['text']}"}]
+    return [
+        {"type": "text", "text": instruction},
+        {"type": "image_url", "image_url": {"url": page_data_url(page)}}
+    ]
@@ -0,0 +1,170 @@
+import itertools
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from config.settings import (
+    QUOTA_LIMITS, QUOTA_GLOBAL_RPM, QUOTA_MAX_RETRIES, QUOTA_BACKOFF_BASE_SECONDS, QUOTA_BACKOFF_MAX_SECONDS
+)
+
+# Priority classes: lower value is served first when callers compete for quota
+INTERACTIVE = 0
+BULK = 1
+
+# Gemini bills an image as a fixed number of tokens regardless of its resolution
+IMAGE_TOKENS = 258
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded")
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for rate limiting"""
+    return len(text) // 4 + 1
+
+def estimate_message_tokens(messages: List[Any]) -> int:
+    """Estimate the prompt tokens of a list of LangChain messages, counting images at a flat rate"""
+    total = 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, str):
+                total += estimate_tokens(part)
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+            else:
+                total += estimate_tokens(str(part.get("text", "")))
+    return total
+
+def is_retryable(error: Exception) -> bool:
+    """True for rate-limit (429) and transient server (5xx) errors"""
+    for attr in ("code", "status_code", "status"):
+        value = getattr(error, attr, None)
+        if callable(value):
+            continue
+        if isinstance(value, int) and value in RETRYABLE_STATUS_CODES:
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    names = [cls.__name__ for cls in type(error).__mro__]
+    if any(name in names for name in RETRYABLE_ERROR_NAMES):
+        return True
+    message = str(error)
+    return any(marker in message for marker in ("429", "Resource has been exhausted", "503", "500 Internal"))
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute` units per minute"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)"""
+        self._refill(now)
+        # Requests bigger than the whole bucket are allowed once it is full, otherwise they would never run
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+class _Waiter:
+    def __init__(self, endpoint: str, priority: int, seq: int):
+        self.endpoint = endpoint
+        self.priority = priority
+        self.seq = seq
+
+class QuotaScheduler:
+    """Process-wide rate limiter for Gemini calls.
+
+    Each endpoint (vision, text, embedding, report) has its own requests-per-minute and
+    tokens-per-minute buckets, and every call also draws from a key-wide request bucket.
+    Callers of a higher priority class are served first; within a class, calls to the same
+    endpoint are served in arrival order. 429/5xx errors are retried with jittered
+    exponential backoff.
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, int]] = None, global_rpm: int = QUOTA_GLOBAL_RPM,
+                 max_retries: int = QUOTA_MAX_RETRIES, backoff_base: float = QUOTA_BACKOFF_BASE_SECONDS,
+                 backoff_max: float = QUOTA_BACKOFF_MAX_SECONDS):
+        limits = limits or QUOTA_LIMITS
+        self.requests = {name: TokenBucket(limit["rpm"]) for name, limit in limits.items()}
+        self.tokens = {name: TokenBucket(limit["tpm"]) for name, limit in limits.items()}
+        self.global_requests = TokenBucket(global_rpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+
+    def _is_next(self, waiter: _Waiter) -> bool:
+        for other in self._waiters:
+            if other.priority < waiter.priority:
+                return False
+            if other.priority == waiter.priority and other.endpoint == waiter.endpoint and other.seq < waiter.seq:
+                return False
+        return True
+
+    def acquire(self, endpoint: str, tokens: int = 1, priority: int = BULK):
+        """Block until the endpoint has quota for one request of `tokens` tokens, then take it"""
+        if endpoint not in self.requests:
+            raise ValueError(f"Unknown quota endpoint: {endpoint}")
+        with self._cond:
+            waiter = _Waiter(endpoint, priority, next(self._seq))
+            self._waiters.append(waiter)
+            try:
+                while True:
+                    wait = 1.0
+                    if self._is_next(waiter):
+                        now = time.monotonic()
+                        wait = max(
+                            self.requests[endpoint].wait_time(1, now),
+                            self.tokens[endpoint].wait_time(tokens, now),
+                            self.global_requests.wait_time(1, now),
+                        )
+                        if wait == 0:
+                            self.requests[endpoint].consume(1)
+                            self.tokens[endpoint].consume(tokens)
+                            self.global_requests.consume(1)
+                            return
+                    self._cond.wait(timeout=min(wait, 1.0))
+            finally:
+                self._waiters.remove(waiter)
+                self._cond.notify_all()
+
+    def call(self, endpoint: str, fn: Callable[..., Any], *args, tokens: int = 1, priority: int = BULK, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) within the endpoint's quota, retrying rate-limit and server errors"""
+        for attempt in range(self.max_retries + 1):
+            self.acquire(endpoint, tokens, priority)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # Full jitter keeps concurrent workers from retrying in lockstep
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                print(f"{endpoint} call failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+_scheduler: Optional[QuotaScheduler] = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> QuotaScheduler:
+    """Return the process-wide scheduler, creating it on first use"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = QuotaScheduler()
+    return _scheduler
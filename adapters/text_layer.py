@@ -0,0 +1,34 @@
+from typing import Optional
+import fitz  # PyMuPDF
+from config.settings import TEXT_LAYER_MIN_CHARS
+
+# A page whose images cover more than this share of its area is treated as a scan,
+# even if it carries a (usually unreliable) OCR text layer
+MAX_IMAGE_COVERAGE = 0.5
+# Share of unmappable glyphs (U+FFFD) above which the text layer is considered garbage
+MAX_UNREADABLE_RATIO = 0.05
+
+def page_text_layer(page: fitz.Page, min_chars: int = TEXT_LAYER_MIN_CHARS) -> Optional[str]:
+    """Return the page text if the page is born-digital, or None if it needs the vision model"""
+    layout = page.get_text("dict", sort=True)
+    page_area = abs(page.rect) or 1.0
+    image_area = 0.0
+    lines = []
+    for block in layout["blocks"]:
+        if block["type"] == 1:
+            image_area += abs(fitz.Rect(block["bbox"]) & page.rect)
+            continue
+        for line in block["lines"]:
+            text = "".join(span["text"] for span in line["spans"]).strip()
+            if text:
+                lines.append(text)
+        lines.append("")
+
+    text = "\n".join(lines).strip()
+    chars = sum(1 for c in text if not c.isspace())
+    # A page without any text has no text layer, even when TEXT_LAYER_MIN_CHARS is 0
+    if chars == 0 or chars < min_chars or image_area / page_area > MAX_IMAGE_COVERAGE:
+        return None
+    if text.count("�") / chars > MAX_UNREADABLE_RATIO:
+        return None
+    return text
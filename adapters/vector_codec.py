@@ -0,0 +1,55 @@
+import struct
+from typing import Any, List, Optional
+import numpy as np
+from bson.binary import Binary
+from config.settings import EMBEDDING_STORAGE
+
+# BSON BinData vector (subtype 9): a dtype byte and a padding byte, followed by the packed values
+VECTOR_SUBTYPE = 9
+FLOAT32_DTYPE = 0x27
+INT8_DTYPE = 0x03
+
+def to_float32(vector: Any) -> Optional[np.ndarray]:
+    """Coerce a list, array or BSON vector to a contiguous float32 array (None stays None)"""
+    if vector is None:
+        return None
+    if isinstance(vector, Binary):
+        return decode_vector(vector)
+    return np.ascontiguousarray(vector, dtype=np.float32)
+
+def quantize_int8(vector: np.ndarray) -> np.ndarray:
+    """Scale a vector into int8 range. The per-vector scale is dropped, so only cosine similarity is preserved"""
+    peak = float(np.max(np.abs(vector))) if vector.size else 0.0
+    if peak == 0.0:
+        return np.zeros(vector.shape, dtype=np.int8)
+    return np.clip(np.rint(vector * (127.0 / peak)), -127, 127).astype(np.int8)
+
+def encode_vector(vector: Any, storage: str = EMBEDDING_STORAGE) -> Binary:
+    """Pack an embedding into a BSON BinData vector: "float32" (4 bytes/dim) or "int8" (1 byte/dim)"""
+    values = to_float32(vector)
+    if storage == "float32":
+        header, body = struct.pack("<BB", FLOAT32_DTYPE, 0), values.astype("<f4").tobytes()
+    elif storage == "int8":
+        header, body = struct.pack("<BB", INT8_DTYPE, 0), quantize_int8(values).tobytes()
+    else:
+        raise ValueError(f"Unsupported embedding storage: {storage}")
+    return Binary(header + body, VECTOR_SUBTYPE)
+
+def decode_vector(value: Any) -> Optional[np.ndarray]:
+    """Read an embedding stored either as a BSON vector or as a legacy array of doubles"""
+    if value is None:
+        return None
+    if not isinstance(value, Binary):
+        return np.asarray(value, dtype=np.float32)
+    if value.subtype != VECTOR_SUBTYPE:
+        raise ValueError(f"Unexpected BinData subtype for an embedding: {value.subtype}")
+    dtype = value[0]
+    if dtype == FLOAT32_DTYPE:
+        return np.frombuffer(value, dtype="<f4", offset=2).astype(np.float32, copy=False)
+    if dtype == INT8_DTYPE:
+        return np.frombuffer(value, dtype=np.int8, offset=2).astype(np.float32)
+    raise ValueError(f"Unsupported BSON vector dtype: {dtype:#04x}")
+
+def query_vector(vector: Any) -> List[float]:
+    """Plain list of floats for a $vectorSearch queryVector"""
+    return to_float32(vector).tolist()
@@ -0,0 +1,305 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from adapters.vector_codec import query_vector, to_float32
+from config.settings import (
+    VECTOR_BACKEND, VECTOR_INDEX_NAME, VECTOR_NUM_CANDIDATES, VECTOR_SEARCH_CONCURRENCY, LOCAL_VECTOR_INDEX_PATH,
+    LOCAL_VECTOR_INDEX_IVF_MIN_ROWS, LOCAL_VECTOR_INDEX_NPROBE
+)
+
+# Fields returned for every neighbor (the same projection the RAG report has always used)
+SIMILAR_DOC_FIELDS = ["invoice_number", "invoice_date", "total_amount", "shipper", "consignee"]
+
+def similar_doc_metadata(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {field: data[field] for field in SIMILAR_DOC_FIELDS if field in data}
+
+class VectorIndex:
+    """Nearest-neighbor search over document embeddings"""
+
+    def add(self, doc_id: str, vector: Any, metadata: Dict[str, Any]):
+        """Index one document. Re-adding a doc_id replaces its previous vector."""
+        raise NotImplementedError
+
+    def add_many(self, items: Iterable[Tuple[str, Any, Dict[str, Any]]]):
+        """Index several (doc_id, vector, metadata) rows"""
+        for doc_id, vector, metadata in items:
+            self.add(doc_id, vector, metadata)
+
+    def search(self, vector: Any, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Return up to top_k neighbors as metadata dicts with "_id" and a cosine "score" in [0, 1]"""
+        raise NotImplementedError
+
+    def search_many(self, vectors: List[Any], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Run several searches at once; the neighbor lists come back in query order"""
+        return [self.search(vector, top_k) for vector in vectors]
+
+class AtlasVectorIndex(VectorIndex):
+    """MongoDB Atlas $vectorSearch over the documents collection"""
+
+    def __init__(self, collection, index_name: str = VECTOR_INDEX_NAME, num_candidates: int = VECTOR_NUM_CANDIDATES):
+        self.collection = collection
+        self.index_name = index_name
+        self.num_candidates = num_candidates
+
+    def add(self, doc_id: str, vector: Any, metadata: Dict[str, Any]):
+        # Atlas indexes the embedding field of the saved document on its own
+        pass
+
+    def search(self, vector: Any, top_k: int = 3) -> List[Dict[str, Any]]:
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": "embedding",
+                    "queryVector": query_vector(vector),
+                    "numCandidates": max(self.num_candidates, top_k),
+                    "limit": top_k
+                }
+            },
+            {
+                "$project": {
+                    **{field: 1 for field in SIMILAR_DOC_FIELDS},
+                    "score": {"$meta": "vectorSearchScore"}
+                }
+            }
+        ]
+        return list(self.collection.aggregate(pipeline))
+
+    def search_many(self, vectors: List[Any], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        # The queries share the collection's connection pool and run concurrently
+        if len(vectors) <= 1:
+            return [self.search(vector, top_k) for vector in vectors]
+        with ThreadPoolExecutor(max_workers=min(len(vectors), VECTOR_SEARCH_CONCURRENCY)) as executor:
+            return list(executor.map(lambda vector: self.search(vector, top_k), vectors))
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+def _spherical_kmeans(vectors: np.ndarray, nlist: int, iterations: int = 10, sample_size: int = 64, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors into nlist centroids, training on a sample of at most nlist*sample_size rows"""
+    rng = np.random.default_rng(seed)
+    sample_rows = np.sort(rng.choice(len(vectors), min(len(vectors), nlist * sample_size), replace=False))
+    sample = np.asarray(vectors[sample_rows])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        # Empty clusters keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, sums, centroids)
+        centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+class LocalVectorIndex(VectorIndex):
+    """On-disk vector index that needs no Atlas cluster.
+
+    Unit-normalized float32 vectors are appended to vectors.f32 and read back through a
+    memory map; rows.jsonl holds each row's doc_id and metadata. Small indexes are searched
+    exactly with one matrix-vector product. Once build() has trained IVF partitions
+    (spherical k-means), searches only score the rows of the nprobe closest partitions,
+    plus any rows added since the last build. Scores follow Atlas' cosine scale, (1 + cos) / 2.
+    """
+
+    def __init__(self, path: str = LOCAL_VECTOR_INDEX_PATH, ivf_min_rows: int = LOCAL_VECTOR_INDEX_IVF_MIN_ROWS,
+                 nprobe: int = LOCAL_VECTOR_INDEX_NPROBE):
+        self.path = path
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._rows_path = os.path.join(path, "rows.jsonl")
+        self._manifest_path = os.path.join(path, "manifest.json")
+        self._ivf_path = os.path.join(path, "ivf.npz")
+        self._load()
+
+    def _load(self):
+        manifest = {"dims": None, "count": 0, "ivf_rows": 0}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                manifest.update(json.load(f))
+        self.dims = manifest["dims"]
+        self.count = manifest["count"]
+        # Rows written after the last manifest update (e.g. an interrupted add) are ignored
+        self.rows: List[Dict[str, Any]] = []
+        truncated = False
+        if os.path.exists(self._rows_path):
+            with open(self._rows_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if len(self.rows) >= self.count:
+                        truncated = True
+                        break
+                    self.rows.append(json.loads(line))
+        if truncated:
+            with open(self._rows_path, "w", encoding="utf-8") as f:
+                for row in self.rows:
+                    f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        self.count = len(self.rows)
+        self._latest = {row["_id"]: i for i, row in enumerate(self.rows)}
+        self._live = np.zeros(self.count, dtype=bool)
+        self._live[list(self._latest.values())] = True
+        self._vectors = None
+        self.ivf = None
+        if manifest["ivf_rows"] and os.path.exists(self._ivf_path):
+            with np.load(self._ivf_path) as ivf:
+                self.ivf = {key: ivf[key] for key in ("centroids", "order", "offsets")}
+            self.ivf_rows = min(manifest["ivf_rows"], self.count)
+        else:
+            self.ivf_rows = 0
+
+    def _write_manifest(self):
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dims": self.dims, "count": self.count, "ivf_rows": self.ivf_rows}, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _matrix(self) -> np.ndarray:
+        if self._vectors is None:
+            if self.count == 0:
+                return np.empty((0, self.dims or 0), dtype=np.float32)
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dims))
+        return self._vectors
+
+    def add(self, doc_id: str, vector: Any, metadata: Dict[str, Any]):
+        self.add_many([(doc_id, vector, metadata)])
+
+    def add_many(self, items: Iterable[Tuple[str, Any, Dict[str, Any]]]):
+        """Append (doc_id, vector, metadata) rows to the index files"""
+        with self._lock:
+            items = list(items)
+            if not items:
+                return
+            vectors = _normalize(np.stack([to_float32(vector) for _, vector, _ in items]))
+            if self.dims is None:
+                self.dims = int(vectors.shape[1])
+            if vectors.shape[1] != self.dims:
+                raise ValueError(f"Vector has {vectors.shape[1]} dimensions, index expects {self.dims}")
+            rows = [{"_id": str(doc_id), **metadata} for doc_id, _, metadata in items]
+            with open(self._vectors_path, "ab") as f:
+                f.seek(self.count * self.dims * 4)
+                f.truncate()
+                f.write(vectors.astype("<f4").tobytes())
+            with open(self._rows_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            self._vectors = None
+            live = np.ones(len(rows), dtype=bool)
+            for offset, row in enumerate(rows):
+                previous = self._latest.get(row["_id"])
+                if previous is not None:
+                    if previous >= self.count:
+                        live[previous - self.count] = False
+                    else:
+                        self._live[previous] = False
+                self._latest[row["_id"]] = self.count + offset
+            self._live = np.concatenate([self._live, live])
+            self.rows.extend(rows)
+            self.count += len(rows)
+            self._write_manifest()
+
+    def _candidates(self, queries: np.ndarray) -> Optional[np.ndarray]:
+        """Row ids to score for a batch of queries, or None to scan the whole index"""
+        if self.ivf is None or self.ivf_rows < self.ivf_min_rows:
+            return None
+        centroids, order, offsets = self.ivf["centroids"], self.ivf["order"], self.ivf["offsets"]
+        probe = set()
+        for centroid_scores in queries @ centroids.T:
+            probe.update(_top_k(centroid_scores, self.nprobe).tolist())
+        parts = [order[offsets[c]:offsets[c + 1]] for c in sorted(probe)]
+        parts.append(np.arange(self.ivf_rows, self.count))
+        return np.sort(np.concatenate(parts))
+
+    def search(self, vector: Any, top_k: int = 3) -> List[Dict[str, Any]]:
+        return self.search_many([vector], top_k)[0]
+
+    def search_many(self, vectors: List[Any], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        # All queries are scored in one matrix product; with IVF, over the union of their probed partitions
+        with self._lock:
+            if self.count == 0 or not len(vectors):
+                return [[] for _ in vectors]
+            queries = _normalize(np.stack([to_float32(vector) for vector in vectors]))
+            matrix = self._matrix()
+            rows = self._candidates(queries)
+            if rows is None:
+                rows = np.arange(self.count)
+                scores = matrix @ queries.T
+            else:
+                scores = matrix[rows] @ queries.T
+            scores[~self._live[rows]] = -np.inf
+            results = []
+            for column in scores.T:
+                neighbors = []
+                for i in _top_k(column, top_k):
+                    if not np.isfinite(column[i]):
+                        break
+                    neighbors.append({**self.rows[rows[i]], "score": float((1.0 + column[i]) / 2.0)})
+                results.append(neighbors)
+            return results
+
+    def build(self, nlist: int = None):
+        """Train IVF partitions over the current rows. Indexes below ivf_min_rows stay exact."""
+        with self._lock:
+            if self.count < self.ivf_min_rows:
+                self.ivf, self.ivf_rows = None, 0
+            else:
+                matrix = self._matrix()
+                nlist = nlist or max(1, int(np.sqrt(self.count)))
+                centroids = _spherical_kmeans(matrix, nlist)
+                assign = np.empty(self.count, dtype=np.int32)
+                for start in range(0, self.count, 65536):
+                    assign[start:start + 65536] = np.argmax(matrix[start:start + 65536] @ centroids.T, axis=1)
+                order = np.argsort(assign, kind="stable").astype(np.int64)
+                offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+                np.savez(self._ivf_path, centroids=centroids, order=order, offsets=offsets)
+                self.ivf = {"centroids": centroids, "order": order, "offsets": offsets}
+                self.ivf_rows = self.count
+            self._write_manifest()
+
+    def rebuild(self, items: Iterable[Tuple[str, Any, Dict[str, Any]]]):
+        """Replace the whole index with the given rows, then train IVF partitions if it is large enough"""
+        with self._lock:
+            for file_path in (self._vectors_path, self._rows_path, self._ivf_path, self._manifest_path):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            self._load()
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= 1000:
+                    self.add_many(batch)
+                    batch = []
+            self.add_many(batch)
+            self.build()
+
+_local_index: Optional[LocalVectorIndex] = None
+_local_index_lock = threading.Lock()
+
+def get_vector_index(collection=None, backend: str = VECTOR_BACKEND) -> VectorIndex:
+    """Return the configured backend: the shared local index, or Atlas search over `collection`"""
+    global _local_index
+    if backend == "local":
+        if _local_index is None:
+            with _local_index_lock:
+                if _local_index is None:
+                    _local_index = LocalVectorIndex()
+        return _local_index
+    if backend == "atlas":
+        if collection is None:
+            # Imported here because the repository itself adds documents to the index
+            from adapters.mongo_repository import MongoRepository
+            collection = MongoRepository().collection
+        return AtlasVectorIndex(collection)
+    raise ValueError(f"Unknown vector backend: {backend}")
@@ -1,10 +1,21 @@
 import argparse
-from use_cases.extract import batch_extract
+import re
+import sys
+from use_cases.extract import extract_batch, print_batch_summary
+from config.settings import BATCH_CONCURRENCY, COMPLIANCE_WORKERS, HS_CODE_TABLE_PATH
+import json
 from adapters.mongo_repository import MongoRepository
 from adapters.llm_service import LLMService
 from adapters.file_adapter import FileAdapter
-from use_cases.compliance import link_documents, run_deterministic_checks, generate_compliance_report
+from adapters.vector_index import LocalVectorIndex, SIMILAR_DOC_FIELDS, get_vector_index, similar_doc_metadata
+from use_cases.compliance import (
+    load_linked_documents, load_shipment, load_all_shipments, get_link_keys, run_deterministic_checks, generate_compliance_report
+)
+from entities.shipment import Shipment
 from use_cases.rag import generate_rag_compliance_report
+from use_cases.compliance_runner import run_compliance, shipment_key
+from adapters.compliance_result_repository import ComplianceResultRepository
+from adapters.hs_code_table import compile_hs_table
 
 # For demonstration, compliance logic is now wired up
 
@@ -15,6 +26,17 @@ def main():
     parser.add_argument('--extract', action='store_true', help='Extract and save documents to MongoDB')
     parser.add_argument('--report', action='store_true', help='Generate compliance report')
     parser.add_argument('--rag_report', action='store_true', help='Generate RAG+CAG compliance report')
+    parser.add_argument('--no_cache', action='store_true', help='Ignore the local extraction cache and call Gemini for every PDF')
+    parser.add_argument('--invoice', help='Report on the shipment of this invoice number only (indexed lookup; the invoice number must match exactly, its DEC/CRN/bill keys may be near matches)')
+    parser.add_argument('--all_shipments', action='store_true', help='Report on every shipment in the collection (one report per invoice)')
+    parser.add_argument('--audit', action='store_true', help='Re-check every shipment across worker processes, store the results in MongoDB and save the failures to compliance_audit.json')
+    parser.add_argument('--workers', type=int, default=COMPLIANCE_WORKERS, help='Worker processes for --audit')
+    parser.add_argument('--incremental', action='store_true', help='With --audit or --report, only re-run the rules and reports whose inputs changed since the last run')
+    parser.add_argument('--render_reports', action='store_true', help='With --audit, also generate the LLM report of each shipment and store it with its results')
+    parser.add_argument('--build_index', action='store_true', help='Rebuild the local vector index from the embeddings stored in MongoDB')
+    parser.add_argument('--backfill', action='store_true', help='Store link keys and canonical/typed fields on documents ingested before they existed (needed for --invoice lookups)')
+    parser.add_argument('--build_hs_table', metavar='CSV', help='Compile a tariff CSV (HS code, description) into the HS code reference table')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help='Number of PDFs to extract in parallel')
     args = parser.parse_args()
 
     # Gather all PDF files
@@ -30,40 +52,107 @@ def main():
         print('No PDF files found to process.')
         return
 
+    # One repository (and one pooled client) for every step of this run
+    repo = MongoRepository()
+
     if args.extract:
-        docs = batch_extract(input_files, doc_type=args.type)
-        repo = MongoRepository()
-        for doc in docs:
-            repo.save_document(doc)
-        print(f"Extracted and saved {len(docs)} documents to MongoDB.")
-
-    if args.report:
-        repo = MongoRepository()
-        docs = repo.get_documents()
-        links = link_documents(docs)
-        deterministic_results = run_deterministic_checks(links)
-        report = generate_compliance_report(links, deterministic_results)
-        print('\n' + '='*60)
-        print('COMPLIANCE REPORT')
-        print('='*60)
-        print(report)
-        print('='*60 + '\n')
-        FileAdapter.save_text('compliance_report.txt', report)
-        print('Compliance report saved to compliance_report.txt')
-
-    if args.rag_report:
-        repo = MongoRepository()
-        docs = repo.get_documents()
-        links = link_documents(docs)
-        deterministic_results = run_deterministic_checks(links)
-        report_rag = generate_rag_compliance_report(links, deterministic_results)
-        print('\n' + '='*60)
-        print('RAG+CAG COMPLIANCE REPORT')
-        print('='*60)
-        print(report_rag)
-        print('='*60 + '\n')
-        FileAdapter.save_text('compliance_report_rag.txt', report_rag)
-        print('RAG+CAG compliance report saved to compliance_report_rag.txt')
+        batch = extract_batch(input_files, doc_type=args.type, use_cache=not args.no_cache, concurrency=args.concurrency)
+        print_batch_summary(batch)
+        FileAdapter.save_text('batch_processing_summary.json', json.dumps(batch['results'], indent=2, ensure_ascii=False))
+        docs = batch['documents']
+        saved = repo.save_documents(docs)
+        print(f"Extracted and saved {len(docs)} documents to MongoDB "
+              f"({saved['upserted'] + saved['inserted']} new, {saved['updated']} updated).")
+
+    if args.build_index:
+        index = get_vector_index(repo.collection)
+        if isinstance(index, LocalVectorIndex):
+            index.rebuild((doc.doc_id, doc.embedding, similar_doc_metadata(doc.data))
+                          for doc in repo.iter_documents({'embedding': {'$exists': True}}, include_embedding=True,
+                                                         fields=SIMILAR_DOC_FIELDS))
+            print(f"Local vector index rebuilt with {index.count} documents.")
+        else:
+            print('VECTOR_BACKEND is atlas; the Atlas index is maintained by MongoDB (see mongoDB-vector-index/vector-index.py).')
+
+    if args.backfill:
+        print(f"Derived fields stored on {repo.backfill_derived_fields()} older documents.")
+
+    if args.build_hs_table:
+        count = compile_hs_table(args.build_hs_table, HS_CODE_TABLE_PATH)
+        print(f"HS code table compiled with {count} codes to {HS_CODE_TABLE_PATH}.")
+
+    if args.audit:
+        # The LLM report prompt needs the full documents; the rules only read the projected fields
+        shipments, orphans = load_all_shipments(repo, projected=not args.render_reports)
+        print(f"Auditing {len(shipments)} shipments with {args.workers} worker(s); "
+              f"{len(orphans)} documents did not match any invoice.")
+        audit = run_compliance(shipments, workers=args.workers, render_reports=args.render_reports,
+                               incremental=args.incremental)
+        if args.incremental:
+            print(f"{audit['unchanged']} shipments unchanged since the last run; {audit['rules_rerun']} rule results recomputed.")
+        for rule_name, passed in audit['pass_counts'].items():
+            applicable = audit['applicable_counts'].get(rule_name, 0)
+            skipped = audit['shipments'] - applicable
+            print(f"  {rule_name}: {passed}/{applicable} passed" + (f" ({skipped} not applicable)" if skipped else ''))
+        FileAdapter.save_text('compliance_audit.json', json.dumps(audit['failures'], indent=2, ensure_ascii=False, default=str))
+        print(f"{audit['failed']} shipments with failed rules saved to compliance_audit.json; "
+              f"{audit['written']} results stored in MongoDB.")
+
+    if args.report or args.rag_report:
+        if args.all_shipments:
+            shipments, orphans = load_all_shipments(repo, include_embedding=args.rag_report)
+            print(f"Linked {len(shipments)} shipments; {len(orphans)} documents did not match any invoice.")
+        else:
+            if args.invoice:
+                links = load_shipment(repo, args.invoice, include_embedding=args.rag_report)
+                if not links['invoice']:
+                    # Nothing to check: no report over an empty shipment
+                    print(f"No invoice found with number {args.invoice}. "
+                          f"Documents ingested before link keys existed need --backfill once.")
+                    sys.exit(1)
+            else:
+                links = load_linked_documents(repo, include_embedding=args.rag_report)
+            shipments = [Shipment(links)]
+
+        if args.report:
+            # Rule results and reports are stored per invoice; with --incremental only changed shipments are redone
+            results_repo = ComplianceResultRepository()
+            reportable = [shipment for shipment in shipments if shipment.invoice]
+            summary = run_compliance(reportable, results_repo, workers=1, render_reports=True, incremental=args.incremental)
+            if args.incremental:
+                print(f"{summary['unchanged']} of {summary['shipments']} shipments unchanged since the last run; "
+                      f"their stored reports are reused.")
+            stored = results_repo.get_results(shipment_key(shipment) for shipment in reportable)
+
+        for shipment in shipments:
+            # One shipment keeps the original file names; a batch gets one file per invoice
+            suffix = f"_{shipment_name(shipment)}" if args.all_shipments else ''
+            fuzzy_links = {role: round(score, 2) for role, score in shipment.confidence.items() if score < 1.0}
+            if fuzzy_links:
+                print(f"Near-match links for {shipment_name(shipment)} (confidence): {fuzzy_links}")
+            if args.report:
+                record = stored.get(shipment_key(shipment)) if shipment.invoice else None
+                if record:
+                    report = record['report']
+                else:
+                    report = generate_compliance_report(shipment.links, run_deterministic_checks(shipment.links))
+                save_report('COMPLIANCE REPORT', report, f'compliance_report{suffix}.txt')
+            if args.rag_report:
+                report_rag = generate_rag_compliance_report(shipment.links, run_deterministic_checks(shipment.links))
+                save_report('RAG+CAG COMPLIANCE REPORT', report_rag, f'compliance_report{suffix}_rag.txt')
+
+def shipment_name(shipment: Shipment) -> str:
+    invoice_no = get_link_keys(shipment.invoice).get('invoice_no', shipment.invoice.doc_id)
+    return re.sub(r'[^A-Za-z0-9]+', '_', invoice_no).strip('_')
+
+def save_report(title: str, report: str, path: str):
+    print('\n' + '='*60)
+    print(title)
+    print('='*60)
+    print(report)
+    print('='*60 + '\n')
+    FileAdapter.save_text(path, report)
+    print(f'Report saved to {path}')
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -6,4 +6,96 @@ load_dotenv()
 #Make sure to add the correct environment variables to the .env file
 MONGO_URI = os.getenv("MONGO_URI")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-DB_NAME = "document_compliance" #You can change the database name to any other name.
\ No newline at end of file
+DB_NAME = "document_compliance" #You can change the database name to any other name.
+
+# Number of PDFs extracted in parallel by batch_extract (overridden by --concurrency)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+# Maximum number of concurrent Gemini vision calls per PDF (one call per page)
+PAGE_CONCURRENCY = int(os.getenv("PAGE_CONCURRENCY", "4"))
+
+# Gemini model the extractors send scanned page images to
+VISION_MODEL = os.getenv("VISION_MODEL", "gemini-1.5-pro")
+
+# Persistent extraction cache (keyed by PDF hash, document type and extraction version: prompt, models, page settings)
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH", os.path.join(".cache", "extractions.sqlite3"))
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512"))
+EXTRACTION_CACHE_MAX_AGE_DAYS = int(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "90"))
+
+# Text-layer fast path: born-digital pages are sent to Gemini as text instead of images
+TEXT_LAYER_ENABLED = os.getenv("TEXT_LAYER_ENABLED", "true").lower() == "true"
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "200"))
+TEXT_LAYER_MODEL = os.getenv("TEXT_LAYER_MODEL", "gemini-1.5-flash")
+
+# Process-wide Gemini quota scheduler: per-endpoint requests/tokens per minute, plus a key-wide request cap
+QUOTA_LIMITS = {
+    "vision": {"rpm": int(os.getenv("VISION_RPM", "60")), "tpm": int(os.getenv("VISION_TPM", "1000000"))},
+    "text": {"rpm": int(os.getenv("TEXT_RPM", "300")), "tpm": int(os.getenv("TEXT_TPM", "2000000"))},
+    "embedding": {"rpm": int(os.getenv("EMBEDDING_RPM", "100")), "tpm": int(os.getenv("EMBEDDING_TPM", "1000000"))},
+    "report": {"rpm": int(os.getenv("REPORT_RPM", "60")), "tpm": int(os.getenv("REPORT_TPM", "1000000"))},
+}
+QUOTA_GLOBAL_RPM = int(os.getenv("QUOTA_GLOBAL_RPM", "400"))
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "6"))
+QUOTA_BACKOFF_BASE_SECONDS = float(os.getenv("QUOTA_BACKOFF_BASE_SECONDS", "2"))
+QUOTA_BACKOFF_MAX_SECONDS = float(os.getenv("QUOTA_BACKOFF_MAX_SECONDS", "60"))
+
+# Gemini embeddings: texts from a batch are sent through embed_documents in size-limited batches
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/gemini-embedding-exp-03-07")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", "400000"))
+
+# Local embedding cache (float32 blobs keyed by model, task type and text hash)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# Embeddings are written to MongoDB as BSON BinData vectors: "float32" or "int8" (4x smaller, cosine only)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+
+# Vector search backend for RAG: "atlas" ($vectorSearch) or "local" (memory-mapped index on disk)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "atlas")
+VECTOR_INDEX_NAME = os.getenv("VECTOR_INDEX_NAME", "invoice_embedding_index")
+VECTOR_NUM_CANDIDATES = int(os.getenv("VECTOR_NUM_CANDIDATES", "100"))
+VECTOR_SEARCH_CONCURRENCY = int(os.getenv("VECTOR_SEARCH_CONCURRENCY", "4"))
+LOCAL_VECTOR_INDEX_PATH = os.getenv("LOCAL_VECTOR_INDEX_PATH", os.path.join(".cache", "vector_index"))
+LOCAL_VECTOR_INDEX_IVF_MIN_ROWS = int(os.getenv("LOCAL_VECTOR_INDEX_IVF_MIN_ROWS", "20000"))
+LOCAL_VECTOR_INDEX_NPROBE = int(os.getenv("LOCAL_VECTOR_INDEX_NPROBE", "8"))
+
+# Shared MongoDB client (adapters/mongo_client.py): connection pool size and timeouts
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000"))
+
+# Documents per unordered bulk_write when saving to MongoDB, and per cursor batch when reading
+MONGO_WRITE_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BATCH_SIZE", "500"))
+MONGO_READ_BATCH_SIZE = int(os.getenv("MONGO_READ_BATCH_SIZE", "500"))
+
+# Near-match linking of OCR-damaged DEC/CRN/bill numbers: edit-distance bound and minimum confidence
+FUZZY_LINK_MAX_DISTANCE = int(os.getenv("FUZZY_LINK_MAX_DISTANCE", "2"))
+FUZZY_LINK_MIN_CONFIDENCE = float(os.getenv("FUZZY_LINK_MIN_CONFIDENCE", "0.8"))
+
+# Compliance rules file (JSON, or YAML with PyYAML installed); defaults to use_cases/compliance_rules.json
+COMPLIANCE_RULES_PATH = os.getenv("COMPLIANCE_RULES_PATH")
+
+# Largest difference (kg) between invoice and declaration weights that still counts as a match
+WEIGHT_TOLERANCE_KG = float(os.getenv("WEIGHT_TOLERANCE_KG", "0.01"))
+
+# Multi-process compliance runner: worker processes, shipments per work unit, and work units queued per worker
+COMPLIANCE_WORKERS = int(os.getenv("COMPLIANCE_WORKERS", str(os.cpu_count() or 1)))
+COMPLIANCE_CHUNK_SIZE = int(os.getenv("COMPLIANCE_CHUNK_SIZE", "500"))
+COMPLIANCE_IN_FLIGHT_PER_WORKER = int(os.getenv("COMPLIANCE_IN_FLIGHT_PER_WORKER", "2"))
+# Threads in the parent rendering the LLM reports of --report/--render_reports (all share the one quota scheduler)
+COMPLIANCE_REPORT_THREADS = int(os.getenv("COMPLIANCE_REPORT_THREADS", "4"))
+COMPLIANCE_RESULTS_COLLECTION = os.getenv("COMPLIANCE_RESULTS_COLLECTION", "compliance-results")
+
+# Line-item reconciliation: relative tolerances for weight, value (CIF vs invoice value) and quantity deltas,
+# and the description word overlap (Jaccard) needed to pair items whose HS codes do not match
+LINE_ITEM_WEIGHT_TOLERANCE = float(os.getenv("LINE_ITEM_WEIGHT_TOLERANCE", "0.01"))
+LINE_ITEM_VALUE_TOLERANCE = float(os.getenv("LINE_ITEM_VALUE_TOLERANCE", "0.05"))
+LINE_ITEM_QUANTITY_TOLERANCE = float(os.getenv("LINE_ITEM_QUANTITY_TOLERANCE", "0"))
+LINE_ITEM_MIN_SIMILARITY = float(os.getenv("LINE_ITEM_MIN_SIMILARITY", "0.5"))
+
+# Compiled HS code reference table (build it from a tariff CSV with --build_hs_table); HS code validation does not apply without it
+HS_CODE_TABLE_PATH = os.getenv("HS_CODE_TABLE_PATH", os.path.join(".cache", "hs_codes.bin"))
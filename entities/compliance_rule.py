@@ -1,7 +1,10 @@
-from typing import Callable, Any
+from typing import Callable, Any, Dict, Optional, Tuple
 
 class ComplianceRule:
-    def __init__(self, name: str, description: str, validate: Callable[[Any], bool]):
+    def __init__(self, name: str, description: str, validate: Callable[[Any], Tuple[Optional[bool], str]],
+                 spec: Optional[Dict[str, Any]] = None):
         self.name = name
         self.description = description
-        self.validate = validate 
\ No newline at end of file
+        self.validate = validate
+        # The rule-file definition it was compiled from (None for rules built in code)
+        self.spec = spec
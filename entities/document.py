@@ -1,8 +1,18 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
 
 class Document:
-    def __init__(self, doc_id: str, doc_type: str, data: Dict[str, Any], embedding: Optional[List[float]] = None):
+    def __init__(self, doc_id: str, doc_type: str, data: Dict[str, Any], embedding: Optional[Union[List[float], np.ndarray]] = None):
         self.doc_id = doc_id
         self.doc_type = doc_type
         self.data = data
-        self.embedding = embedding 
\ No newline at end of file
+        self.embedding = embedding
+
+    @property
+    def embedding(self) -> Optional[np.ndarray]:
+        return self._embedding
+
+    @embedding.setter
+    def embedding(self, value: Optional[Union[List[float], np.ndarray]]):
+        # Held as a float32 array: ~12 KB for 3072 dims instead of ~100 KB of Python floats
+        self._embedding = None if value is None else np.asarray(value, dtype=np.float32)
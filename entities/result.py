@@ -1,5 +1,8 @@
+from typing import Optional
+
 class ComplianceResult:
-    def __init__(self, rule_name: str, passed: bool, explanation: str):
+    def __init__(self, rule_name: str, passed: Optional[bool], explanation: str):
         self.rule_name = rule_name
+        # None when the rule does not apply to the shipment (counted neither as passed nor failed)
         self.passed = passed
-        self.explanation = explanation 
\ No newline at end of file
+        self.explanation = explanation
\ No newline at end of file
@@ -0,0 +1,16 @@
+from typing import Dict, Optional
+from entities.document import Document
+
+class Shipment:
+    def __init__(self, links: Dict[str, Optional[Document]], confidence: Optional[Dict[str, float]] = None):
+        # Same shape as link_documents' result: role ("invoice", "customs_declaration", ...) -> document
+        self.links = links
+        # Confidence of each linked role in [0, 1]; exact key matches are 1.0
+        self.confidence = confidence or {role: 1.0 for role, doc in links.items() if doc}
+
+    @property
+    def invoice(self) -> Optional[Document]:
+        return self.links.get("invoice")
+
+    def documents(self):
+        return [doc for doc in self.links.values() if doc]
@@ -73,6 +73,7 @@ def process_image_with_gemini(image_base64: str) -> Dict[str, Any]:
             {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
         ]
     )
+    response = None
     try:
         response = vision_model.invoke([system_message, human_message])
         response_text = response.content
@@ -92,8 +93,10 @@ def process_image_with_gemini(image_base64: str) -> Dict[str, Any]:
         return extracted_data
     except Exception as e:
         print(f"Error processing image with Gemini: {e}")
-        print(f"Response content: {response.content[:500]}...")
-        return {"error": str(e), "partial_response": response.content[:500]}
+        # No response when the call itself failed (e.g. the scheduler gave up retrying)
+        partial_response = response.content[:500] if response is not None else ""
+        print(f"Response content: {partial_response}...")
+        return {"error": str(e), "partial_response": partial_response}
 
 def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Combine results from multiple pages into a single coherent result"""
@@ -1,55 +1,48 @@
 import os
-import base64
+import sys
 import json
-import tempfile
-from pymongo import MongoClient
 from datetime import datetime
 from typing import Dict, Any, List
 
 # LangChain imports
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.schema import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-import fitz  
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.page_executor import map_pages
+from adapters.pdf_rasterizer import load_pdf_pages
+from adapters.embedding_service import document_text_for_embedding, embed_text
+from adapters.fallback_extraction import extract_page_json, save_extracted_document
+from adapters.vector_codec import query_vector
+from adapters.mongo_client import get_mongo_client
+from adapters.extraction_cache import file_sha256
+from config.settings import TEXT_LAYER_MODEL, VISION_MODEL
 
 # Load environment variables
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-MONGODB_URI = os.getenv("MONGO_URI")
 
-# Initialize Gemini model for vision
-vision_model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0)
+# Initialize Gemini model for vision (retries are handled by the quota scheduler)
+vision_model = ChatGoogleGenerativeAI(model=VISION_MODEL, temperature=0, max_retries=0)
 
-# Initialize Gemini embeddings model
-embeddings_model = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-exp-03-07",  # Or latest model as needed
-    task_type="RETRIEVAL_DOCUMENT"
-)
+# Cheaper text-only model for born-digital pages that have a usable text layer
+text_model = ChatGoogleGenerativeAI(model=TEXT_LAYER_MODEL, temperature=0, max_retries=0)
 
 def extract_leminar_invoice_data(pdf_path: str) -> Dict[str, Any]:
     """Extract data from a Leminar Air Conditioning invoice PDF using Gemini Vision API"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        doc = fitz.open(pdf_path)
-        all_results = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_path = os.path.join(temp_dir, f"page_{page_num}.png")
-            pix.save(img_path)
-            with open(img_path, "rb") as img_file:
-                img_data = base64.b64encode(img_file.read()).decode("utf-8")
-            result = process_leminar_invoice_with_gemini(img_data)
-            all_results.append(result)
-        doc.close()
+    # Born-digital pages go to Gemini as text, scanned pages as images
+    pages = load_pdf_pages(pdf_path, "leminar_invoice")
+    # Send all pages to Gemini at once (bounded by PAGE_CONCURRENCY); results stay in page order
+    all_results = map_pages(process_leminar_invoice_with_gemini, pages)
     combined_data = combine_page_results(all_results)
     combined_data["extraction_timestamp"] = datetime.now().isoformat()
     combined_data["source_filename"] = os.path.basename(pdf_path)
+    combined_data["source_sha256"] = file_sha256(pdf_path)
     return combined_data
 
-def process_leminar_invoice_with_gemini(image_base64: str) -> Dict[str, Any]:
-    """Process a Leminar invoice image with Gemini Vision API to extract data"""
-    system_message = SystemMessage(content="""
+# System prompt for the vision model; its hash versions the extraction cache
+LEMINAR_INVOICE_PROMPT = """
     You are a specialized HVAC invoice data extractor. Extract all relevant information from this Leminar Air Conditioning Company invoice including:
     - Invoice number (format: LACO-XX)
     - Invoice date
@@ -66,35 +59,12 @@ def process_leminar_invoice_with_gemini(image_base64: str) -> Dict[str, Any]:
     
     Format your response as a clean, properly formatted JSON object. Be precise and accurate.
     Return ONLY the JSON object, nothing else.
-    """)
-    human_message = HumanMessage(
-        content=[
-            {"type": "text", "text": "Extract all information from this Leminar Air Conditioning invoice."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-        ]
-    )
-    try:
-        response = vision_model.invoke([system_message, human_message])
-        response_text = response.content
-        import re
-        # Clean up the response to ensure it's valid JSON
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(1)
-        if not response_text.strip().startswith('{'):
-            first_brace = response_text.find('{')
-            if first_brace != -1:
-                response_text = response_text[first_brace:]
-        if not response_text.strip().endswith('}'):
-            last_brace = response_text.rfind('}')
-            if last_brace != -1:
-                response_text = response_text[:last_brace+1]
-        extracted_data = json.loads(response_text)
-        return extracted_data
-    except Exception as e:
-        print(f"Error processing Leminar invoice with Gemini: {e}")
-        print(f"Response content: {response.content[:500]}...")
-        return {"error": str(e), "partial_response": response.content[:500]}
+    """
+
+def process_leminar_invoice_with_gemini(page: Dict[str, str]) -> Dict[str, Any]:
+    """Process a Leminar invoice page (image or text layer) with Gemini to extract data"""
+    return extract_page_json(page, LEMINAR_INVOICE_PROMPT, "Extract all information from this Leminar Air Conditioning invoice.",
+                             "Leminar invoice", text_model, vision_model)
 
 def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Combine results from multiple pages into a single coherent result"""
@@ -106,45 +76,28 @@ def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
             if "line_items" not in combined:
                 combined["line_items"] = []
             combined["line_items"].extend(page_data["line_items"])
+    # A failed page leaves the document incomplete: report every failed page, not just the first
+    errors = [f"page {number}: {page['error']}" for number, page in enumerate(page_results, 1) if "error" in page]
+    if errors:
+        combined["error"] = "; ".join(errors)
     return combined
 
-def get_invoice_text_for_embedding(invoice_data: dict) -> str:
-    """Return a string with all invoice info except extraction_timestamp and source_filename"""
-    filtered = {k: v for k, v in invoice_data.items() if k not in ["extraction_timestamp", "source_filename"]}
-    return json.dumps(filtered, ensure_ascii=False, indent=2)
-
 #You can change the collection name to any other name.
 def save_to_mongodb_with_embedding(data: dict, embedding: list, collection_name: str = "invoices-test") -> str:
     """Save the extracted Leminar invoice data and embedding to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        data["embedding"] = embedding
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "leminar_invoice", collection_name, embedding)
 
 #You can change the collection name to any other name.
 def save_to_mongodb(data: Dict[str, Any], collection_name: str = "invoices-test") -> str:
     """Save the extracted Leminar invoice data to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "leminar_invoice", collection_name)
+
+def enrich_leminar_invoice_data(invoice_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Additional processing specific to Leminar invoices, applied after extraction"""
+    if "line_items" in invoice_data:
+        total_amount = sum(item.get("total_value", 0) for item in invoice_data["line_items"])
+        invoice_data["calculated_total"] = total_amount
+    return invoice_data
 
 def process_and_save_leminar_invoice(pdf_path: str, add_embedding: bool = False) -> Dict[str, Any]:
     """Process a Leminar invoice PDF and save to MongoDB, with optional Gemini embedding"""
@@ -155,15 +108,12 @@ def process_and_save_leminar_invoice(pdf_path: str, add_embedding: bool = False)
             print(f"Error in extraction: {invoice_data['error']}")
             return {"status": "error", "message": f"Extraction failed: {invoice_data['error']}"}
         
-        # Additional processing specific to Leminar invoices
-        if "line_items" in invoice_data:
-            total_amount = sum(item.get("total_value", 0) for item in invoice_data["line_items"])
-            invoice_data["calculated_total"] = total_amount
+        invoice_data = enrich_leminar_invoice_data(invoice_data)
             
         embedding = None
         if add_embedding:
-            invoice_text = get_invoice_text_for_embedding(invoice_data)
-            embedding = embeddings_model.embed_query(invoice_text)
+            invoice_text = document_text_for_embedding(invoice_data)
+            embedding = embed_text(invoice_text)
             print("Saving to MongoDB with embedding...")
             doc_id = save_to_mongodb_with_embedding(invoice_data, embedding)
         else:
@@ -189,9 +139,7 @@ def process_and_save_leminar_invoice(pdf_path: str, add_embedding: bool = False)
 def check_mongodb_connection() -> bool:
     """Check if MongoDB is available"""
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.server_info()
-        client.close()
+        get_mongo_client().admin.command("ping")
         return True
     except Exception as e:
         print(f"MongoDB connection error: {e}")
@@ -203,12 +151,13 @@ def find_similar_invoices(invoice_data: dict, similarity_threshold: float = 0.85
         return []
         
     try:
-        # Extract key text for embedding
-        invoice_text = get_invoice_text_for_embedding(invoice_data)
-        embedding = embeddings_model.embed_query(invoice_text)
+        # Reuse the embedding computed at ingest time instead of re-embedding the same document
+        embedding = invoice_data.get("embedding")
+        if embedding is None:
+            embedding = embed_text(document_text_for_embedding(invoice_data))
         
         # Connect to MongoDB
-        client = MongoClient(MONGODB_URI)
+        client = get_mongo_client()
         db = client.document_compliance
         collection = db.invoices
         
@@ -219,7 +168,7 @@ def find_similar_invoices(invoice_data: dict, similarity_threshold: float = 0.85
                 "$vectorSearch": {
                     "index": "invoice_embedding_index",
                     "path": "embedding",
-                    "queryVector": embedding,
+                    "queryVector": query_vector(embedding),
                     "numCandidates": 100,
                     "limit": 5
                 }
@@ -243,9 +192,6 @@ def find_similar_invoices(invoice_data: dict, similarity_threshold: float = 0.85
     except Exception as e:
         print(f"Error finding similar invoices: {e}")
         return []
-    finally:
-        if 'client' in locals():
-            client.close()
 
 def analyze_invoice_trends(date_range: Dict[str, str] = None) -> Dict[str, Any]:
     """Analyze Leminar invoice data to identify trends and patterns"""
@@ -253,35 +199,47 @@ def analyze_invoice_trends(date_range: Dict[str, str] = None) -> Dict[str, Any]:
         return {"status": "error", "message": "MongoDB not available"}
         
     try:
-        client = MongoClient(MONGODB_URI)
+        client = get_mongo_client()
         db = client.document_compliance
         collection = db.invoices
         
-        # Build query based on date range if provided
-        query = {}
-        if date_range:
-            query["invoice_date"] = {
-                "$gte": date_range.get("start"),
-                "$lte": date_range.get("end")
-            }
+        # Dates and amounts come from the typed fields parsed at ingest; documents saved before
+        # those existed fall back to parsing the raw fields in the pipeline. A typed document whose
+        # value did not parse stays None, as it is for the indexed typed.invoice_date filter below.
+        is_typed = {"$eq": [{"$type": "$typed"}, "object"]}
+        resolved = {"$addFields": {
+            "_invoice_date": {"$cond": [is_typed, "$typed.invoice_date", {"$dateFromString": {
+                "dateString": "$invoice_date", "onError": None, "onNull": None}}]},
+            "_total_amount": {"$cond": [is_typed, "$typed.total_amount", {"$convert": {
+                "input": "$total_amount", "to": "double", "onError": None, "onNull": None}}]},
+        }}
+        match = [{"$match": {}}, resolved]
+        # Either bound may be left out for an open-ended range
+        bounds = {operator: datetime.fromisoformat(date_range[key])
+                  for operator, key in (("$gte", "start"), ("$lte", "end")) if (date_range or {}).get(key)}
+        if bounds:
+            # Typed documents are filtered on the (indexed) typed date, untyped ones once their date is parsed
+            match = [
+                {"$match": {"$or": [{"typed.invoice_date": bounds}, {"typed": {"$exists": False}}]}},
+                resolved,
+                {"$match": {"_invoice_date": bounds}},
+            ]
         
         # Aggregation for total invoice amount by month
-        monthly_totals_pipeline = [
-            {"$match": query},
+        monthly_totals_pipeline = match + [
             {"$group": {
                 "_id": {
-                    "year": {"$year": {"$dateFromString": {"dateString": "$invoice_date"}}},
-                    "month": {"$month": {"$dateFromString": {"dateString": "$invoice_date"}}}
+                    "year": {"$year": "$_invoice_date"},
+                    "month": {"$month": "$_invoice_date"}
                 },
-                "total_amount": {"$sum": "$total_amount"},
+                "total_amount": {"$sum": "$_total_amount"},
                 "count": {"$sum": 1}
             }},
             {"$sort": {"_id.year": 1, "_id.month": 1}}
         ]
         
         # Aggregation for top products by quantity
-        top_products_pipeline = [
-            {"$match": query},
+        top_products_pipeline = match + [
             {"$unwind": "$line_items"},
             {"$group": {
                 "_id": "$line_items.description",
@@ -293,8 +251,7 @@ def analyze_invoice_trends(date_range: Dict[str, str] = None) -> Dict[str, Any]:
         ]
         
         # Aggregation for top countries of origin
-        origin_pipeline = [
-            {"$match": query},
+        origin_pipeline = match + [
             {"$unwind": "$line_items"},
             {"$group": {
                 "_id": "$line_items.origin",
@@ -313,15 +270,12 @@ def analyze_invoice_trends(date_range: Dict[str, str] = None) -> Dict[str, Any]:
             "monthly_totals": monthly_totals,
             "top_products": top_products,
             "origins": origins,
-            "total_invoices": collection.count_documents(query)
+            "total_invoices": next(collection.aggregate(match + [{"$count": "count"}]), {}).get("count", 0)
         }
         
     except Exception as e:
         print(f"Error analyzing invoice trends: {e}")
         return {"status": "error", "message": str(e)}
-    finally:
-        if 'client' in locals():
-            client.close()
 
 if __name__ == "__main__":
     leminar_invoice_path = "invoice.pdf"  # Replace with your actual file path
@@ -1,57 +1,50 @@
 import os
-import base64
+import sys
 import json
-import tempfile
-from pymongo import MongoClient
 from datetime import datetime
 from typing import Dict, Any, List
 
 # LangChain imports
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.schema import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-import fitz  
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.page_executor import map_pages
+from adapters.pdf_rasterizer import load_pdf_pages
+from adapters.embedding_service import document_text_for_embedding, embed_text
+from adapters.fallback_extraction import extract_page_json, save_extracted_document
+from adapters.vector_codec import query_vector
+from adapters.mongo_client import get_mongo_client
+from adapters.extraction_cache import file_sha256
+from config.settings import TEXT_LAYER_MODEL, VISION_MODEL
 
 # Load environment variables
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-MONGODB_URI = os.getenv("MONGO_URI")
 
-# Initialize Gemini model for vision
-vision_model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0)
+# Initialize Gemini model for vision (retries are handled by the quota scheduler)
+vision_model = ChatGoogleGenerativeAI(model=VISION_MODEL, temperature=0, max_retries=0)
 
-# Initialize Gemini embeddings model
-embeddings_model = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-exp-03-07",  # Or latest model as needed
-    task_type="RETRIEVAL_DOCUMENT"
-)
+# Cheaper text-only model for born-digital pages that have a usable text layer
+text_model = ChatGoogleGenerativeAI(model=TEXT_LAYER_MODEL, temperature=0, max_retries=0)
 
 def extract_western_express_data(pdf_path: str) -> Dict[str, Any]:
     """Extract data from a Western Express waybill/bill of lading PDF using Gemini Vision API"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        doc = fitz.open(pdf_path)
-        all_results = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_path = os.path.join(temp_dir, f"page_{page_num}.png")
-            pix.save(img_path)
-            with open(img_path, "rb") as img_file:
-                img_data = base64.b64encode(img_file.read()).decode("utf-8")
-            result = process_western_express_with_gemini(img_data)
-            all_results.append(result)
-        doc.close()
+    # Born-digital pages go to Gemini as text, scanned pages as images
+    pages = load_pdf_pages(pdf_path, "western_express")
+    # Send all pages to Gemini at once (bounded by PAGE_CONCURRENCY); results stay in page order
+    all_results = map_pages(process_western_express_with_gemini, pages)
     combined_data = combine_page_results(all_results)
     combined_data["extraction_timestamp"] = datetime.now().isoformat()
     combined_data["source_filename"] = os.path.basename(pdf_path)
+    combined_data["source_sha256"] = file_sha256(pdf_path)
     combined_data["document_type"] = "waybill"
     combined_data["carrier"] = "Western Express"
     return combined_data
 
-def process_western_express_with_gemini(image_base64: str) -> Dict[str, Any]:
-    """Process a Western Express waybill image with Gemini Vision API to extract data"""
-    system_message = SystemMessage(content="""
+# System prompt for the vision model; its hash versions the extraction cache
+WESTERN_EXPRESS_PROMPT = """
     You are a specialized logistics document data extractor. Extract all relevant information from this Western Express waybill including:
     - Consignment number (CRN No.)
     - Shipper details (name, address, city, country, contact name, telephone)
@@ -69,35 +62,12 @@ def process_western_express_with_gemini(image_base64: str) -> Dict[str, Any]:
     
     Format your response as a clean, properly formatted JSON object. Be precise and accurate.
     Return ONLY the JSON object, nothing else.
-    """)
-    human_message = HumanMessage(
-        content=[
-            {"type": "text", "text": "Extract all information from this Western Express waybill."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-        ]
-    )
-    try:
-        response = vision_model.invoke([system_message, human_message])
-        response_text = response.content
-        import re
-        # Clean up the response to ensure it's valid JSON
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(1)
-        if not response_text.strip().startswith('{'):
-            first_brace = response_text.find('{')
-            if first_brace != -1:
-                response_text = response_text[first_brace:]
-        if not response_text.strip().endswith('}'):
-            last_brace = response_text.rfind('}')
-            if last_brace != -1:
-                response_text = response_text[:last_brace+1]
-        extracted_data = json.loads(response_text)
-        return extracted_data
-    except Exception as e:
-        print(f"Error processing Western Express waybill with Gemini: {e}")
-        print(f"Response content: {response.content[:500]}...")
-        return {"error": str(e), "partial_response": response.content[:500]}
+    """
+
+def process_western_express_with_gemini(page: Dict[str, str]) -> Dict[str, Any]:
+    """Process a Western Express waybill page (image or text layer) with Gemini to extract data"""
+    return extract_page_json(page, WESTERN_EXPRESS_PROMPT, "Extract all information from this Western Express waybill.",
+                             "Western Express waybill", text_model, vision_model)
 
 def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Combine results from multiple pages into a single coherent result"""
@@ -111,45 +81,21 @@ def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
             if "packages" not in combined:
                 combined["packages"] = []
             combined["packages"].extend(page_data["packages"])
+    # A failed page leaves the document incomplete: report every failed page, not just the first
+    errors = [f"page {number}: {page['error']}" for number, page in enumerate(page_results, 1) if "error" in page]
+    if errors:
+        combined["error"] = "; ".join(errors)
     return combined
 
-def get_waybill_text_for_embedding(waybill_data: dict) -> str:
-    """Return a string with all waybill info except extraction_timestamp and source_filename"""
-    filtered = {k: v for k, v in waybill_data.items() if k not in ["extraction_timestamp", "source_filename"]}
-    return json.dumps(filtered, ensure_ascii=False, indent=2)
-
 #You can change the collection name to any other name.
 def save_to_mongodb_with_embedding(data: dict, embedding: list, collection_name: str = "invoices-test") -> str:
     """Save the extracted Western Express waybill data and embedding to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        data["embedding"] = embedding
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "western_express", collection_name, embedding)
 
 #You can change the collection name to any other name.
 def save_to_mongodb(data: Dict[str, Any], collection_name: str = "invoices-test") -> str:
     """Save the extracted Western Express waybill data to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "western_express", collection_name)
 
 def process_and_save_western_express(pdf_path: str, add_embedding: bool = False) -> Dict[str, Any]:
     """Process a Western Express waybill PDF and save to MongoDB, with optional Gemini embedding"""
@@ -162,8 +108,8 @@ def process_and_save_western_express(pdf_path: str, add_embedding: bool = False)
         
         embedding = None
         if add_embedding:
-            waybill_text = get_waybill_text_for_embedding(waybill_data)
-            embedding = embeddings_model.embed_query(waybill_text)
+            waybill_text = document_text_for_embedding(waybill_data)
+            embedding = embed_text(waybill_text)
             print("Saving to MongoDB with embedding...")
             doc_id = save_to_mongodb_with_embedding(waybill_data, embedding)
         else:
@@ -189,9 +135,7 @@ def process_and_save_western_express(pdf_path: str, add_embedding: bool = False)
 def check_mongodb_connection() -> bool:
     """Check if MongoDB is available"""
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.server_info()
-        client.close()
+        get_mongo_client().admin.command("ping")
         return True
     except Exception as e:
         print(f"MongoDB connection error: {e}")
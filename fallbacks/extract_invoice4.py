@@ -1,57 +1,50 @@
 import os
-import base64
+import sys
 import json
-import tempfile
-from pymongo import MongoClient
 from datetime import datetime
 from typing import Dict, Any, List
 
 # LangChain imports
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.schema import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-import fitz  
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.page_executor import map_pages
+from adapters.pdf_rasterizer import load_pdf_pages
+from adapters.embedding_service import document_text_for_embedding, embed_text
+from adapters.fallback_extraction import extract_page_json, save_extracted_document
+from adapters.vector_codec import query_vector
+from adapters.mongo_client import get_mongo_client
+from adapters.extraction_cache import file_sha256
+from config.settings import TEXT_LAYER_MODEL, VISION_MODEL
 
 # Load environment variables
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-MONGODB_URI = os.getenv("MONGO_URI")
 
-# Initialize Gemini model for vision
-vision_model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0)
+# Initialize Gemini model for vision (retries are handled by the quota scheduler)
+vision_model = ChatGoogleGenerativeAI(model=VISION_MODEL, temperature=0, max_retries=0)
 
-# Initialize Gemini embeddings model
-embeddings_model = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-exp-03-07",  # Or latest model as needed
-    task_type="RETRIEVAL_DOCUMENT"
-)
+# Cheaper text-only model for born-digital pages that have a usable text layer
+text_model = ChatGoogleGenerativeAI(model=TEXT_LAYER_MODEL, temperature=0, max_retries=0)
 
 def extract_customs_certificate_data(pdf_path: str) -> Dict[str, Any]:
     """Extract data from a Dubai Customs Exit/Entry Certificate PDF using Gemini Vision API"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        doc = fitz.open(pdf_path)
-        all_results = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_path = os.path.join(temp_dir, f"page_{page_num}.png")
-            pix.save(img_path)
-            with open(img_path, "rb") as img_file:
-                img_data = base64.b64encode(img_file.read()).decode("utf-8")
-            result = process_customs_certificate_with_gemini(img_data)
-            all_results.append(result)
-        doc.close()
+    # Born-digital pages go to Gemini as text, scanned pages as images
+    pages = load_pdf_pages(pdf_path, "customs_certificate")
+    # Send all pages to Gemini at once (bounded by PAGE_CONCURRENCY); results stay in page order
+    all_results = map_pages(process_customs_certificate_with_gemini, pages)
     combined_data = combine_page_results(all_results)
     combined_data["extraction_timestamp"] = datetime.now().isoformat()
     combined_data["source_filename"] = os.path.basename(pdf_path)
+    combined_data["source_sha256"] = file_sha256(pdf_path)
     combined_data["document_type"] = "customs_certificate"
     combined_data["issuing_authority"] = "Dubai Customs"
     return combined_data
 
-def process_customs_certificate_with_gemini(image_base64: str) -> Dict[str, Any]:
-    """Process a Dubai Customs certificate image with Gemini Vision API to extract data"""
-    system_message = SystemMessage(content="""
+# System prompt for the vision model; its hash versions the extraction cache
+CUSTOMS_CERTIFICATE_PROMPT = """
     You are a specialized customs document data extractor. Extract all relevant information from this Dubai Customs Exit/Entry Certificate including:
     - Certificate date
     - Exporter name and details
@@ -70,35 +63,12 @@ def process_customs_certificate_with_gemini(image_base64: str) -> Dict[str, Any]
     
     Format your response as a clean, properly formatted JSON object. Be precise and accurate.
     Return ONLY the JSON object, nothing else.
-    """)
-    human_message = HumanMessage(
-        content=[
-            {"type": "text", "text": "Extract all information from this Dubai Customs Exit/Entry Certificate."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-        ]
-    )
-    try:
-        response = vision_model.invoke([system_message, human_message])
-        response_text = response.content
-        import re
-        # Clean up the response to ensure it's valid JSON
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(1)
-        if not response_text.strip().startswith('{'):
-            first_brace = response_text.find('{')
-            if first_brace != -1:
-                response_text = response_text[first_brace:]
-        if not response_text.strip().endswith('}'):
-            last_brace = response_text.rfind('}')
-            if last_brace != -1:
-                response_text = response_text[:last_brace+1]
-        extracted_data = json.loads(response_text)
-        return extracted_data
-    except Exception as e:
-        print(f"Error processing Customs Certificate with Gemini: {e}")
-        print(f"Response content: {response.content[:500]}...")
-        return {"error": str(e), "partial_response": response.content[:500]}
+    """
+
+def process_customs_certificate_with_gemini(page: Dict[str, str]) -> Dict[str, Any]:
+    """Process a Dubai Customs certificate page (image or text layer) with Gemini to extract data"""
+    return extract_page_json(page, CUSTOMS_CERTIFICATE_PROMPT, "Extract all information from this Dubai Customs Exit/Entry Certificate.",
+                             "Customs Certificate", text_model, vision_model)
 
 def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Combine results from multiple pages into a single coherent result"""
@@ -111,45 +81,29 @@ def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
             if "goods" not in combined:
                 combined["goods"] = []
             combined["goods"].extend(page_data["goods"])
+    # A failed page leaves the document incomplete: report every failed page, not just the first
+    errors = [f"page {number}: {page['error']}" for number, page in enumerate(page_results, 1) if "error" in page]
+    if errors:
+        combined["error"] = "; ".join(errors)
     return combined
 
-def get_certificate_text_for_embedding(certificate_data: dict) -> str:
-    """Return a string with all certificate info except extraction_timestamp and source_filename"""
-    filtered = {k: v for k, v in certificate_data.items() if k not in ["extraction_timestamp", "source_filename"]}
-    return json.dumps(filtered, ensure_ascii=False, indent=2)
-
 #You can change the collection name to any other name.
 def save_to_mongodb_with_embedding(data: dict, embedding: list, collection_name: str = "invoices-test") -> str:
     """Save the extracted Dubai Customs certificate data and embedding to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        data["embedding"] = embedding
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "customs_certificate", collection_name, embedding)
 
 #You can change the collection name to any other name.
 def save_to_mongodb(data: Dict[str, Any], collection_name: str = "invoices-test") -> str:
     """Save the extracted Dubai Customs certificate data to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "customs_certificate", collection_name)
+
+def enrich_customs_certificate_data(certificate_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Add relationships to associated invoices if present, applied after extraction"""
+    if "invoice_number" in certificate_data:
+        certificate_data["related_documents"] = [
+            {"type": "invoice", "document_id": certificate_data["invoice_number"]}
+        ]
+    return certificate_data
 
 def process_and_save_customs_certificate(pdf_path: str, add_embedding: bool = False) -> Dict[str, Any]:
     """Process a Dubai Customs certificate PDF and save to MongoDB, with optional Gemini embedding"""
@@ -160,16 +114,12 @@ def process_and_save_customs_certificate(pdf_path: str, add_embedding: bool = Fa
             print(f"Error in extraction: {certificate_data['error']}")
             return {"status": "error", "message": f"Extraction failed: {certificate_data['error']}"}
         
-        # Add relationships to associated invoices if present
-        if "invoice_number" in certificate_data:
-            certificate_data["related_documents"] = [
-                {"type": "invoice", "document_id": certificate_data["invoice_number"]}
-            ]
+        certificate_data = enrich_customs_certificate_data(certificate_data)
             
         embedding = None
         if add_embedding:
-            certificate_text = get_certificate_text_for_embedding(certificate_data)
-            embedding = embeddings_model.embed_query(certificate_text)
+            certificate_text = document_text_for_embedding(certificate_data)
+            embedding = embed_text(certificate_text)
             print("Saving to MongoDB with embedding...")
             doc_id = save_to_mongodb_with_embedding(certificate_data, embedding)
         else:
@@ -195,9 +145,7 @@ def process_and_save_customs_certificate(pdf_path: str, add_embedding: bool = Fa
 def check_mongodb_connection() -> bool:
     """Check if MongoDB is available"""
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.server_info()
-        client.close()
+        get_mongo_client().admin.command("ping")
         return True
     except Exception as e:
         print(f"MongoDB connection error: {e}")
@@ -1,57 +1,50 @@
 import os
-import base64
+import sys
 import json
-import tempfile
-from pymongo import MongoClient
 from datetime import datetime
 from typing import Dict, Any, List
 
 # LangChain imports
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.schema import HumanMessage, SystemMessage
+from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-import fitz  
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.page_executor import map_pages
+from adapters.pdf_rasterizer import load_pdf_pages
+from adapters.embedding_service import document_text_for_embedding, embed_text
+from adapters.fallback_extraction import extract_page_json, save_extracted_document
+from adapters.vector_codec import query_vector
+from adapters.mongo_client import get_mongo_client
+from adapters.extraction_cache import file_sha256
+from config.settings import TEXT_LAYER_MODEL, VISION_MODEL
 
 # Load environment variables
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-MONGODB_URI = os.getenv("MONGO_URI")
 
-# Initialize Gemini model for vision
-vision_model = ChatGoogleGenerativeAI(model="gemini-1.5-pro", temperature=0)
+# Initialize Gemini model for vision (retries are handled by the quota scheduler)
+vision_model = ChatGoogleGenerativeAI(model=VISION_MODEL, temperature=0, max_retries=0)
 
-# Initialize Gemini embeddings model
-embeddings_model = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-exp-03-07",  # Or latest model as needed
-    task_type="RETRIEVAL_DOCUMENT"
-)
+# Cheaper text-only model for born-digital pages that have a usable text layer
+text_model = ChatGoogleGenerativeAI(model=TEXT_LAYER_MODEL, temperature=0, max_retries=0)
 
 def extract_customs_declaration_data(pdf_path: str) -> Dict[str, Any]:
     """Extract data from a UAE Federal Customs Authority declaration PDF using Gemini Vision API"""
-    with tempfile.TemporaryDirectory() as temp_dir:
-        doc = fitz.open(pdf_path)
-        all_results = []
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-            img_path = os.path.join(temp_dir, f"page_{page_num}.png")
-            pix.save(img_path)
-            with open(img_path, "rb") as img_file:
-                img_data = base64.b64encode(img_file.read()).decode("utf-8")
-            result = process_customs_declaration_with_gemini(img_data)
-            all_results.append(result)
-        doc.close()
+    # Born-digital pages go to Gemini as text, scanned pages as images
+    pages = load_pdf_pages(pdf_path, "customs_declaration")
+    # Send all pages to Gemini at once (bounded by PAGE_CONCURRENCY); results stay in page order
+    all_results = map_pages(process_customs_declaration_with_gemini, pages)
     combined_data = combine_page_results(all_results)
     combined_data["extraction_timestamp"] = datetime.now().isoformat()
     combined_data["source_filename"] = os.path.basename(pdf_path)
+    combined_data["source_sha256"] = file_sha256(pdf_path)
     combined_data["document_type"] = "customs_declaration"
     combined_data["issuing_authority"] = "UAE Federal Customs Authority"
     return combined_data
 
-def process_customs_declaration_with_gemini(image_base64: str) -> Dict[str, Any]:
-    """Process a UAE Customs declaration image with Gemini Vision API to extract data"""
-    system_message = SystemMessage(content="""
+# System prompt for the vision model; its hash versions the extraction cache
+CUSTOMS_DECLARATION_PROMPT = """
     You are a specialized customs document data extractor. Extract all relevant information from this UAE Federal Customs Authority declaration including:
     - Declaration number (DEC NO.)
     - Declaration date
@@ -76,35 +69,12 @@ def process_customs_declaration_with_gemini(image_base64: str) -> Dict[str, Any]
     
     Format your response as a clean, properly formatted JSON object. Be precise and accurate.
     Return ONLY the JSON object, nothing else.
-    """)
-    human_message = HumanMessage(
-        content=[
-            {"type": "text", "text": "Extract all information from this UAE Federal Customs Authority declaration."},
-            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_base64}"}}
-        ]
-    )
-    try:
-        response = vision_model.invoke([system_message, human_message])
-        response_text = response.content
-        import re
-        # Clean up the response to ensure it's valid JSON
-        json_match = re.search(r'```json\s*(.*?)\s*```', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(1)
-        if not response_text.strip().startswith('{'):
-            first_brace = response_text.find('{')
-            if first_brace != -1:
-                response_text = response_text[first_brace:]
-        if not response_text.strip().endswith('}'):
-            last_brace = response_text.rfind('}')
-            if last_brace != -1:
-                response_text = response_text[:last_brace+1]
-        extracted_data = json.loads(response_text)
-        return extracted_data
-    except Exception as e:
-        print(f"Error processing Customs Declaration with Gemini: {e}")
-        print(f"Response content: {response.content[:500]}...")
-        return {"error": str(e), "partial_response": response.content[:500]}
+    """
+
+def process_customs_declaration_with_gemini(page: Dict[str, str]) -> Dict[str, Any]:
+    """Process a UAE Customs declaration page (image or text layer) with Gemini to extract data"""
+    return extract_page_json(page, CUSTOMS_DECLARATION_PROMPT, "Extract all information from this UAE Federal Customs Authority declaration.",
+                             "Customs Declaration", text_model, vision_model)
 
 def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Combine results from multiple pages into a single coherent result"""
@@ -117,45 +87,41 @@ def combine_page_results(page_results: List[Dict[str, Any]]) -> Dict[str, Any]:
             if "line_items" not in combined:
                 combined["line_items"] = []
             combined["line_items"].extend(page_data["line_items"])
+    # A failed page leaves the document incomplete: report every failed page, not just the first
+    errors = [f"page {number}: {page['error']}" for number, page in enumerate(page_results, 1) if "error" in page]
+    if errors:
+        combined["error"] = "; ".join(errors)
     return combined
 
-def get_declaration_text_for_embedding(declaration_data: dict) -> str:
-    """Return a string with all declaration info except extraction_timestamp and source_filename"""
-    filtered = {k: v for k, v in declaration_data.items() if k not in ["extraction_timestamp", "source_filename"]}
-    return json.dumps(filtered, ensure_ascii=False, indent=2)
-
 #You can change the collection name to any other name.
 def save_to_mongodb_with_embedding(data: dict, embedding: list, collection_name: str = "invoices-test") -> str:
     """Save the extracted UAE Customs declaration data and embedding to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        data["embedding"] = embedding
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "customs_declaration", collection_name, embedding)
 
 #You can change the collection name to any other name.
 def save_to_mongodb(data: Dict[str, Any], collection_name: str = "invoices-test") -> str:
     """Save the extracted UAE Customs declaration data to MongoDB"""
-    try:
-        client = MongoClient(MONGODB_URI)
-        db = client.document_compliance #You can change the database name to any other name.
-        collection = db[collection_name]
-        result = collection.insert_one(data)
-        return str(result.inserted_id)
-    except Exception as e:
-        print(f"Error saving to MongoDB: {e}")
-        return None
-    finally:
-        if 'client' in locals():
-            client.close()
+    return save_extracted_document(data, "customs_declaration", collection_name)
+
+def enrich_customs_declaration_data(declaration_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Calculate totals and link related documents, applied after extraction"""
+    # Calculate total values if line items are present
+    if "line_items" in declaration_data and isinstance(declaration_data["line_items"], list):
+        total_value = sum(item.get("cif_local_value", 0) for item in declaration_data["line_items"])
+        declaration_data["calculated_total_value"] = total_value
+
+    # Add relationships to associated documents if present
+    related_docs = []
+    # Check for invoice references
+    if "invoice_reference" in declaration_data:
+        related_docs.append({"type": "invoice", "document_id": declaration_data["invoice_reference"]})
+    # Check for bill of lading/airway bill references
+    if "awb_number" in declaration_data:
+        related_docs.append({"type": "airway_bill", "document_id": declaration_data["awb_number"]})
+
+    if related_docs:
+        declaration_data["related_documents"] = related_docs
+    return declaration_data
 
 def process_and_save_customs_declaration(pdf_path: str, add_embedding: bool = False) -> Dict[str, Any]:
     """Process a UAE Customs declaration PDF and save to MongoDB, with optional Gemini embedding"""
@@ -166,27 +132,12 @@ def process_and_save_customs_declaration(pdf_path: str, add_embedding: bool = Fa
             print(f"Error in extraction: {declaration_data['error']}")
             return {"status": "error", "message": f"Extraction failed: {declaration_data['error']}"}
         
-        # Calculate total values if line items are present
-        if "line_items" in declaration_data and isinstance(declaration_data["line_items"], list):
-            total_value = sum(item.get("cif_local_value", 0) for item in declaration_data["line_items"])
-            declaration_data["calculated_total_value"] = total_value
-        
-        # Add relationships to associated documents if present
-        related_docs = []
-        # Check for invoice references
-        if "invoice_reference" in declaration_data:
-            related_docs.append({"type": "invoice", "document_id": declaration_data["invoice_reference"]})
-        # Check for bill of lading/airway bill references
-        if "awb_number" in declaration_data:
-            related_docs.append({"type": "airway_bill", "document_id": declaration_data["awb_number"]})
-        
-        if related_docs:
-            declaration_data["related_documents"] = related_docs
+        declaration_data = enrich_customs_declaration_data(declaration_data)
             
         embedding = None
         if add_embedding:
-            declaration_text = get_declaration_text_for_embedding(declaration_data)
-            embedding = embeddings_model.embed_query(declaration_text)
+            declaration_text = document_text_for_embedding(declaration_data)
+            embedding = embed_text(declaration_text)
             print("Saving to MongoDB with embedding...")
             doc_id = save_to_mongodb_with_embedding(declaration_data, embedding)
         else:
@@ -212,9 +163,7 @@ def process_and_save_customs_declaration(pdf_path: str, add_embedding: bool = Fa
 def check_mongodb_connection() -> bool:
     """Check if MongoDB is available"""
     try:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-        client.server_info()
-        client.close()
+        get_mongo_client().admin.command("ping")
         return True
     except Exception as e:
         print(f"MongoDB connection error: {e}")
@@ -23,15 +23,16 @@ except Exception as e:
     print(f"Connection failed: {e}")
     exit(1)
 
-# Configure vector index parameters
+# Configure vector index parameters (the same definition serves float32 and int8 EMBEDDING_STORAGE)
 search_index_model = SearchIndexModel(
     definition={
         "fields": [
             {
                 "type": "vector",
-                "path": "embedding",  # Your embedding field name
+                "path": "embedding",  # Your embedding field name, stored as a BSON BinData vector
                 "numDimensions": 3072,  # Match your embedding model
-                "similarity": "cosine"  # Preferred similarity metric
+                "similarity": "cosine",  # Required for int8: the per-vector quantization scale is not stored
+                "quantization": "none"  # Vectors are already compact (float32 or int8) when written
             }
         ]
     },
@@ -1,9 +1,12 @@
 # Updated vector-search.py
 import os
+import sys
 import pymongo
 import json
 from dotenv import load_dotenv
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.embedding_service import embed_text
 
 # Load environment variables with validation
 load_dotenv()
@@ -17,16 +20,9 @@ if not GOOGLE_API_KEY:
 if not MONGO_URI:
     raise ValueError("MONGO_URI not found in environment variables")
 
-# Initialize Gemini embeddings with explicit API key
-embeddings = GoogleGenerativeAIEmbeddings(
-    model="models/gemini-embedding-exp-03-07",
-    task_type="RETRIEVAL_QUERY",
-    google_api_key=GOOGLE_API_KEY  # Explicit API key setting
-)
-
-# Generate embedding for search term
+# Generate embedding for search term (repeated searches are served from the local embedding cache)
 search_term = "travel"
-query_vector = embeddings.embed_query(search_term)
+query_vector = embed_text(search_term, task_type="RETRIEVAL_QUERY")
 
 # MongoDB connection with improved error handling
 DATABASE_NAME = "document_compliance" #change to your database name
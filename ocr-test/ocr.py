@@ -2,11 +2,11 @@ import easyocr
 import os
 import re
 import json
-from pdf2image import convert_from_path
+import sys
 import numpy as np
 
-# Configure system paths (update with your Poppler path)
-os.environ["PATH"] += os.pathsep + r"C:\Users\ilfas\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.pdf_rasterizer import rasterize_pdf_images
 
 def extract_structured_data(ocr_text):
     data = {}
@@ -60,7 +60,7 @@ def extract_structured_data(ocr_text):
 
 def process_pdf_with_easyocr(pdf_path):
     reader = easyocr.Reader(['en'])
-    images = convert_from_path(pdf_path, dpi=300)
+    images = rasterize_pdf_images(pdf_path, dpi=300)
     results = []
     for idx, image in enumerate(images):
         print(f"Processing page {idx+1} with EasyOCR...")
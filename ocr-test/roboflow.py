@@ -1,17 +1,14 @@
 import os
-import base64
 import json
 import re
-from io import BytesIO
-from pdf2image import convert_from_path
-from PIL import Image
+import sys
 import requests
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.pdf_rasterizer import rasterize_pdf
 
-# Configure system paths (update with your Poppler path)
-os.environ["PATH"] += os.pathsep + r"C:\Users\ilfas\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
+load_dotenv()
 
 # Set your Roboflow API key
 API_KEY = os.getenv("ROBOFLOW_API_KEY")  # Ensure this environment variable is set
@@ -19,14 +16,8 @@ API_KEY = os.getenv("ROBOFLOW_API_KEY")  # Ensure this environment variable is s
 # Path to your PDF file
 PDF_PATH = "invoice (1).PDF"
 
-# Convert PDF pages to images
-images = convert_from_path(PDF_PATH, dpi=300)
-
-# Function to convert PIL image to base64
-def pil_to_base64(image):
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode()
+# Render PDF pages straight to base64 JPEG payloads (no temp files)
+pages = rasterize_pdf(PDF_PATH, "ocr")
 
 # Function to extract structured data from OCR result
 def extract_structured_data(ocr_text):
@@ -60,11 +51,10 @@ def extract_structured_data(ocr_text):
     return data
 
 # Process each image
-for idx, image in enumerate(images):
+for idx, page in enumerate(pages):
     print(f"Processing page {idx + 1}...")
 
-    # Convert image to base64
-    image_base64 = pil_to_base64(image)
+    image_base64 = page["image"]
 
     # Prepare payload for OCR API
     payload = {
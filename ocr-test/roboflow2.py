@@ -1,17 +1,14 @@
 import os
-import base64
 import json
 import re
-from io import BytesIO
-from pdf2image import convert_from_path
-from PIL import Image
+import sys
 import requests
 from dotenv import load_dotenv
 
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.pdf_rasterizer import rasterize_pdf
 
-# Configure system paths (update with your Poppler path)
-os.environ["PATH"] += os.pathsep + r"C:\Users\ilfas\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
+load_dotenv()
 
 # Set your Roboflow API key
 API_KEY = os.getenv("ROBOFLOW_API_KEY")
@@ -19,13 +16,8 @@ API_KEY = os.getenv("ROBOFLOW_API_KEY")
 # Path to your PDF file
 PDF_PATH = "truck consignment, exit certificate, delivery note-pages-1.pdf"
 
-# Convert PDF pages to images
-images = convert_from_path(PDF_PATH, dpi=300)
-
-def pil_to_base64(image):
-    buffered = BytesIO()
-    image.save(buffered, format="JPEG")
-    return base64.b64encode(buffered.getvalue()).decode()
+# Render PDF pages straight to base64 JPEG payloads (no temp files)
+pages = rasterize_pdf(PDF_PATH, "ocr")
 
 def extract_structured_data(ocr_text):
     data = {}
@@ -85,11 +77,10 @@ def re_search(pattern, text):
 
 # Process each image
 # Process each image
-for idx, image in enumerate(images):
+for idx, page in enumerate(pages):
     print(f"\n{'='*40}\nProcessing page {idx + 1}\n{'='*40}")
     
-    # Convert image to base64
-    image_base64 = pil_to_base64(image)
+    image_base64 = page["image"]
     
     payload = {
         "image": {"type": "base64", "value": image_base64}
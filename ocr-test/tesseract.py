@@ -1,12 +1,14 @@
 import os
 import re
 import json
-from pdf2image import convert_from_path
+import sys
 import pytesseract
 from PIL import Image
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # repo root, for adapters
+from adapters.pdf_rasterizer import rasterize_pdf_images
+
 # Configure paths
-POPPLER_PATH = r"C:\Users\ilfas\Downloads\Release-24.08.0-0\poppler-24.08.0\Library\bin"
 TESSERACT_PATH = r"C:\Program Files\Tesseract-OCR\tesseract.exe"  # Update with your Tesseract path
 
 # Configure executables
@@ -70,7 +72,7 @@ def re_search(pattern, text):
 
 def process_pdf(pdf_path):
     # Convert PDF to images
-    images = convert_from_path(pdf_path, poppler_path=POPPLER_PATH, dpi=300)
+    images = rasterize_pdf_images(pdf_path, dpi=300)
     
     results = []
     
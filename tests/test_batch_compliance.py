@@ -0,0 +1,63 @@
+import random
+from entities.document import Document
+from use_cases.batch_compliance import evaluate_batch
+from use_cases.compliance import derived_fields, empty_links, run_deterministic_checks
+
+WEIGHTS = ["1,200 kg", "1.200,0 kg", "1200", "1.2 t", "1,250.5 KG", "n/a", None]
+DATES = ["15.8.23", "2023-08-20", "08/25/2023", "15 Aug 2023", "sometime", None]
+NAMES = ["Leminar Air Conditioning", "LEMINAR AIR CONDITIONING CO LLC", "Other Trading", None]
+VEHICLES = ["DXB-12345", "dxb 12345", "DXB-99999", None]
+ITEMS = [
+    {"hs_code": "8415.10", "description": "split air conditioner", "origin": "China", "weight_kg": "600", "total_value": "5,000.00"},
+    {"hs_code": "8415.90", "description": "air conditioner parts", "origin": "Thailand", "weight_kg": "0,5 t", "total_value": 1200},
+    {"hs_code": "8418.50", "description": "display cooler", "origin": "China", "weight": "300 kg", "value": "3.000,00"},
+]
+
+def make_document(rng, doc_id, doc_type, **fields):
+    data = {"_id": doc_id, "document_type": doc_type}
+    data.update({key: value for key, value in fields.items() if value is not None})
+    if rng.random() < 0.7:
+        data.update(derived_fields(data))
+    return Document(doc_id, doc_type, data)
+
+def make_batch(size, seed=3):
+    """Shipments with any role missing and weights, dates and names in every supported spelling (or unparseable)"""
+    rng = random.Random(seed)
+    batch = []
+    for i in range(size):
+        links = empty_links()
+        links["invoice"] = make_document(rng, f"inv{i}", "leminar_invoice", invoice_number=f"LACO-{i}",
+                                         declaration_number=f"DEC-{i}", total_weight=rng.choice(WEIGHTS),
+                                         invoice_date=rng.choice(DATES), consignee_exporter=rng.choice(NAMES),
+                                         container_vehicle_number=rng.choice(VEHICLES),
+                                         line_items=rng.sample(ITEMS, rng.randint(0, len(ITEMS))))
+        if rng.random() < 0.8:
+            links["customs_declaration"] = make_document(
+                rng, f"dec{i}", "customs_declaration", declaration_number=rng.choice([f"DEC-{i}", None]),
+                gross_weight=rng.choice(WEIGHTS), consignee_exporter=rng.choice(NAMES),
+                line_items=rng.sample(ITEMS, rng.randint(0, len(ITEMS))))
+        if rng.random() < 0.7:
+            links["waybill"] = make_document(rng, f"way{i}", "waybill", crn_no=rng.choice([f"CRN-{i}", None]))
+        if rng.random() < 0.7:
+            links["customs_certificate"] = make_document(
+                rng, f"cert{i}", "customs_certificate", invoice_date=rng.choice(DATES),
+                container_vehicle_number=rng.choice(VEHICLES))
+        batch.append(links)
+    return batch
+
+def test_batch_results_match_scalar_checks():
+    batch = make_batch(200)
+    audit = evaluate_batch(batch)
+    for row, links in enumerate(batch):
+        scalar = [(result.rule_name, result.passed, result.explanation) for result in run_deterministic_checks(links)]
+        batched = [(result.rule_name, result.passed, result.explanation) for result in audit.results(row)]
+        assert batched == scalar, row
+
+def test_batch_counts_match_scalar_checks():
+    batch = make_batch(100, seed=5)
+    audit = evaluate_batch(batch)
+    scalar = [run_deterministic_checks(links) for links in batch]
+    for column, rule_name in enumerate(result.rule_name for result in scalar[0]):
+        outcomes = [results[column].passed for results in scalar]
+        assert audit.pass_counts()[rule_name] == sum(outcome is True for outcome in outcomes)
+        assert audit.applicable_counts()[rule_name] == sum(outcome is not None for outcome in outcomes)
@@ -0,0 +1,67 @@
+from entities.document import Document
+from use_cases.batch_compliance import evaluate_batch
+from use_cases.compliance import RELATED_DOC_TYPES, derived_fields, empty_links, load_shipment, run_deterministic_checks
+
+def make_document(doc_id, doc_type, **fields):
+    data = {"_id": doc_id, "document_type": doc_type, **fields}
+    data.update(derived_fields(data))
+    return Document(doc_id, doc_type, data)
+
+class InMemoryDocuments:
+    """Stands in for MongoRepository: answers the link-key queries load_shipment makes"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _matches(self, doc, clause):
+        return any(doc.data["link_keys"].get(path.split(".", 1)[1]) in condition["$in"]
+                   for path, condition in clause.items())
+
+    def find_shipment(self, invoice_key, include_embedding=False):
+        invoices = [doc for doc in self.docs if doc.data["link_keys"].get("invoice_no") == invoice_key]
+        keys = {(field, doc.data["link_keys"].get(field)) for doc in invoices for field in ("dec_no", "crn_no", "bill_no")}
+        related = [doc for doc in self.docs if doc not in invoices
+                   and any((field, value) in keys for field, value in doc.data["link_keys"].items())]
+        return invoices + related
+
+    def link_key_values(self, field, filter_dict=None):
+        # Only ever called with NON_INVOICE_FILTER
+        return sorted({doc.data["link_keys"][field] for doc in self.docs if field in doc.data["link_keys"]
+                       and not (doc.data["link_keys"].get("invoice_no") and doc.doc_type not in RELATED_DOC_TYPES)})
+
+    def get_documents(self, filter_dict, include_embedding=False):
+        return [doc for doc in self.docs if any(self._matches(doc, clause) for clause in filter_dict["$or"])]
+
+def test_invoice_lookup_links_near_match_keys_like_all_shipments():
+    invoice = make_document("inv", "leminar_invoice", invoice_number="LACO-39", declaration_number="DEC-1234567",
+                            crn_no="CRN-555000")
+    # OCR misread one digit of the declaration number; the waybill matches exactly
+    declaration = make_document("dec", "customs_declaration", declaration_number="DEC-1234561")
+    waybill = make_document("way", "waybill", crn_no="CRN-555000")
+    unrelated = make_document("other", "customs_declaration", declaration_number="DEC-9999999")
+
+    links = load_shipment(InMemoryDocuments([invoice, declaration, waybill, unrelated]), "laco 39")
+
+    assert links["invoice"] is invoice
+    assert links["customs_declaration"] is declaration
+    assert links["waybill"] is waybill
+
+def test_unknown_invoice_links_nothing():
+    declaration = make_document("dec", "customs_declaration", declaration_number="DEC-1234567")
+    links = load_shipment(InMemoryDocuments([declaration]), "LACO-40")
+    assert all(doc is None for doc in links.values())
+
+def test_stored_blocks_missing_a_field_are_recomputed():
+    invoice = make_document("inv", "leminar_invoice", invoice_number="LACO-39", declaration_number="DEC-1",
+                            total_weight="1,200 kg")
+    declaration = make_document("dec", "customs_declaration", declaration_number="DEC-1", gross_weight="1200 kg")
+    # Saved before total_weight was part of the canonical schema
+    del invoice.data["canonical"]["total_weight"]
+    del invoice.data["typed"]["total_weight_kg"]
+    links = {**empty_links(), "invoice": invoice, "customs_declaration": declaration}
+
+    scalar = {result.rule_name: result.passed for result in run_deterministic_checks(links)}
+    batch = {result.rule_name: result.passed for result in evaluate_batch([links]).results(0)}
+
+    assert scalar["Total Weight Match"] is True
+    assert batch == scalar
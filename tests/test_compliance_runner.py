@@ -0,0 +1,137 @@
+import bson
+import pytest
+from entities.document import Document
+from entities.shipment import Shipment
+from use_cases import compliance_runner
+from use_cases.compliance import COMPLIANCE_FIELDS, empty_links
+from use_cases.compliance_runner import run_compliance
+
+class InMemoryResults:
+    """Stands in for ComplianceResultRepository: stores the encoded records by key"""
+
+    def __init__(self):
+        self.records = {}
+
+    def save_encoded(self, records):
+        for key, raw in records:
+            self.records[key] = bson.decode(raw)
+        return len(records)
+
+    def get_results(self, keys):
+        return {key: self.records[key] for key in keys if key in self.records}
+
+def make_shipments(count, weight_offset=0):
+    shipments = []
+    for i in range(count):
+        links = empty_links()
+        links["invoice"] = Document(f"inv{i}", "leminar_invoice", {
+            "_id": f"inv{i}", "document_type": "leminar_invoice", "invoice_number": f"INV-{i}",
+            "total_weight": f"{100 + i} kg", "notes": "shipped on time"})
+        links["customs_declaration"] = Document(f"dec{i}", "customs_declaration", {
+            "_id": f"dec{i}", "document_type": "customs_declaration", "declaration_number": f"DEC-{i}",
+            "gross_weight": f"{100 + i + weight_offset} kg"})
+        shipments.append(Shipment(links))
+    return shipments
+
+def projected(shipments):
+    """The same shipments as --audit loads them: COMPLIANCE_FIELDS only (see load_all_shipments)"""
+    for shipment in shipments:
+        shipment.links = {role: Document(doc.doc_id, doc.doc_type, {
+            key: value for key, value in doc.data.items() if key in COMPLIANCE_FIELDS or key in ("_id", "document_type")})
+            if doc else None for role, doc in shipment.links.items()}
+    return shipments
+
+@pytest.fixture
+def rendered(monkeypatch):
+    """Counts the LLM reports generated instead of calling the model"""
+    calls = []
+
+    def fake_report(links, results):
+        calls.append(links["invoice"].doc_id)
+        return f"report for {links['invoice'].doc_id}"
+
+    monkeypatch.setattr(compliance_runner, "generate_compliance_report", fake_report)
+    return calls
+
+def test_audit_keeps_reports_for_incremental_report(rendered):
+    results = InMemoryResults()
+    run_compliance(make_shipments(20), results, workers=1, render_reports=True)
+    assert len(rendered) == 20
+
+    audit = run_compliance(projected(make_shipments(20)), results, workers=1)
+    assert audit["shipments"] == 20
+    assert all("report" in record for record in results.records.values())
+
+    rendered.clear()
+    report = run_compliance(make_shipments(20), results, workers=1, render_reports=True, incremental=True)
+    assert rendered == []
+    assert report["unchanged"] == 20
+
+def test_incremental_audit_keeps_reports_of_rechecked_shipments(rendered):
+    results = InMemoryResults()
+    run_compliance(make_shipments(5), results, workers=1, render_reports=True)
+    # A new rule definition makes every shipment re-run that rule, but nothing the reports read changed
+    for record in results.records.values():
+        record["results"][0]["fingerprint"] = "outdated"
+    audit = run_compliance(projected(make_shipments(5)), results, workers=1, incremental=True)
+    assert audit["rules_rerun"] == 5
+    assert all("report" in record for record in results.records.values())
+
+def test_incremental_reruns_only_changed_rules(rendered):
+    results = InMemoryResults()
+    first = run_compliance(make_shipments(10), results, workers=1)
+    assert first["rules_rerun"] > 0
+
+    unchanged = run_compliance(make_shipments(10), results, workers=1, incremental=True)
+    assert unchanged["unchanged"] == 10
+    assert unchanged["rules_rerun"] == 0
+
+    # Only the declaration weight changes: the weight rule (and python rules reading the declaration) re-run
+    changed = run_compliance(make_shipments(10, weight_offset=5), results, workers=1, incremental=True)
+    assert changed["unchanged"] == 0
+    assert 0 < changed["rules_rerun"] < first["rules_rerun"]
+    assert changed["pass_counts"]["Total Weight Match"] == 0
+
+def test_report_regenerated_when_its_inputs_change(rendered):
+    results = InMemoryResults()
+    run_compliance(make_shipments(5), results, workers=1, render_reports=True)
+    rendered.clear()
+    run_compliance(make_shipments(5, weight_offset=1), results, workers=1, render_reports=True, incremental=True)
+    assert len(rendered) == 5
+
+def test_full_run_rechecks_every_rule(rendered):
+    results = InMemoryResults()
+    first = run_compliance(make_shipments(5), results, workers=1)
+    again = run_compliance(make_shipments(5), results, workers=1)
+    assert again["unchanged"] == 0
+    assert again["rules_rerun"] == first["rules_rerun"]
+
+def test_rules_that_do_not_apply_are_not_counted(monkeypatch, rendered):
+    from use_cases import line_items
+    monkeypatch.setattr(line_items, "get_hs_table", lambda: None)
+    summary = run_compliance(make_shipments(4), InMemoryResults(), workers=1)
+    assert summary["applicable_counts"]["HS Code Validity"] == 0
+    assert summary["pass_counts"]["HS Code Validity"] == 0
+    assert summary["applicable_counts"]["Total Weight Match"] == 4
+    for failure in summary["failures"]:
+        hs_result = next(result for result in failure["results"] if result["label"] == "HS Code Validity")
+        assert hs_result["passed"] is None
+
+def test_reference_data_change_reruns_only_its_rule(monkeypatch, rendered):
+    from use_cases.compliance import get_rules
+    results = InMemoryResults()
+    run_compliance(make_shipments(6), results, workers=1)
+    hs_rule = next(rule for rule in get_rules() if rule.name == "HS Code Validity")
+    # A new HS table version: the same documents, but that rule's input changed
+    monkeypatch.setattr(hs_rule.validate, "reference_data", lambda: "recompiled table")
+    rerun = run_compliance(make_shipments(6), results, workers=1, incremental=True)
+    assert rerun["unchanged"] == 0
+    assert rerun["rules_rerun"] == 6
+
+def test_new_shipments_are_checked_by_an_incremental_run(rendered):
+    results = InMemoryResults()
+    run_compliance(make_shipments(3), results, workers=1)
+    summary = run_compliance(make_shipments(5), results, workers=1, incremental=True)
+    assert summary["unchanged"] == 3
+    assert summary["rules_rerun"] == 2 * len(summary["pass_counts"])
+    assert len(results.records) == 5
@@ -0,0 +1,31 @@
+import random
+from use_cases.fuzzy_keys import FuzzyKeyIndex, bounded_levenshtein
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def test_bounded_levenshtein_matches_brute_force():
+    rng = random.Random(7)
+    for _ in range(3000):
+        a = "".join(rng.choice("ab01") for _ in range(rng.randint(0, 9)))
+        b = "".join(rng.choice("ab01") for _ in range(rng.randint(0, 9)))
+        max_distance = rng.randint(0, 4)
+        distance = levenshtein(a, b)
+        assert bounded_levenshtein(a, b, max_distance) == (distance if distance <= max_distance else None), (a, b, max_distance)
+
+def test_index_finds_what_a_scan_finds():
+    rng = random.Random(11)
+    keys = sorted({"".join(rng.choice("0123456789") for _ in range(rng.randint(4, 10))) for _ in range(300)})
+    index = FuzzyKeyIndex()
+    for key in keys:
+        index.add(key, key)
+    for _ in range(200):
+        query = "".join(rng.choice("0123456789") for _ in range(rng.randint(4, 10)))
+        scanned = {key for key in keys if levenshtein(query, key) <= 2}
+        assert {key for _, key, _ in index.query(query, 2)} == scanned, query
@@ -0,0 +1,47 @@
+from datetime import datetime
+import pytest
+from use_cases.typed_values import parse_amount, parse_date, parse_weight_kg
+
+@pytest.mark.parametrize("value, expected", [
+    ("1,234.5 KG", 1234.5),
+    ("1.234,5 kg", 1234.5),
+    ("1.234.567 kg", 1234567.0),
+    ("1,200 kgs", 1200.0),
+    ("12,5 kg", 12.5),
+    ("980", 980.0),
+    ("1.2 t", 1200.0),
+    ("500 g", 0.5),
+    ({"value": "2,5", "unit": "kg"}, 2.5),
+    (75, 75.0),
+    ("n/a", None),
+    (None, None),
+])
+def test_parse_weight_kg(value, expected):
+    assert parse_weight_kg(value) == (None if expected is None else pytest.approx(expected))
+
+@pytest.mark.parametrize("value, expected", [
+    ("AED 12,500.00", {"value": 12500.0, "currency": "AED"}),
+    ("EUR 12.500,00", {"value": 12500.0, "currency": "EUR"}),
+    ("1.234,56 €", {"value": 1234.56, "currency": "EUR"}),
+    ("$1,200", {"value": 1200.0, "currency": "USD"}),
+    ({"amount": "3,75", "currency": "usd"}, {"value": 3.75, "currency": "USD"}),
+    ("none", None),
+])
+def test_parse_amount(value, expected):
+    assert parse_amount(value) == expected
+
+@pytest.mark.parametrize("value, expected", [
+    ("2023-08-15", datetime(2023, 8, 15)),
+    ("2023-08-15T10:30:00Z", datetime(2023, 8, 15, 10, 30)),
+    ("15.8.23", datetime(2023, 8, 15)),
+    ("15/08/2023", datetime(2023, 8, 15)),
+    ("15 Aug 2023", datetime(2023, 8, 15)),
+    ("Aug 15, 2023", datetime(2023, 8, 15)),
+    # Day-first wins when both readings are valid; month-first only when day-first is impossible
+    ("05/04/2023", datetime(2023, 4, 5)),
+    ("08/15/2023", datetime(2023, 8, 15)),
+    ("08-15-23", datetime(2023, 8, 15)),
+    ("not a date", None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
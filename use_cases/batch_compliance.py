@@ -0,0 +1,219 @@
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from entities.compliance_rule import ComplianceRule
+from entities.document import Document
+from entities.result import ComplianceResult
+from use_cases.compliance import canonical_of, get_rules, normalize_value, typed_of
+from use_cases.rule_dsl import COMPARISONS, explanation_templates, parse_field_ref, resolve_tolerance
+
+class ShipmentColumns:
+    """The rule fields of a batch of shipments as columns.
+
+    Each column is built once, in one pass over the batch, and shared by every rule that
+    reads it: canonical/typed blocks per role, raw values, presence masks, and typed values
+    as float64 arrays (NaN when unparsed; dates as seconds since the epoch).
+    """
+
+    def __init__(self, batch: List[Dict[str, Document]]):
+        self.batch = batch
+        self.size = len(batch)
+        self._blocks: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._columns: Dict[Tuple[str, str], Any] = {}
+
+    def _cached(self, key: Tuple[str, str], build: Callable[[], Any]) -> Any:
+        if key not in self._columns:
+            self._columns[key] = build()
+        return self._columns[key]
+
+    def _block(self, role: str, kind: str) -> List[Dict[str, Any]]:
+        if (role, kind) not in self._blocks:
+            source = typed_of if kind == "typed" else canonical_of
+            self._blocks[role, kind] = [source(links, role) for links in self.batch]
+        return self._blocks[role, kind]
+
+    def linked(self, role: str) -> np.ndarray:
+        return self._cached(("linked", role), lambda: np.fromiter(
+            (bool(links.get(role)) for links in self.batch), dtype=bool, count=self.size))
+
+    def values(self, ref: str) -> List[Any]:
+        """Raw values, kept as a list: they are only read back to fill in explanations"""
+        role, kind, field = parse_field_ref(ref, ref)
+        return self._cached(("values", ref), lambda: [block.get(field) for block in self._block(role, kind)])
+
+    def present(self, ref: str) -> np.ndarray:
+        return self._cached(("present", ref), lambda: np.fromiter(
+            map(bool, self.values(ref)), dtype=bool, count=self.size))
+
+    def typed(self, ref: str) -> Tuple[Optional[str], np.ndarray, np.ndarray]:
+        """(kind, float64 values, valid mask); kind is "number", "datetime" or None when the column mixes types"""
+        return self._cached(("typed", ref), lambda: _typed_column(self.values(ref)))
+
+_EPOCH = datetime(1970, 1, 1)
+
+def _typed_column(values: List[Any]) -> Tuple[Optional[str], np.ndarray, np.ndarray]:
+    valid = np.fromiter((value is not None for value in values), dtype=bool, count=len(values))
+    kinds = set(map(type, values)) - {type(None)}
+    if kinds <= {int, float}:
+        column = np.fromiter((np.nan if value is None else value for value in values), dtype=np.float64, count=len(values))
+        return "number", column, valid
+    if kinds <= {datetime}:
+        # Dates as float seconds since the epoch: orders and compares like the datetimes, without datetime64 conversion
+        column = np.fromiter((np.nan if value is None else (value - _EPOCH).total_seconds() for value in values),
+                             dtype=np.float64, count=len(values))
+        return "datetime", column, valid
+    return None, np.zeros(len(values)), valid
+
+def _compare_text(op: str, left: List[Any], right: List[Any], rows: np.ndarray) -> np.ndarray:
+    if op == "gte":
+        return np.array([str(left[row]) for row in rows], dtype=str) >= np.array([str(right[row]) for row in rows], dtype=str)
+    left_text = np.array([normalize_value(left[row]) for row in rows], dtype=str)
+    right_text = np.array([normalize_value(right[row]) for row in rows], dtype=str)
+    if op == "contains":
+        return np.char.find(right_text, left_text) >= 0
+    return left_text == right_text
+
+def _compare_columns(op: str, spec: Dict[str, Any], columns: ShipmentColumns, rows: np.ndarray,
+                     tolerance: float) -> np.ndarray:
+    """Vectorized equivalent of COMPARISONS[op] over the given rows of the batch"""
+    result = np.zeros(columns.size, dtype=bool)
+    text_rows = rows
+    if "typed" in spec:
+        left_kind, left_typed, left_valid = columns.typed(spec["typed"][0])
+        right_kind, right_typed, right_valid = columns.typed(spec["typed"][1])
+        both = np.zeros(columns.size, dtype=bool)
+        both[rows] = (left_valid & right_valid)[rows]
+        typed_rows = np.flatnonzero(both)
+        if left_kind is not None and left_kind == right_kind:
+            left_rows, right_rows = left_typed[typed_rows], right_typed[typed_rows]
+            if op == "gte":
+                result[typed_rows] = left_rows >= right_rows
+            elif left_kind == "number":
+                result[typed_rows] = np.abs(left_rows - right_rows) <= tolerance
+            else:
+                result[typed_rows] = left_rows == right_rows
+        else:
+            # Mixed value types: compare the rows with both typed values one by one
+            compare = COMPARISONS[op]
+            left_values, right_values = columns.values(spec["typed"][0]), columns.values(spec["typed"][1])
+            for row in typed_rows:
+                result[row] = compare(None, None, left_values[row], right_values[row], tolerance)
+        # The text comparison is only needed where the typed values do not both parse
+        text_rows = rows[~both[rows]]
+    if len(text_rows):
+        result[text_rows] = _compare_text(op, columns.values(spec["left"]), columns.values(spec["right"]), text_rows)
+    return result
+
+class RuleOutcome:
+    """One rule over a batch: complete/passed masks, with explanations rendered only when asked for"""
+
+    def __init__(self, rule: ComplianceRule, complete: np.ndarray, passed: np.ndarray,
+                 left: List[Any], right: List[Any], rendered: Optional[List[ComplianceResult]] = None,
+                 applicable: Optional[np.ndarray] = None):
+        self.rule = rule
+        self.complete = complete
+        self.passed = passed
+        # Rows the rule applies to; only python rules can report themselves not applicable
+        self.applicable = np.ones(len(passed), dtype=bool) if applicable is None else applicable
+        self.left = left
+        self.right = right
+        self.rendered = rendered
+        self.missing, self.passed_text, self.failed_text = (
+            explanation_templates(rule.spec) if rendered is None else (None, None, None))
+
+    def result(self, row: int) -> ComplianceResult:
+        if self.rendered is not None:
+            return self.rendered[row]
+        if not self.complete[row]:
+            return ComplianceResult(self.rule.name, False, self.missing)
+        template = self.passed_text if self.passed[row] else self.failed_text
+        return ComplianceResult(self.rule.name, bool(self.passed[row]),
+                                template.format(left=self.left[row], right=self.right[row]))
+
+    def results(self) -> List[ComplianceResult]:
+        if self.rendered is not None:
+            return self.rendered
+        name, missing = self.rule.name, self.missing
+        # Templates without placeholders are shared rather than formatted per row
+        passed_static = None if "{" in self.passed_text else self.passed_text
+        failed_static = None if "{" in self.failed_text else self.failed_text
+        return [
+            ComplianceResult(name, True, passed_static or self.passed_text.format(left=left, right=right))
+            if is_passed else
+            ComplianceResult(name, False, failed_static or self.failed_text.format(left=left, right=right))
+            if is_complete else
+            ComplianceResult(name, False, missing)
+            for is_complete, is_passed, left, right
+            in zip(self.complete.tolist(), self.passed.tolist(), self.left, self.right)
+        ]
+
+def evaluate_rule(rule: ComplianceRule, columns: ShipmentColumns) -> RuleOutcome:
+    """One rule over the whole batch; rules without a vectorizable definition run row by row"""
+    spec = rule.spec
+    op = spec.get("op", "present") if spec else "python"
+    empty = [None] * columns.size
+    if op != "present" and op not in COMPARISONS:
+        rendered = [ComplianceResult(rule.name, *rule.validate(links)) for links in columns.batch]
+        passed = np.fromiter((result.passed is True for result in rendered), dtype=bool, count=columns.size)
+        applicable = np.fromiter((result.passed is not None for result in rendered), dtype=bool, count=columns.size)
+        return RuleOutcome(rule, np.ones(columns.size, dtype=bool), passed, empty, empty, rendered, applicable)
+
+    complete = np.ones(columns.size, dtype=bool)
+    for role in spec.get("requires", ()):
+        complete &= columns.linked(role)
+    sides = [spec[side] for side in ("left", "right") if side in spec]
+    for ref in sides:
+        complete &= columns.present(ref)
+    passed = complete.copy()
+    if op in COMPARISONS:
+        tolerance = resolve_tolerance(spec.get("tolerance", 0.0), rule.name)
+        passed &= _compare_columns(op, spec, columns, np.flatnonzero(complete), tolerance)
+    left = columns.values(sides[0]) if sides else empty
+    right = columns.values(sides[1]) if len(sides) > 1 else empty
+    return RuleOutcome(rule, complete, passed, left, right)
+
+class BatchCheckResults:
+    """Every rule over a batch of shipments.
+
+    passed and applicable are shipments x rules boolean matrices, enough for counts and
+    filtering; the ComplianceResult objects (with their explanations) are only built for
+    the rows read.
+    """
+
+    def __init__(self, outcomes: List[RuleOutcome], size: int):
+        self.outcomes = outcomes
+        self.size = size
+        self.rule_names = [outcome.rule.name for outcome in outcomes]
+        self.passed = np.column_stack([outcome.passed for outcome in outcomes]) if outcomes \
+            else np.ones((size, 0), dtype=bool)
+        self.applicable = np.column_stack([outcome.applicable for outcome in outcomes]) if outcomes \
+            else np.ones((size, 0), dtype=bool)
+
+    def results(self, row: int) -> List[ComplianceResult]:
+        """The same results run_deterministic_checks gives for shipment `row`"""
+        return [outcome.result(row) for outcome in self.outcomes]
+
+    def pass_counts(self) -> Dict[str, int]:
+        return dict(zip(self.rule_names, self.passed.sum(axis=0).tolist()))
+
+    def applicable_counts(self) -> Dict[str, int]:
+        return dict(zip(self.rule_names, self.applicable.sum(axis=0).tolist()))
+
+    def failing_rows(self) -> List[int]:
+        """Shipments with at least one failed rule (rules that do not apply never fail)"""
+        return np.flatnonzero((self.applicable & ~self.passed).any(axis=1)).tolist()
+
+    def all_results(self) -> List[List[ComplianceResult]]:
+        if not self.outcomes:
+            return [[] for _ in range(self.size)]
+        return [list(results) for results in zip(*(outcome.results() for outcome in self.outcomes))]
+
+def evaluate_batch(batch: List[Dict[str, Document]], rules: Optional[List[ComplianceRule]] = None) -> BatchCheckResults:
+    columns = ShipmentColumns(batch)
+    rules = get_rules() if rules is None else rules
+    return BatchCheckResults([evaluate_rule(rule, columns) for rule in rules], len(batch))
+
+def run_batch_checks(batch: List[Dict[str, Document]],
+                     rules: Optional[List[ComplianceRule]] = None) -> List[List[ComplianceResult]]:
+    """run_deterministic_checks for many shipments at once: the same results, in the same order, per shipment"""
+    return evaluate_batch(batch, rules).all_results()
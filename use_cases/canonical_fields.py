@@ -0,0 +1,84 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# Gemini spells the same field differently from run to run and from one document type to
+# another. Each canonical field lists the raw spellings it is read from, in priority order;
+# a tuple is a path into nested objects. The table covers all four document types: a
+# document simply has no value for the fields its type does not carry.
+AliasPath = Union[str, Tuple[str, ...]]
+
+CANONICAL_ALIASES: Dict[str, List[AliasPath]] = {
+    "invoice_number": ["Invoice number", "invoice_number", "Invoice No."],
+    "invoice_date": ["Invoice date", "invoice_date"],
+    "declaration_number": ["Declaration Number (DEC NO.)", "declaration_number", "DEC NO.", "Declaration No."],
+    "crn_number": ["CRN No.", "crn_no", "CRN Number"],
+    "bill_number": ["bill_number", "Bill Number", "Bill No."],
+    "total_weight": ["Total weight", "total_weight"],
+    "gross_weight": ["Gross Weight", "gross_weight"],
+    "total_amount": [
+        "Total amount", "total_amount", "Total Amount",
+        ("Total amount in numbers and words", "numbers"), "Total amount in numbers and words",
+    ],
+    "currency": ["Currency", "currency"],
+    "exporter_name": [
+        ("Shipper/Exporter details", "company_name"),
+        ("Shipper/Exporter details", "Company Name"),
+        "Consignee/Exporter",
+        "consignee_exporter",
+    ],
+    "vehicle_number": ["container_vehicle_number", "Container/Vehicle Number"],
+    "lac_references": ["LAC reference numbers"],
+    "line_items": ["line_items", "Line items", "Line Items"],
+}
+
+def _vehicle_from_lac_references(canonical: Dict[str, Any]) -> Optional[str]:
+    """Leminar invoices carry the vehicle number among their LAC references (the last one mentioning DXB)"""
+    vehicle = None
+    for ref in canonical.get("lac_references") or []:
+        if isinstance(ref, str) and "DXB" in ref:
+            vehicle = ref
+    return vehicle
+
+# Fields computed from other canonical fields when no alias is present
+DERIVED_FIELDS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "vehicle_number": _vehicle_from_lac_references,
+}
+
+_MISSING = object()
+
+def _lookup(data: Dict[str, Any], path: AliasPath) -> Any:
+    """Value at an alias path, or _MISSING if any key along it is absent"""
+    value: Any = data
+    for key in ((path,) if isinstance(path, str) else path):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+def first_present(data: Dict[str, Any], aliases: List[AliasPath]) -> Any:
+    """Value of the first alias that exists in data, even if empty (None when none does)"""
+    for path in aliases:
+        value = _lookup(data, path)
+        if value is not _MISSING:
+            return value
+    return None
+
+def canonicalize(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Map raw extractor output to the fixed canonical schema (every field present, None when missing)"""
+    canonical = {}
+    for field, aliases in CANONICAL_ALIASES.items():
+        # As with the old get_first_present probing: the first alias that exists wins, even if empty
+        canonical[field] = first_present(data, aliases)
+    for field, derive in DERIVED_FIELDS.items():
+        if canonical.get(field) is None:
+            canonical[field] = derive(canonical)
+    return canonical
+
+def source_fields() -> List[str]:
+    """Top-level raw fields the alias table reads (for projections of documents saved before canonicalization)"""
+    fields = []
+    for aliases in CANONICAL_ALIASES.values():
+        for path in aliases:
+            key = path if isinstance(path, str) else path[0]
+            if key not in fields:
+                fields.append(key)
+    return fields
@@ -1,143 +1,231 @@
+import threading
 from entities.document import Document
 from entities.compliance_rule import ComplianceRule
 from entities.result import ComplianceResult
+from entities.shipment import Shipment
+from use_cases.fuzzy_keys import FuzzyKeyIndex
+from use_cases.canonical_fields import canonicalize, source_fields
+from use_cases.typed_values import typed_fields
+from config.settings import FUZZY_LINK_MAX_DISTANCE, FUZZY_LINK_MIN_CONFIDENCE
 from adapters.llm_service import LLMService
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from use_cases.compliance_rules import USER_RULES
 
 class ComplianceChecker:
     def __init__(self, rules: List[ComplianceRule]):
         self.rules = rules
 
-    def check(self, docs: List[Document]) -> List[ComplianceResult]:
+    def check(self, links: Dict[str, Document]) -> List[ComplianceResult]:
         results = []
         for rule in self.rules:
-            passed, explanation = rule.validate(docs)
+            passed, explanation = rule.validate(links)
             results.append(ComplianceResult(rule.name, passed, explanation))
         return results 
 
+# Fields linking and the rules read: the canonical and typed blocks and link keys, plus the raw aliases
+# they are derived from for documents saved before canonicalization. Linking only needs these,
+# so documents can be fetched with MongoRepository.get_documents(fields=...).
+COMPLIANCE_FIELDS = ["canonical", "typed", "link_keys"] + source_fields()
+
 # --- Robust linking logic for main compliance case ---
 def normalize_value(val):
     if not val:
         return ""
     return str(val).replace("-", "").replace(" ", "").strip().lower()
 
-def get_first_present(data, keys):
-    for key in keys:
-        if key in data:
-            return data[key]
-    return None
+EMPTY_CANONICAL = canonicalize({})
+EMPTY_TYPED = typed_fields(EMPTY_CANONICAL)
+
+def get_canonical(doc: Document) -> Dict[str, Any]:
+    """Canonical fields stored at ingest, computed on the fly for documents saved before they existed
+    (or before a field was added to the schema)"""
+    stored = doc.data.get("canonical")
+    if stored and stored.keys() >= EMPTY_CANONICAL.keys():
+        return stored
+    return canonicalize(doc.data)
+
+def get_typed(doc: Document) -> Dict[str, Any]:
+    """Parsed weights, amounts and dates stored at ingest, computed on the fly for older documents"""
+    stored = doc.data.get("typed")
+    if stored and stored.keys() >= EMPTY_TYPED.keys():
+        return stored
+    return typed_fields(get_canonical(doc))
+
+# Link key -> role of the document it identifies
+LINK_ROLES = {
+    "dec_no": "customs_declaration",
+    "crn_no": "waybill",
+    "bill_no": "customs_certificate",
+}
+
+# Types that are never the invoice of a shipment, even when they quote its invoice number
+RELATED_DOC_TYPES = {"customs_declaration", "customs_certificate", "waybill", "western_express"}
+
+def empty_links() -> Dict[str, Document]:
+    return {"invoice": None, "customs_declaration": None, "waybill": None, "customs_certificate": None}
+
+def get_link_keys(doc: Document) -> Dict[str, str]:
+    """Link keys stored at ingest, computed on the fly for documents saved before they existed"""
+    return doc.data.get("link_keys") or compute_link_keys(get_canonical(doc))
+
+def link_all_documents(docs: List[Document], fuzzy_match: bool = True) -> Tuple[List[Shipment], List[Document]]:
+    """Group every invoice with its declaration, waybill and certificate in one pass.
+
+    Non-invoice documents are hashed by their normalized DEC/CRN/bill keys, then each
+    invoice looks up its own keys (a hash join, O(N)). Keys with no exact match fall back to
+    the closest OCR-tolerant near match (see FuzzyKeyIndex), recorded with its confidence on
+    the Shipment. Returns the shipments in invoice order and the orphans: documents that
+    are neither an invoice nor linked to one.
+    """
+    keys = {id(doc): get_link_keys(doc) for doc in docs}
+    invoices = [doc for doc in docs if keys[id(doc)].get("invoice_no") and doc.doc_type not in RELATED_DOC_TYPES]
+    invoice_ids = {id(doc) for doc in invoices}
+
+    # When several documents share a key the last one wins, as in the original linear scan
+    by_key = {field: {} for field in LINK_ROLES}
+    for doc in docs:
+        if id(doc) in invoice_ids:
+            continue
+        for field in LINK_ROLES:
+            value = keys[id(doc)].get(field)
+            if value:
+                by_key[field][value] = doc
+
+    # Keys an exact lookup misses are retried against a fuzzy index (built on first use)
+    fuzzy: Dict[str, FuzzyKeyIndex] = {}
+
+    shipments, linked = [], set()
+    for invoice in invoices:
+        links = empty_links()
+        links["invoice"] = invoice
+        confidence = {"invoice": 1.0}
+        for field, role in LINK_ROLES.items():
+            value = keys[id(invoice)].get(field)
+            if not value:
+                continue
+            if value in by_key[field]:
+                links[role], confidence[role] = by_key[field][value], 1.0
+            elif fuzzy_match:
+                if field not in fuzzy:
+                    fuzzy[field] = FuzzyKeyIndex()
+                    for key, doc in by_key[field].items():
+                        fuzzy[field].add(key, doc)
+                match = fuzzy[field].best_match(value, FUZZY_LINK_MAX_DISTANCE, FUZZY_LINK_MIN_CONFIDENCE)
+                if match:
+                    links[role], _, confidence[role] = match
+            if links[role]:
+                linked.add(id(links[role]))
+        shipments.append(Shipment(links, confidence))
+    orphans = [doc for doc in docs if id(doc) not in invoice_ids and id(doc) not in linked]
+    return shipments, orphans
 
 def link_documents(docs: List[Document]) -> Dict[str, Document]:
-    links = {
-        "invoice": None,
-        "customs_declaration": None,
-        "waybill": None,
-        "customs_certificate": None
+    """Links of the first invoice's shipment (see link_all_documents for every shipment)"""
+    shipments, _ = link_all_documents(docs)
+    return shipments[0].links if shipments else empty_links()
+
+def compute_link_keys(canonical: Dict[str, Any]) -> Dict[str, str]:
+    """Normalized link keys stored with each document at ingest, so shipments can be found with indexed lookups"""
+    keys = {
+        "invoice_no": normalize_value(canonical["invoice_number"]),
+        "dec_no": normalize_value(canonical["declaration_number"]),
+        "crn_no": normalize_value(canonical["crn_number"]),
+        "bill_no": normalize_value(canonical["bill_number"]),
     }
+    return {name: value for name, value in keys.items() if value}
 
-    # Step 1: Find the invoice document
-    for doc in docs:
-        data = doc.data
-        invoice_no = get_first_present(data, ["Invoice number", "invoice_number", "Invoice No."])
-        if invoice_no:
-            links["invoice"] = doc
-            break  # Assuming only one invoice per batch
-
-    # Step 2: Extract target values from the invoice
-    target_invoice_no = normalize_value(get_first_present(links["invoice"].data, ["Invoice number", "invoice_number", "Invoice No."])) if links["invoice"] else ""
-    target_dec_no = normalize_value(get_first_present(links["invoice"].data, ["Declaration Number (DEC NO.)", "declaration_number", "DEC NO.", "Declaration No."])) if links["invoice"] else ""
-    target_crn_no = normalize_value(get_first_present(links["invoice"].data, ["CRN No.", "crn_no", "CRN Number"])) if links["invoice"] else ""
-    target_bill_no = normalize_value(get_first_present(links["invoice"].data, ["bill_number", "Bill Number", "Bill No."])) if links["invoice"] else ""
-
-    # Step 3: Match other documents using the extracted values
-    for doc in docs:
-        data = doc.data
-        # Customs Declaration
-        dec_no = get_first_present(data, ["Declaration Number (DEC NO.)", "declaration_number", "DEC NO.", "Declaration No."])
-        if normalize_value(dec_no) == target_dec_no and doc != links["invoice"]:
-            links["customs_declaration"] = doc
-        # Waybill
-        crn_no = get_first_present(data, ["CRN No.", "crn_no", "CRN Number"])
-        if normalize_value(crn_no) == target_crn_no and doc != links["invoice"]:
-            links["waybill"] = doc
-        # Customs Certificate
-        bill_no = get_first_present(data, ["bill_number", "Bill Number", "Bill No."])
-        if normalize_value(bill_no) == target_bill_no and doc != links["invoice"]:
-            links["customs_certificate"] = doc
-
-    return links
+def derived_fields(data: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields stored with a document at ingest, computed from its raw extracted data:
+    the canonical copy, its typed values and the normalized link keys"""
+    canonical = canonicalize(data)
+    return {"canonical": canonical, "typed": typed_fields(canonical), "link_keys": compute_link_keys(canonical)}
+
+# Documents link_all_documents never treats as an invoice (the complement of its invoice test)
+NON_INVOICE_FILTER = {"$or": [{"link_keys.invoice_no": {"$exists": False}},
+                              {"document_type": {"$in": sorted(RELATED_DOC_TYPES)}}]}
+
+def load_shipment(repo, invoice_no: str, include_embedding: bool = False) -> Dict[str, Document]:
+    """Link the documents of one invoice's shipment, fetched with indexed link-key queries.
+
+    The invoice number itself must match exactly (after normalization). DEC/CRN/bill keys of
+    the invoice with no exact match are retried against every stored value of that key with
+    the same near-match tolerance as link_all_documents, so the shipment links the same
+    documents as it does under --all_shipments.
+    """
+    docs = repo.find_shipment(normalize_value(invoice_no), include_embedding=include_embedding)
+    keys = [get_link_keys(doc) for doc in docs]
+    is_invoice = [bool(doc_keys.get("invoice_no")) and doc.doc_type not in RELATED_DOC_TYPES
+                  for doc, doc_keys in zip(docs, keys)]
+    near_matches = []
+    for field in LINK_ROLES:
+        wanted = {doc_keys.get(field) for doc_keys, invoice in zip(keys, is_invoice) if invoice}
+        found = {doc_keys.get(field) for doc_keys, invoice in zip(keys, is_invoice) if not invoice}
+        missing = wanted - found - {None, ""}
+        if not missing:
+            continue
+        index = FuzzyKeyIndex()
+        for value in repo.link_key_values(field, NON_INVOICE_FILTER):
+            index.add(value, value)
+        matched = [match[0] for match in (index.best_match(value, FUZZY_LINK_MAX_DISTANCE, FUZZY_LINK_MIN_CONFIDENCE)
+                                          for value in sorted(missing)) if match]
+        if matched:
+            near_matches.append({f"link_keys.{field}": {"$in": matched}})
+    if near_matches:
+        fetched = {doc.doc_id for doc in docs}
+        docs += [doc for doc in repo.get_documents({"$or": near_matches}, include_embedding)
+                 if doc.doc_id not in fetched]
+    return link_documents(docs)
+
+def load_all_shipments(repo, include_embedding: bool = False,
+                       projected: bool = False) -> Tuple[List[Shipment], List[Document]]:
+    """Link every shipment in the collection, then fetch all linked documents in full in one query.
+
+    With projected=True the documents keep only COMPLIANCE_FIELDS (all the deterministic rules
+    read) and the second fetch is skipped.
+    """
+    shipments, orphans = link_all_documents(repo.get_documents(fields=COMPLIANCE_FIELDS))
+    if projected:
+        return shipments, orphans
+    full = repo.get_documents_by_id([doc.doc_id for s in shipments for doc in s.documents()], include_embedding=include_embedding)
+    for shipment in shipments:
+        shipment.links = {key: full.get(doc.doc_id) if doc else None for key, doc in shipment.links.items()}
+    return shipments, orphans
+
+def load_linked_documents(repo, include_embedding: bool = False) -> Dict[str, Document]:
+    """Link on the projected COMPLIANCE_FIELDS, then fetch only the linked documents in full"""
+    links = link_documents(repo.get_documents(fields=COMPLIANCE_FIELDS))
+    full = repo.get_documents_by_id([doc.doc_id for doc in links.values() if doc], include_embedding=include_embedding)
+    return {key: full.get(doc.doc_id) if doc else None for key, doc in links.items()}
 
 # --- Deterministic rule functions ---
-def check_invoice_to_customs_match(links):
-    if links["invoice"] and links["customs_declaration"]:
-        return True, f"DEC Matched: {get_first_present(links['customs_declaration'].data, ['Declaration Number (DEC NO.)', 'declaration_number', 'DEC NO.', 'Declaration No.'])}"
-    return False, "DEC not matched."
-
-def check_invoice_to_waybill_match(links):
-    if links["invoice"] and links["waybill"]:
-        return True, f"CRN No. Matched: {get_first_present(links['waybill'].data, ['CRN No.', 'crn_no', 'CRN Number'])}"
-    return False, "CRN No. not matched."
-
-def check_total_weight(links):
-    invoice_weight = get_first_present(links["invoice"].data, ["Total weight", "total_weight"]) if links["invoice"] else None
-    customs_weight = get_first_present(links["customs_declaration"].data, ["Gross Weight", "gross_weight"]) if links["customs_declaration"] else None
-    if invoice_weight and customs_weight:
-        if normalize_value(invoice_weight) == normalize_value(customs_weight):
-            return True, f"Total Weight Matches ({invoice_weight})"
-        else:
-            return False, f"Weight Mismatch: Invoice: {invoice_weight}, Customs: {customs_weight}"
-    return False, "Weight data missing in one or more documents."
-
-def check_exporter_name(links):
-    invoice_exporter = get_first_present(links["invoice"].data.get("Shipper/Exporter details", {}), ["company_name", "Company Name"]) if links["invoice"] else None
-    customs_exporter = get_first_present(links["customs_declaration"].data, ["Consignee/Exporter", "consignee_exporter"]) if links["customs_declaration"] else None
-    if invoice_exporter and customs_exporter:
-        if normalize_value(invoice_exporter) in normalize_value(customs_exporter):
-            return True, "Exporter Name Consistent"
-        else:
-            return False, f"Exporter Name Mismatch: Invoice: {invoice_exporter}, Customs: {customs_exporter}"
-    return False, "Exporter name missing in one or more documents."
-
-def check_vehicle_number(links):
-    invoice_vehicle = None
-    if links["invoice"]:
-        for ref in links["invoice"].data.get("LAC reference numbers", []):
-            if isinstance(ref, str) and "DXB" in ref:
-                invoice_vehicle = ref
-    customs_vehicle = get_first_present(links["customs_certificate"].data, ["container_vehicle_number", "Container/Vehicle Number"]) if links["customs_certificate"] else None
-    if invoice_vehicle and customs_vehicle:
-        if normalize_value(invoice_vehicle) == normalize_value(customs_vehicle):
-            return True, f"Vehicle/Container Number Matches ({invoice_vehicle})"
-        else:
-            return False, f"Vehicle/Container Number Mismatch: Invoice: {invoice_vehicle}, Certificate: {customs_vehicle}"
-    return False, "Vehicle/container number missing in one or more documents."
-
-def check_invoice_date_vs_certificate(links):
-    invoice_date = get_first_present(links["invoice"].data, ["Invoice date", "invoice_date"]) if links["invoice"] else None
-    cert_date = get_first_present(links["customs_certificate"].data, ["invoice_date", "Invoice date"]) if links["customs_certificate"] else None
-    if invoice_date and cert_date:
-        if invoice_date >= cert_date:
-            return True, "Invoice Date ≥ Customs Certificate Date"
-        else:
-            return False, f"Invoice Date {invoice_date} < Certificate Date {cert_date}"
-    return False, "Invoice or certificate date missing."
-
-RULES = [
-    ("DEC Matched", check_invoice_to_customs_match),
-    ("CRN No. Matched", check_invoice_to_waybill_match),
-    ("Total Weight Match", check_total_weight),
-    ("Exporter Name Consistency", check_exporter_name),
-    ("Vehicle/Container Number Match", check_vehicle_number),
-    ("Invoice Date vs Certificate", check_invoice_date_vs_certificate),
-]
+def canonical_of(links, role) -> Dict[str, Any]:
+    """Canonical fields of a linked document, or an empty schema when the role is not linked"""
+    return get_canonical(links[role]) if links[role] else EMPTY_CANONICAL
+
+def typed_of(links, role) -> Dict[str, Any]:
+    """Typed fields of a linked document, or all None when the role is not linked"""
+    return get_typed(links[role]) if links[role] else EMPTY_TYPED
+
+_rules = None
+_rules_lock = threading.Lock()
+
+def get_rules() -> List[ComplianceRule]:
+    """Rules compiled once per process from the rules file (COMPLIANCE_RULES_PATH)"""
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                # Imported here because the rule compiler reads the field helpers defined above
+                from use_cases.rule_dsl import load_rules
+                _rules = load_rules()
+    return _rules
 
 def run_deterministic_checks(links) -> List[ComplianceResult]:
-    results = []
-    for label, func in RULES:
-        passed, explanation = func(links)
-        results.append(ComplianceResult(label, passed, explanation))
-    return results
+    return ComplianceChecker(get_rules()).check(links)
+
+def rules_prompt() -> str:
+    """The configured rules as the LLM sees them, followed by the general reporting instructions"""
+    return "\n".join(rule.description for rule in get_rules()) + "\n" + USER_RULES
 
 # --- LLM-based report generation ---
 def generate_compliance_report(links, deterministic_results) -> str:
@@ -168,7 +256,7 @@ Final Status: FAIL (2 issues found)
 """
     import json
     context = {
-        "rules": USER_RULES,
+        "rules": rules_prompt(),
         "documents": json.dumps({k: v.data if v else None for k, v in links.items()}, indent=2, default=str),
         "deterministic_results": json.dumps([
             {"label": r.rule_name, "passed": r.passed, "explanation": r.explanation} for r in deterministic_results
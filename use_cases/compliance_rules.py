@@ -1,9 +1,7 @@
+# General reporting instructions for the LLM. The rules themselves are defined in
+# compliance_rules.json and listed ahead of these lines (see use_cases.compliance.rules_prompt).
 USER_RULES = """
-Match invoice LACO-39 to customs declaration 203-04144376-23 and consignment note 319303 using the respective fields.
-Ensure invoice date is on or after customs certificate date.
-Check total weight matches across all documents.
-Check exporter name consistency.
-Check vehicle/container numbers match.
+Match each invoice to its customs declaration, waybill and customs certificate using the respective fields (DEC NO., CRN No., bill number).
 Generate a compliance report with pass/fail for each rule and explanations.
 Additionally, use any similar or related documents retrieved by vector search to inform your reasoning and catch edge cases or fuzzy matches.
-""" 
\ No newline at end of file
+"""
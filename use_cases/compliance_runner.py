@@ -0,0 +1,240 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import bson
+from adapters.compliance_result_repository import ComplianceResultRepository
+from entities.result import ComplianceResult
+from entities.shipment import Shipment
+from use_cases.batch_compliance import evaluate_batch
+from use_cases.compliance import generate_compliance_report, get_link_keys, get_rules
+from use_cases.fingerprints import RuleFingerprints
+from config.settings import (
+    COMPLIANCE_WORKERS, COMPLIANCE_CHUNK_SIZE, COMPLIANCE_IN_FLIGHT_PER_WORKER, COMPLIANCE_REPORT_THREADS,
+    MONGO_WRITE_BATCH_SIZE
+)
+
+def shipment_key(shipment: Shipment) -> str:
+    """Normalized invoice number of the shipment (its invoice's _id when it has none)"""
+    return get_link_keys(shipment.invoice).get("invoice_no") or shipment.invoice.doc_id
+
+def _chunks(shipments: Iterable[Shipment], chunk_size: int) -> Iterator[List[Tuple[str, Dict, Dict]]]:
+    chunk = []
+    for shipment in shipments:
+        chunk.append((shipment_key(shipment), shipment.links, shipment.confidence))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _summary_entry(results: List[Dict[str, Any]]) -> Tuple[bool, Dict[str, Optional[int]]]:
+    """Whether no rule failed, and per rule 1/0 for passed/failed or None when it did not apply"""
+    return (all(result["passed"] is not False for result in results),
+            {result["label"]: None if result["passed"] is None else int(result["passed"]) for result in results})
+
+def check_chunk(chunk: List[Tuple[str, Dict, Dict]], render_reports: bool = False,
+                previous: Optional[Dict[str, Dict[str, Any]]] = None, incremental: bool = True) -> Dict[str, Any]:
+    """Worker entry point: evaluate the rules for one work unit.
+
+    `previous` holds the stored records of these shipments. A stored report is kept whenever
+    its fingerprint still matches, so a run that does not render reports never drops them.
+    With incremental=True a rule only runs again where the fingerprint of its inputs changed,
+    and shipments where nothing changed are skipped; otherwise every rule runs again. Results
+    come back BSON-encoded, so serialization happens in the workers and the parent only
+    forwards bytes to MongoDB. Records whose LLM report must be (re)generated come back
+    under "needs_report" instead; the parent renders them (see _ReportRenderer).
+    """
+    rules = get_rules()
+    fingerprints = RuleFingerprints(rules)
+    previous = previous or {}
+    output = {"encoded": [], "needs_report": [], "failures": [], "pass_counts": {rule.name: 0 for rule in rules},
+              "applicable_counts": {rule.name: 0 for rule in rules},
+              "unchanged": 0, "rules_rerun": 0}
+
+    def summarize(key, results):
+        passed, per_rule = _summary_entry(results)
+        for rule_name, count in per_rule.items():
+            if count is not None:
+                output["pass_counts"][rule_name] = output["pass_counts"].get(rule_name, 0) + count
+                output["applicable_counts"][rule_name] = output["applicable_counts"].get(rule_name, 0) + 1
+        if not passed:
+            output["failures"].append({"invoice": key, "results": results})
+        return passed
+
+    stale = []
+    for key, links, confidence in chunk:
+        rule_fingerprints = fingerprints.rules_for(links)
+        stored = previous.get(key)
+        stored_results = {result["label"]: result for result in stored["results"]} if stored else {}
+        changed = [not incremental or stored_results.get(rule.name, {}).get("fingerprint") != fingerprint
+                   for rule, fingerprint in zip(rules, rule_fingerprints)]
+        needs_report_fingerprint = render_reports or (stored is not None and "report" in stored)
+        report_fingerprint = fingerprints.report_for(links, rule_fingerprints) if needs_report_fingerprint else None
+        report_stale = render_reports and (not incremental or not stored or "report" not in stored
+                                           or stored.get("report_fingerprint") != report_fingerprint)
+        if stored and not any(changed) and not report_stale:
+            output["unchanged"] += 1
+            summarize(key, stored["results"])
+            continue
+        stale.append({"key": key, "links": links, "confidence": confidence, "fingerprints": rule_fingerprints,
+                      "changed": changed, "stored": stored, "stored_results": stored_results,
+                      "report_fingerprint": report_fingerprint, "report_stale": report_stale})
+
+    # Only the rules whose inputs changed for at least one shipment are evaluated, over those shipments only
+    rerun = [i for i in range(len(rules)) if any(entry["changed"][i] for entry in stale)]
+    audit = evaluate_batch([entry["links"] for entry in stale], [rules[i] for i in rerun])
+    column = {rule_index: position for position, rule_index in enumerate(rerun)}
+    for row, entry in enumerate(stale):
+        fresh = audit.results(row)
+        results = []
+        for i, rule in enumerate(rules):
+            if entry["changed"][i]:
+                result = fresh[column[i]]
+                results.append({"label": result.rule_name, "passed": result.passed,
+                                "explanation": result.explanation, "fingerprint": entry["fingerprints"][i]})
+            else:
+                results.append(entry["stored_results"][rule.name])
+        output["rules_rerun"] += sum(entry["changed"])
+        key, links, stored = entry["key"], entry["links"], entry["stored"]
+        record = {
+            "_id": key,
+            "document_ids": {role: doc.doc_id if doc else None for role, doc in links.items()},
+            "link_confidence": entry["confidence"],
+            "passed": summarize(key, results),
+            "results": results,
+            "checked_at": datetime.now(),
+        }
+        if entry["report_stale"]:
+            record["report_fingerprint"] = entry["report_fingerprint"]
+            output["needs_report"].append(record)
+            continue
+        elif stored and "report" in stored and stored.get("report_fingerprint") == entry["report_fingerprint"]:
+            # Nothing the report reads changed: keep it even though this run does not render reports
+            record["report"], record["report_fingerprint"] = stored["report"], entry["report_fingerprint"]
+        output["encoded"].append((key, bson.encode(record)))
+    return output
+
+def _render_report(record: Dict[str, Any], links: Dict) -> Tuple[str, bytes]:
+    checked = [ComplianceResult(result["label"], result["passed"], result["explanation"]) for result in record["results"]]
+    record["report"] = generate_compliance_report(links, checked)
+    return record["_id"], bson.encode(record)
+
+class _ReportRenderer:
+    """Generates the LLM reports workers leave pending on a thread pool in the parent.
+
+    Every call goes through this process's one quota scheduler however many workers check
+    the rules, so the threads only overlap the waiting on Gemini. A worker's output is
+    released (see collect) once all of its reports are rendered.
+    """
+
+    def __init__(self, threads: int = COMPLIANCE_REPORT_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.pending: List[Tuple[Dict[str, Any], List[Future]]] = []
+
+    def submit(self, output: Dict[str, Any], chunk: List[Tuple[str, Dict, Dict]]):
+        links_by_key = {key: links for key, links, _ in chunk}
+        futures = [self.executor.submit(_render_report, record, links_by_key[record["_id"]])
+                   for record in output.pop("needs_report", [])]
+        self.pending.append((output, futures))
+
+    def running(self) -> List[Future]:
+        return [future for _, futures in self.pending for future in futures if not future.done()]
+
+    def collect(self, collector: "_Collector", block: bool = False):
+        """Hand every output whose reports are all rendered to the collector (all of them when block=True)"""
+        remaining = []
+        for output, futures in self.pending:
+            if block or all(future.done() for future in futures):
+                output["encoded"].extend(future.result() for future in futures)
+                collector.add(output)
+            else:
+                remaining.append((output, futures))
+        self.pending = remaining
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+class _Collector:
+    """Merges worker output in the parent and writes it back in MONGO_WRITE_BATCH_SIZE bulk upserts"""
+
+    def __init__(self, results_repo: ComplianceResultRepository):
+        self.results_repo = results_repo
+        self.buffer: List[Tuple[str, bytes]] = []
+        self.stats = {"shipments": 0, "failed": 0, "unchanged": 0, "rules_rerun": 0, "written": 0}
+        self.pass_counts: Dict[str, int] = {}
+        self.applicable_counts: Dict[str, int] = {}
+        self.failures: List[Dict[str, Any]] = []
+
+    def add(self, output: Dict[str, Any]):
+        self.buffer.extend(output["encoded"])
+        self.failures.extend(output["failures"])
+        self.stats["shipments"] += len(output["encoded"]) + output["unchanged"]
+        self.stats["failed"] += len(output["failures"])
+        self.stats["unchanged"] += output["unchanged"]
+        self.stats["rules_rerun"] += output["rules_rerun"]
+        for rule_name, passed in output["pass_counts"].items():
+            self.pass_counts[rule_name] = self.pass_counts.get(rule_name, 0) + passed
+        for rule_name, applicable in output["applicable_counts"].items():
+            self.applicable_counts[rule_name] = self.applicable_counts.get(rule_name, 0) + applicable
+        if len(self.buffer) >= MONGO_WRITE_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stats["written"] += self.results_repo.save_encoded(self.buffer)
+            self.buffer = []
+
+def run_compliance(shipments: Iterable[Shipment], results_repo: Optional[ComplianceResultRepository] = None,
+                   workers: int = COMPLIANCE_WORKERS, chunk_size: int = COMPLIANCE_CHUNK_SIZE,
+                   render_reports: bool = False, incremental: bool = False) -> Dict[str, Any]:
+    """Check shipments across `workers` processes and store their results in bulk.
+
+    Shipments are cut into chunks of `chunk_size`; at most COMPLIANCE_IN_FLIGHT_PER_WORKER
+    chunks per worker are queued at once, so memory stays bounded however many shipments
+    the iterable yields. Each chunk's stored records are fetched (one query per chunk), so
+    reports whose inputs did not change are kept; with incremental=True only what changed
+    since the last run is recomputed.
+    Workers are spawned rather than forked, so none inherits this process's MongoDB client;
+    LLM reports are rendered here on COMPLIANCE_REPORT_THREADS threads, under the single
+    shared quota (see _ReportRenderer). Chunks whose reports are still rendering count
+    towards the in-flight limit.
+    Returns the counts, per-rule pass counts (out of the shipments each rule applied to) and
+    failing shipments.
+    """
+    results_repo = results_repo or ComplianceResultRepository()
+    collector = _Collector(results_repo)
+
+    def work_units():
+        for chunk in _chunks(shipments, max(1, chunk_size)):
+            yield chunk, results_repo.get_results(key for key, _, _ in chunk)
+
+    max_in_flight = max(1, workers) * max(1, COMPLIANCE_IN_FLIGHT_PER_WORKER)
+    renderer = _ReportRenderer()
+    try:
+        if workers <= 1:
+            for chunk, previous in work_units():
+                while len(renderer.pending) >= max_in_flight:
+                    wait(renderer.running(), return_when=FIRST_COMPLETED)
+                    renderer.collect(collector)
+                renderer.submit(check_chunk(chunk, render_reports, previous, incremental), chunk)
+                renderer.collect(collector)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = {}
+                for chunk, previous in work_units():
+                    while len(pending) + len(renderer.pending) >= max_in_flight:
+                        done, _ = wait(list(pending) + renderer.running(), return_when=FIRST_COMPLETED)
+                        for future in done & pending.keys():
+                            renderer.submit(future.result(), pending.pop(future))
+                        renderer.collect(collector)
+                    pending[executor.submit(check_chunk, chunk, render_reports, previous, incremental)] = chunk
+                for future in wait(pending).done:
+                    renderer.submit(future.result(), pending[future])
+                    renderer.collect(collector)
+        renderer.collect(collector, block=True)
+    finally:
+        renderer.close()
+    collector.flush()
+    return {**collector.stats, "pass_counts": collector.pass_counts,
+            "applicable_counts": collector.applicable_counts, "failures": collector.failures}
@@ -1,10 +1,17 @@
 from entities.document import Document
 from typing import List, Dict, Any, Optional
-from fallbacks.extract_invoice2 import extract_leminar_invoice_data
-from fallbacks.extract_invoice3 import extract_western_express_data
-from fallbacks.extract_invoice4 import extract_customs_certificate_data
-from fallbacks.extract_invoice5 import extract_customs_declaration_data
+from adapters.extraction_cache import ExtractionCache, file_sha256, prompt_version
+from adapters.pdf_rasterizer import get_render_profile, pdf_page_count
+from adapters.embedding_service import document_text_for_embedding, embed_texts
+from config.settings import BATCH_CONCURRENCY, TEXT_LAYER_ENABLED, TEXT_LAYER_MIN_CHARS, TEXT_LAYER_MODEL, VISION_MODEL
+from use_cases.compliance import derived_fields
+from fallbacks.extract_invoice2 import extract_leminar_invoice_data, enrich_leminar_invoice_data, LEMINAR_INVOICE_PROMPT
+from fallbacks.extract_invoice3 import extract_western_express_data, WESTERN_EXPRESS_PROMPT
+from fallbacks.extract_invoice4 import extract_customs_certificate_data, enrich_customs_certificate_data, CUSTOMS_CERTIFICATE_PROMPT
+from fallbacks.extract_invoice5 import extract_customs_declaration_data, enrich_customs_declaration_data, CUSTOMS_DECLARATION_PROMPT
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
 
 EXTRACTION_MAP = {
     'leminar_invoice': extract_leminar_invoice_data,
@@ -13,6 +20,31 @@ EXTRACTION_MAP = {
     'customs_declaration': extract_customs_declaration_data,
 }
 
+# Type-specific post-processing applied after extraction (same as in the process_and_save_* functions)
+ENRICH_MAP = {
+    'leminar_invoice': enrich_leminar_invoice_data,
+    'customs_certificate': enrich_customs_certificate_data,
+    'customs_declaration': enrich_customs_declaration_data,
+}
+
+def extraction_version(doc_type: str, prompt: str) -> str:
+    """Version of an extraction in the cache: the prompt plus every setting that changes what Gemini sees"""
+    return prompt_version(prompt, {
+        'vision_model': VISION_MODEL,
+        'text_model': TEXT_LAYER_MODEL,
+        'text_layer': TEXT_LAYER_ENABLED,
+        'text_layer_min_chars': TEXT_LAYER_MIN_CHARS,
+        'render_profile': get_render_profile(doc_type),
+    })
+
+# Versions of the extraction cache: editing a prompt, a model or a page setting forces re-extraction
+PROMPT_VERSIONS = {
+    'leminar_invoice': extraction_version('leminar_invoice', LEMINAR_INVOICE_PROMPT),
+    'western_express': extraction_version('western_express', WESTERN_EXPRESS_PROMPT),
+    'customs_certificate': extraction_version('customs_certificate', CUSTOMS_CERTIFICATE_PROMPT),
+    'customs_declaration': extraction_version('customs_declaration', CUSTOMS_DECLARATION_PROMPT),
+}
+
 def detect_document_type(filename: str) -> Optional[str]:
     name = filename.lower()
     if 'leminar' in name or 'invoice' in name:
@@ -25,36 +57,115 @@ def detect_document_type(filename: str) -> Optional[str]:
         return 'customs_declaration'
     return None
 
-def batch_extract(files: List[str], doc_type: str = None, add_embedding: bool = True) -> List[Document]:
-    results = []
-    for file_path in files:
+def extract_file(file_path: str, doc_type: str = None, cache: Optional[ExtractionCache] = None) -> Dict[str, Any]:
+    """Extract a single PDF. Failures are reported in the returned summary instead of raised,
+    so one bad file cannot take down a batch."""
+    started = time.perf_counter()
+    summary = {'file': file_path, 'document_type': None, 'pages': 0, 'cached': False}
+    try:
         if not os.path.isfile(file_path):
-            continue
+            summary.update(status='error', message='File not found')
+            return summary
         dtype = doc_type or detect_document_type(file_path)
+        summary['document_type'] = dtype
         if dtype not in EXTRACTION_MAP:
-            continue
-        print(f"Extracting {file_path} as {dtype}...")
-
-        # Use the process_and_save_* function for each type
-        if dtype == 'leminar_invoice':
-            from fallbacks.extract_invoice2 import process_and_save_leminar_invoice
-            result = process_and_save_leminar_invoice(file_path, add_embedding=add_embedding)
-            data = result.get("data", {})
-        elif dtype == 'western_express':
-            from fallbacks.extract_invoice3 import process_and_save_western_express
-            result = process_and_save_western_express(file_path, add_embedding=add_embedding)
-            data = result.get("data", {})
-        elif dtype == 'customs_certificate':
-            from fallbacks.extract_invoice4 import process_and_save_customs_certificate
-            result = process_and_save_customs_certificate(file_path, add_embedding=add_embedding)
-            data = result.get("data", {})
-        elif dtype == 'customs_declaration':
-            from fallbacks.extract_invoice5 import process_and_save_customs_declaration
-            result = process_and_save_customs_declaration(file_path, add_embedding=add_embedding)
-            data = result.get("data", {})
+            summary.update(status='error', message=f'Unknown document type: {dtype}')
+            return summary
+        summary['pages'] = pdf_page_count(file_path)
+
+        # Serve previously extracted files from the cache before rendering anything
+        file_hash = file_sha256(file_path)
+        data = cache.get(file_hash, dtype, PROMPT_VERSIONS[dtype]) if cache else None
+        if data is not None:
+            print(f"Using cached extraction for {file_path} ({dtype})")
+            summary['cached'] = True
         else:
+            print(f"Extracting {file_path} as {dtype}...")
             data = EXTRACTION_MAP[dtype](file_path)
+            if "error" in data:
+                summary.update(status='error', message=f"Extraction failed: {data['error']}")
+                return summary
+            if dtype in ENRICH_MAP:
+                data = ENRICH_MAP[dtype](data)
+            if cache:
+                cache.put(file_hash, dtype, PROMPT_VERSIONS[dtype], data)
+
+        # Natural key of the saved record (see MongoRepository.save_documents); older cache entries lack it
+        data.setdefault('source_sha256', file_hash)
+        # Fixed-schema copy of the fields linking and the rules read (whatever keys Gemini used), its
+        # weights, amounts and dates parsed once, and the normalized link keys indexed in MongoDB
+        data.update(derived_fields(data))
+        summary.update(status='success', message='', document=Document(doc_id=file_path, doc_type=dtype, data=data))
+    except Exception as e:
+        summary.update(status='error', message=str(e))
+    finally:
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+    return summary
+
+def embed_documents(docs: List[Document]):
+    """Embed all documents of a batch in a few batched embed_documents calls"""
+    if not docs:
+        return
+    texts = [document_text_for_embedding(doc.data) for doc in docs]
+    for doc, vector in zip(docs, embed_texts(texts)):
+        doc.embedding = vector
+
+def extract_batch(files: List[str], doc_type: str = None, add_embedding: bool = True, use_cache: bool = True,
+                  concurrency: int = BATCH_CONCURRENCY) -> Dict[str, Any]:
+    """Extract many PDFs in parallel (up to `concurrency` files at a time), embed them in batches
+    and return the documents, the per-file results summary and throughput stats.
+    Saving is left to the caller (see MongoRepository.save_documents)."""
+    cache = ExtractionCache() if use_cache else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(lambda f: extract_file(f, doc_type, cache), files))
+
+    succeeded = [r for r in results if r['status'] == 'success']
+    documents = [r.pop('document') for r in succeeded]
+    embedding_error = None
+    if add_embedding:
+        try:
+            embed_documents(documents)
+        except Exception as e:
+            # Keep the extracted documents; they can still be saved and re-embedded later
+            print(f"Embedding failed: {e}")
+            embedding_error = str(e)
+    elapsed = time.perf_counter() - started
+
+    pages = sum(r['pages'] for r in succeeded)
+    minutes = max(elapsed, 1e-9) / 60
+    stats = {
+        'files': len(results),
+        'succeeded': len(succeeded),
+        'failed': len(results) - len(succeeded),
+        'pages': pages,
+        'seconds': round(elapsed, 2),
+        'docs_per_min': round(len(succeeded) / minutes, 1),
+        'pages_per_min': round(pages / minutes, 1),
+    }
+    if embedding_error:
+        stats['embedding_error'] = embedding_error
+    if cache:
+        stats['cache'] = cache.stats()
+        cache.close()
+    return {
+        'documents': documents,
+        'results': results,
+        'stats': stats,
+    }
+
+def print_batch_summary(batch: Dict[str, Any]):
+    print('\nBatch Processing Summary:')
+    for res in batch['results']:
+        print(f"- {res['file']}: {res['status']} {res.get('message', '')}")
+    stats = batch['stats']
+    print(f"{stats['succeeded']}/{stats['files']} files, {stats['pages']} pages in {stats['seconds']}s "
+          f"({stats['docs_per_min']} docs/min, {stats['pages_per_min']} pages/min)")
+    if 'cache' in stats:
+        print(f"Extraction cache: {stats['cache']['hits']} hits, {stats['cache']['misses']} misses, {stats['cache']['entries']} entries")
 
-        doc = Document(doc_id=file_path, doc_type=dtype, data=data)
-        results.append(doc)
-    return results 
\ No newline at end of file
+def batch_extract(files: List[str], doc_type: str = None, add_embedding: bool = True, use_cache: bool = True,
+                  concurrency: int = BATCH_CONCURRENCY) -> List[Document]:
+    batch = extract_batch(files, doc_type=doc_type, add_embedding=add_embedding, use_cache=use_cache, concurrency=concurrency)
+    print_batch_summary(batch)
+    return batch['documents']
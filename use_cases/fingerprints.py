@@ -0,0 +1,62 @@
+import hashlib
+import json
+from typing import Any, Callable, Dict, List, Optional
+from entities.compliance_rule import ComplianceRule
+from entities.document import Document
+from use_cases.compliance import COMPLIANCE_FIELDS, get_canonical, get_typed
+from use_cases.rule_dsl import ROLES, compile_field_ref
+
+def digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def rule_view(doc: Optional[Document]) -> Optional[Dict[str, Any]]:
+    """What any rule can read from a document: its COMPLIANCE_FIELDS, with canonical and typed filled in.
+
+    The same with projected and fully loaded documents, so an audit and a report run agree.
+    """
+    if doc is None:
+        return None
+    view = {field: doc.data[field] for field in COMPLIANCE_FIELDS if field in doc.data}
+    view["canonical"] = get_canonical(doc)
+    view["typed"] = get_typed(doc)
+    return view
+
+class RuleFingerprints:
+    """Digests of the exact inputs of each rule, and of the inputs of a shipment's LLM report.
+
+    A DSL rule reads which required documents are linked and the fields it references;
+    a python rule reads the rule view of the documents in its "reads" roles (all by default),
+    plus whatever its function's reference_data() reports (the version of a reference table).
+    Each digest also covers the rule definition, so editing a rule invalidates its results.
+    """
+
+    def __init__(self, rules: List[ComplianceRule]):
+        self.rules = rules
+        self._inputs: List[Callable[[Dict[str, Optional[Document]]], Any]] = [self._compile(rule) for rule in rules]
+
+    @staticmethod
+    def _compile(rule: ComplianceRule) -> Callable[[Dict[str, Optional[Document]]], Any]:
+        spec = rule.spec or {"name": rule.name}
+        definition = json.dumps(spec, sort_keys=True, default=str)
+        if spec.get("op") == "python" or rule.spec is None:
+            roles = tuple(spec.get("reads", ROLES))
+            reference_data = getattr(rule.validate, "reference_data", None) or (lambda: None)
+            return lambda links: [definition, reference_data(), [rule_view(links.get(role)) for role in roles]]
+        requires = tuple(spec.get("requires", ()))
+        refs = [spec[side] for side in ("left", "right") if side in spec] + list(spec.get("typed", ()))
+        getters = [compile_field_ref(ref, rule.name) for ref in refs]
+        return lambda links: [definition, [bool(links.get(role)) for role in requires],
+                              [getter(links) for getter in getters]]
+
+    def rules_for(self, links: Dict[str, Optional[Document]]) -> List[str]:
+        """One fingerprint per rule, in rule order"""
+        return [digest(inputs(links)) for inputs in self._inputs]
+
+    def report_for(self, links: Dict[str, Optional[Document]], rule_fingerprints: List[str]) -> str:
+        """The rule fingerprints plus which documents are linked and their rule views.
+
+        Built only from what a projected load (--audit) also has, so an audit computes the
+        same fingerprint as the --report run that rendered the report and keeps it.
+        """
+        linked = {role: [doc.doc_id, rule_view(doc)] if doc else None for role, doc in links.items()}
+        return digest([rule_fingerprints, linked])
@@ -0,0 +1,100 @@
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Characters OCR commonly confuses with digits; both sides of a comparison are folded the same way
+OCR_CONFUSIONS = str.maketrans({"o": "0", "q": "0", "i": "1", "l": "1", "s": "5", "b": "8", "z": "2"})
+
+def fold_ocr(key: str) -> str:
+    return key.lower().translate(OCR_CONFUSIONS)
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> Optional[int]:
+    """Edit distance between a and b, or None as soon as it is known to exceed max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        # Only cells within max_distance of the diagonal can stay under the bound
+        low, high = max(1, i - max_distance), min(len(b), i + max_distance)
+        if low > 1:
+            current[low - 1] = max_distance + 1
+        for j in range(low, high + 1):
+            cost = 0 if ca == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+        if high < len(b):
+            current[high + 1:] = [max_distance + 1] * (len(b) - high)
+        if min(current[low - 1:high + 1]) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+def _grams(key: str, q: int) -> List[str]:
+    padded = "#" * (q - 1) + key + "$" * (q - 1)
+    return [padded[i:i + q] for i in range(len(padded) - q + 1)]
+
+class FuzzyKeyIndex:
+    """Near-match lookup of identifiers (DEC/CRN/bill/invoice numbers) with OCR damage.
+
+    Keys are OCR-folded and split into q-grams kept in an inverted index. A query only
+    verifies keys that share enough q-grams to be within max_distance edits (the q-gram
+    count filter), so lookups touch a small candidate set instead of every key. Short
+    keys, where the filter cannot prune, are compared within their length bucket.
+    """
+
+    def __init__(self, q: int = 3):
+        self.q = q
+        self.keys: List[str] = []
+        self.items: List[Any] = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.by_length: Dict[int, List[int]] = defaultdict(list)
+
+    def add(self, key: str, item: Any):
+        folded = fold_ocr(key)
+        position = len(self.keys)
+        self.keys.append(key)
+        self.items.append(item)
+        for gram in set(_grams(folded, self.q)):
+            self.postings[gram].append(position)
+        self.by_length[len(folded)].append(position)
+
+    def _candidates(self, folded: str, max_distance: int) -> List[int]:
+        # Each edit destroys at most q of the query's distinct q-grams (the q-gram count filter)
+        grams = set(_grams(folded, self.q))
+        min_shared = len(grams) - max_distance * self.q
+        if min_shared <= 0:
+            return [position for length in range(len(folded) - max_distance, len(folded) + max_distance + 1)
+                    for position in self.by_length.get(length, [])]
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        return [position for position, count in shared.items() if count >= min_shared]
+
+    def query(self, key: str, max_distance: int) -> List[Tuple[Any, str, float]]:
+        """Items whose key is within max_distance edits, as (item, key, confidence), best first.
+
+        Confidence is 1 - distance / length, averaging the distance after OCR folding with the
+        raw distance, so an O/0 confusion costs half as much as a genuine wrong character.
+        """
+        folded = fold_ocr(key)
+        matches = []
+        for position in self._candidates(folded, max_distance):
+            candidate = self.keys[position]
+            distance = bounded_levenshtein(folded, fold_ocr(candidate), max_distance)
+            if distance is None:
+                continue
+            raw = bounded_levenshtein(key, candidate, max(len(key), len(candidate)))
+            confidence = 1.0 - (distance + raw) / (2.0 * max(len(key), len(candidate), 1))
+            matches.append((self.items[position], candidate, confidence))
+        matches.sort(key=lambda match: -match[2])
+        return matches
+
+    def best_match(self, key: str, max_distance: int, min_confidence: float) -> Optional[Tuple[Any, str, float]]:
+        """The single best near match, or None if there is none or two different items tie for it"""
+        matches = [match for match in self.query(key, max_distance) if match[2] >= min_confidence]
+        if not matches:
+            return None
+        if len(matches) > 1 and matches[1][2] == matches[0][2] and matches[1][0] is not matches[0][0]:
+            return None
+        return matches[0]
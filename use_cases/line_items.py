@@ -0,0 +1,243 @@
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+from adapters.hs_code_table import get_hs_table
+from use_cases.canonical_fields import AliasPath, canonicalize, first_present
+from use_cases.compliance import get_canonical
+from use_cases.typed_values import parse_amount, parse_number, parse_weight_kg
+from config.settings import (
+    LINE_ITEM_WEIGHT_TOLERANCE, LINE_ITEM_VALUE_TOLERANCE, LINE_ITEM_QUANTITY_TOLERANCE, LINE_ITEM_MIN_SIMILARITY
+)
+
+# Item keys as the Leminar invoice and customs declaration extractors spell them, in priority order
+LINE_ITEM_ALIASES: Dict[str, List[AliasPath]] = {
+    "hs_code": ["hs_code", "HS code", "HS Code", "hs", "HS"],
+    "description": ["description", "goods_description", "Description", "Goods description"],
+    "origin": ["origin", "Origin", "country_of_origin"],
+    "weight": ["weight_kg", "weight", "Weight (KG)", "weight_in_kg", "net_weight", "gross_weight"],
+    "quantity": ["quantity", "Quantity", "qty"],
+    # Values in the invoice currency only: cif_local_value (CIF in the declaring country's currency) is left out,
+    # as no exchange rate is extracted to convert it; items without a comparable value are not compared on value
+    "value": ["total_value", "Total value", "value", "cif_value"],
+}
+
+# Digits of the internationally harmonized part of an HS code; national subheadings follow
+HS_SHARED_DIGITS = 6
+
+# Description words on more declaration lines than this do not propose description matches
+MAX_WORD_POSTINGS = 50
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+class LineItem:
+    def __init__(self, position: int, raw: Dict[str, Any]):
+        values = {field: first_present(raw, aliases) for field, aliases in LINE_ITEM_ALIASES.items()}
+        self.position = position
+        self.hs_code = re.sub(r"\D", "", str(values["hs_code"] or ""))
+        self.description = str(values["description"] or "")
+        self.words = frozenset(_WORD.findall(self.description.lower()))
+        self.origin = str(values["origin"] or "").strip()
+        self.weight_kg = parse_weight_kg(values["weight"])
+        self.quantity = parse_number(values["quantity"])
+        amount = parse_amount(values["value"])
+        self.value = amount["value"] if amount else None
+
+    def label(self) -> str:
+        return f"HS {self.hs_code}" if self.hs_code else f"'{self.description[:40]}'"
+
+def line_items_of(doc) -> List[LineItem]:
+    """Parsed line items of a document (canonical first, raw data for documents saved before line items were canonical)"""
+    items = get_canonical(doc).get("line_items")
+    if items is None:
+        items = canonicalize(doc.data).get("line_items")
+    return [LineItem(position, item) for position, item in enumerate(items or []) if isinstance(item, dict)]
+
+def _within(a: Optional[float], b: Optional[float], tolerance: float) -> bool:
+    """Relative tolerance (as an absolute one below 1 kg/unit/AED); a side with no value is not compared"""
+    if a is None or b is None:
+        return True
+    return abs(a - b) <= tolerance * max(abs(a), abs(b), 1.0)
+
+class _Group:
+    """Items sharing a match key, compared on their totals (a declaration often merges invoice lines of one HS code)"""
+
+    def __init__(self, items: List[LineItem]):
+        self.items = items
+        self.weight_kg = _total(item.weight_kg for item in items)
+        self.quantity = _total(item.quantity for item in items)
+        self.value = _total(item.value for item in items)
+
+def _total(values) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+class Reconciliation:
+    def __init__(self):
+        self.matches: List[Tuple[str, _Group, _Group]] = []
+        self.unmatched_invoice: List[LineItem] = []
+        self.unmatched_declaration: List[LineItem] = []
+
+    def deltas(self) -> List[str]:
+        issues = []
+        for via, invoice, declaration in self.matches:
+            label = invoice.items[0].label() if via != "description" else \
+                f"{invoice.items[0].label()} ~ {declaration.items[0].label()}"
+            if not _within(invoice.weight_kg, declaration.weight_kg, LINE_ITEM_WEIGHT_TOLERANCE):
+                issues.append(f"{label} weight {invoice.weight_kg:g} kg vs {declaration.weight_kg:g} kg")
+            if not _within(invoice.quantity, declaration.quantity, LINE_ITEM_QUANTITY_TOLERANCE):
+                issues.append(f"{label} quantity {invoice.quantity:g} vs {declaration.quantity:g}")
+            if not _within(invoice.value, declaration.value, LINE_ITEM_VALUE_TOLERANCE):
+                issues.append(f"{label} value {invoice.value:,.2f} vs {declaration.value:,.2f}")
+        return issues
+
+def _hs_code(item: LineItem) -> str:
+    return item.hs_code
+
+def _hs_heading(item: LineItem) -> str:
+    return item.hs_code[:HS_SHARED_DIGITS] if len(item.hs_code) >= HS_SHARED_DIGITS else ""
+
+def _group_by(items: List[LineItem], key) -> Dict[str, List[LineItem]]:
+    groups = defaultdict(list)
+    for item in items:
+        if key(item):
+            groups[key(item)].append(item)
+    return groups
+
+def _join(result: Reconciliation, invoice_items: List[LineItem], declaration_items: List[LineItem],
+          key, via: str) -> Tuple[List[LineItem], List[LineItem]]:
+    """Hash join on `key`; returns the items of both sides left without a partner"""
+    invoice_groups, declaration_groups = _group_by(invoice_items, key), _group_by(declaration_items, key)
+    matched = invoice_groups.keys() & declaration_groups.keys()
+    for match_key in sorted(matched):
+        result.matches.append((via, _Group(invoice_groups[match_key]), _Group(declaration_groups[match_key])))
+    return ([item for item in invoice_items if key(item) not in matched],
+            [item for item in declaration_items if key(item) not in matched])
+
+def _match_descriptions(result: Reconciliation, invoice_items: List[LineItem],
+                        declaration_items: List[LineItem]) -> Tuple[List[LineItem], List[LineItem]]:
+    """Pair leftover items by description word overlap (Jaccard), best pairs first.
+
+    Candidates come from an inverted index of description words, so each item is only
+    scored against items sharing a distinctive word with it rather than against every
+    leftover item.
+    """
+    postings = defaultdict(list)
+    for index, item in enumerate(declaration_items):
+        for word in item.words:
+            postings[word].append(index)
+    pairs = []
+    for invoice_index, item in enumerate(invoice_items):
+        candidates = set()
+        for word in item.words:
+            posting = postings.get(word, ())
+            # Words on most lines ("unit", "pcs") act as stop words: they would make every item a candidate
+            if len(posting) <= MAX_WORD_POSTINGS:
+                candidates.update(posting)
+        for index in candidates:
+            other = declaration_items[index].words
+            similarity = len(item.words & other) / len(item.words | other)
+            if similarity >= LINE_ITEM_MIN_SIMILARITY:
+                pairs.append((similarity, invoice_index, index))
+    used_invoice, used_declaration = set(), set()
+    for similarity, invoice_index, index in sorted(pairs, key=lambda pair: -pair[0]):
+        if invoice_index in used_invoice or index in used_declaration:
+            continue
+        used_invoice.add(invoice_index)
+        used_declaration.add(index)
+        result.matches.append(("description", _Group([invoice_items[invoice_index]]), _Group([declaration_items[index]])))
+    return ([item for i, item in enumerate(invoice_items) if i not in used_invoice],
+            [item for i, item in enumerate(declaration_items) if i not in used_declaration])
+
+def reconcile_line_items(invoice_items: List[LineItem], declaration_items: List[LineItem]) -> Reconciliation:
+    """Match invoice and declaration line items, each step taking what the previous one left.
+
+    Full HS code, then its harmonized first six digits, then description similarity. Every
+    step is a hash join or an indexed lookup, so the work grows with the number of items,
+    not their product.
+    """
+    result = Reconciliation()
+    invoice_left, declaration_left = _join(result, invoice_items, declaration_items, _hs_code, "hs_code")
+    invoice_left, declaration_left = _join(result, invoice_left, declaration_left, _hs_heading, "hs_heading")
+    invoice_left, declaration_left = _match_descriptions(result, invoice_left, declaration_left)
+    result.unmatched_invoice, result.unmatched_declaration = invoice_left, declaration_left
+    return result
+
+def _summarize(issues: List[str], limit: int = 5) -> str:
+    shown = "; ".join(issues[:limit])
+    return shown + (f"; and {len(issues) - limit} more" if len(issues) > limit else "")
+
+def check_line_items(links) -> Tuple[bool, str]:
+    """Compliance rule: invoice and declaration line items agree on weight, quantity and value per HS code"""
+    invoice_items = line_items_of(links["invoice"])
+    declaration_items = line_items_of(links["customs_declaration"])
+    if not invoice_items or not declaration_items:
+        return False, "Line items missing in one or more documents."
+    result = reconcile_line_items(invoice_items, declaration_items)
+    issues = result.deltas()
+    issues += [f"invoice item {item.label()} not on the declaration" for item in result.unmatched_invoice]
+    issues += [f"declaration item {item.label()} not on the invoice" for item in result.unmatched_declaration]
+    if issues:
+        return False, f"Line Item Mismatch: {_summarize(issues)}"
+    return True, f"Line Items Reconciled ({len(result.matches)} matched groups)"
+
+def _hs_code_issue(table, item: LineItem) -> Optional[str]:
+    """Why the item's HS code is not a tariff code, or None when it is one.
+
+    A code is valid when it is in the table, when codes under it are (declared at a coarser
+    level), or when its first six digits or more are (a national subheading the table lacks).
+    """
+    if not item.hs_code:
+        return None
+    if len(item.hs_code) < HS_SHARED_DIGITS:
+        return f"HS {item.hs_code} has fewer than {HS_SHARED_DIGITS} digits"
+    if table.has_prefix(item.hs_code) or table.longest_prefix(item.hs_code, HS_SHARED_DIGITS):
+        return None
+    return f"HS {item.hs_code} not in the tariff"
+
+def _origins(group: _Group) -> set:
+    return {" ".join(_WORD.findall(item.origin.lower())) for item in group.items} - {""}
+
+def _same_origin(invoice_origins: set, declaration_origins: set) -> bool:
+    """Some invoice origin matches or contains a declaration one ("china" vs "made in china")"""
+    return any(a == b or f" {a} " in f" {b} " or f" {b} " in f" {a} " for a in invoice_origins for b in declaration_origins)
+
+def check_hs_codes(links) -> Tuple[Optional[bool], str]:
+    """Compliance rule: line-item HS codes exist in the tariff (not applicable until a table is compiled)"""
+    table = get_hs_table()
+    if table is None:
+        return None, "HS Code Validity not applicable: no HS code table compiled (see --build_hs_table)."
+    invoice_items = line_items_of(links["invoice"])
+    declaration_items = line_items_of(links["customs_declaration"])
+    if not invoice_items and not declaration_items:
+        return False, "Line items missing in one or more documents."
+    issues = [f"invoice item {issue}" for issue in filter(None, (_hs_code_issue(table, item) for item in invoice_items))]
+    issues += [f"declaration item {issue}" for issue in filter(None, (_hs_code_issue(table, item) for item in declaration_items))]
+    if issues:
+        return False, f"HS Code Issues: {_summarize(issues)}"
+    return True, f"HS Codes Valid ({len(invoice_items) + len(declaration_items)} items)"
+
+def check_line_item_origins(links) -> Tuple[Optional[bool], str]:
+    """Compliance rule: matched invoice and declaration line items declare the same origin"""
+    invoice_items = line_items_of(links["invoice"])
+    declaration_items = line_items_of(links["customs_declaration"])
+    if not invoice_items or not declaration_items:
+        return False, "Line items missing in one or more documents."
+    issues, compared = [], 0
+    for via, invoice, declaration in reconcile_line_items(invoice_items, declaration_items).matches:
+        invoice_origins, declaration_origins = _origins(invoice), _origins(declaration)
+        if not invoice_origins or not declaration_origins:
+            continue
+        compared += 1
+        if not _same_origin(invoice_origins, declaration_origins):
+            issues.append(f"{invoice.items[0].label()} origin {invoice.items[0].origin} vs {declaration.items[0].origin}")
+    if not compared:
+        return None, "Origin Consistency not applicable: no matched line items state an origin on both documents."
+    if issues:
+        return False, f"Origin Mismatch: {_summarize(issues)}"
+    return True, f"Origins Consistent ({compared} matched groups)"
+
+def _hs_table_version() -> Optional[str]:
+    table = get_hs_table()
+    return table.digest if table else None
+
+check_hs_codes.reference_data = _hs_table_version
@@ -1,50 +1,37 @@
-from adapters.mongo_repository import MongoRepository
 from adapters.llm_service import LLMService
+from adapters.vector_index import get_vector_index
 from entities.document import Document
-from use_cases.compliance import RULES
+from use_cases.compliance import rules_prompt
 from entities.result import ComplianceResult
 from typing import Dict, List
 import json
-from use_cases.compliance_rules import USER_RULES
 
 def vector_search_similar_docs(query_embedding, top_k=3) -> List[dict]:
-    repo = MongoRepository()
-    collection = repo.collection
-    pipeline = [
-        {
-            "$vectorSearch": {
-                "index": "invoice_embedding_index",
-                "path": "embedding",
-                "queryVector": query_embedding,
-                "numCandidates": 100,
-                "limit": top_k
-            }
-        },
-        {
-            "$project": {
-                "invoice_number": 1,
-                "invoice_date": 1,
-                "total_amount": 1,
-                "shipper": 1,
-                "consignee": 1,
-                "score": {"$meta": "vectorSearchScore"}
-            }
-        }
-    ]
+    # Atlas $vectorSearch or the local on-disk index, depending on VECTOR_BACKEND
     try:
-        similar_docs = list(collection.aggregate(pipeline))
+        similar_docs = get_vector_index().search(query_embedding, top_k=top_k)
     except Exception as e:
         print(f"Vector search error: {e}")
         similar_docs = []
     return similar_docs
 
+def vector_search_many(query_embeddings: Dict[str, object], top_k=3) -> Dict[str, List[dict]]:
+    """Retrieve neighbors for several documents in one batch (one connection for Atlas, one matrix product locally)"""
+    keys = list(query_embeddings)
+    if not keys:
+        return {}
+    try:
+        neighbors = get_vector_index().search_many([query_embeddings[key] for key in keys], top_k=top_k)
+    except Exception as e:
+        print(f"Vector search error: {e}")
+        neighbors = [[] for _ in keys]
+    return dict(zip(keys, neighbors))
+
 def generate_rag_compliance_report(links: Dict[str, Document], deterministic_results: List[ComplianceResult]) -> str:
     # For each main doc, retrieve similar docs using its embedding
-    rag_context = {}
-    for key, doc in links.items():
-        if doc and doc.embedding:
-            similar = vector_search_similar_docs(doc.embedding, top_k=3)
-            rag_context[key] = similar
+    rag_context = vector_search_many(
+        {key: doc.embedding for key, doc in links.items() if doc and doc.embedding is not None}, top_k=3
+    )
     llm = LLMService()
     prompt_template = """
 You are a compliance officer. Given these compliance rules:
@@ -74,7 +61,7 @@ Invoice_INV1001 – Compliance Report
 Final Status: FAIL (2 issues found)
 """
     context = {
-        "rules": USER_RULES,
+        "rules": rules_prompt(),
         "documents": json.dumps({k: v.data if v else None for k, v in links.items()}, indent=2, default=str),
         "deterministic_results": json.dumps([
             {"label": r.rule_name, "passed": r.passed, "explanation": r.explanation} for r in deterministic_results
@@ -82,54 +69,3 @@ Final Status: FAIL (2 issues found)
         "rag_context": json.dumps(rag_context, indent=2, default=str)
     }
     return llm.generate_report(prompt_template, context)
-
-def normalize_value(val):
-    if not val:
-        return ""
-    return str(val).replace("-", "").replace(" ", "").strip().lower()
-
-def get_first_present(data, keys):
-    for key in keys:
-        if key in data:
-            return data[key]
-    return None
-
-def link_documents(docs: List[Document]) -> Dict[str, Document]:
-    links = {
-        "invoice": None,
-        "customs_declaration": None,
-        "waybill": None,
-        "customs_certificate": None
-    }
-
-    # Step 1: Find the invoice document
-    for doc in docs:
-        data = doc.data
-        invoice_no = get_first_present(data, ["Invoice number", "invoice_number", "Invoice No."])
-        if invoice_no:
-            links["invoice"] = doc
-            break  # Assuming only one invoice per batch
-
-    # Step 2: Extract target values from the invoice
-    target_invoice_no = normalize_value(get_first_present(links["invoice"].data, ["Invoice number", "invoice_number", "Invoice No."])) if links["invoice"] else ""
-    target_dec_no = normalize_value(get_first_present(links["invoice"].data, ["Declaration Number (DEC NO.)", "declaration_number", "DEC NO.", "Declaration No."])) if links["invoice"] else ""
-    target_crn_no = normalize_value(get_first_present(links["invoice"].data, ["CRN No.", "crn_no", "CRN Number"])) if links["invoice"] else ""
-    target_bill_no = normalize_value(get_first_present(links["invoice"].data, ["bill_number", "Bill Number", "Bill No."])) if links["invoice"] else ""
-
-    # Step 3: Match other documents using the extracted values
-    for doc in docs:
-        data = doc.data
-        # Customs Declaration
-        dec_no = get_first_present(data, ["Declaration Number (DEC NO.)", "declaration_number", "DEC NO.", "Declaration No."])
-        if normalize_value(dec_no) == target_dec_no and doc != links["invoice"]:
-            links["customs_declaration"] = doc
-        # Waybill
-        crn_no = get_first_present(data, ["CRN No.", "crn_no", "CRN Number"])
-        if normalize_value(crn_no) == target_crn_no and doc != links["invoice"]:
-            links["waybill"] = doc
-        # Customs Certificate
-        bill_no = get_first_present(data, ["bill_number", "Bill Number", "Bill No."])
-        if normalize_value(bill_no) == target_bill_no and doc != links["invoice"]:
-            links["customs_certificate"] = doc
-
-    return links 
\ No newline at end of file
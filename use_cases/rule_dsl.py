@@ -0,0 +1,156 @@
+import importlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config import settings
+from entities.compliance_rule import ComplianceRule
+from use_cases.compliance import EMPTY_CANONICAL, EMPTY_TYPED, canonical_of, empty_links, normalize_value, typed_of
+
+try:
+    import yaml
+except ImportError:
+    yaml = None  # YAML rule files are optional; JSON needs nothing extra
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), "compliance_rules.json")
+
+# A rule is a dict in the rules file:
+#   name, description    shown in results and to the LLM
+#   requires             document roles that must be linked; the rule fails with "missing" otherwise
+#   op                   present | equals | contains | gte | python
+#   left, right          field references "role.field" (canonical) or "role.typed.field" (typed)
+#   typed                optional [left, right] typed references compared instead of the text when both parse
+#   tolerance            numeric tolerance for equals, or the name of a setting holding it
+#   function             "module:function" taking the links and returning (passed, explanation), for op python;
+#                        passed is None when the rule does not apply to the shipment
+#   reads                roles whose documents a python rule reads (all by default), for its fingerprint
+#   pass, fail, missing  explanations; {left} and {right} are replaced by the field values
+
+def _values_equal(left, right, left_typed, right_typed, tolerance) -> bool:
+    if left_typed is not None and right_typed is not None:
+        if isinstance(left_typed, (int, float)) and isinstance(right_typed, (int, float)):
+            return abs(left_typed - right_typed) <= tolerance
+        return left_typed == right_typed
+    return normalize_value(left) == normalize_value(right)
+
+def _value_contained(left, right, left_typed, right_typed, tolerance) -> bool:
+    return normalize_value(left) in normalize_value(right)
+
+def _value_gte(left, right, left_typed, right_typed, tolerance) -> bool:
+    if left_typed is not None and right_typed is not None:
+        return left_typed >= right_typed
+    return str(left) >= str(right)
+
+COMPARISONS = {
+    "equals": _values_equal,
+    "contains": _value_contained,
+    "gte": _value_gte,
+}
+
+ROLES = tuple(empty_links())
+
+def parse_field_ref(ref: str, rule_name: str) -> Tuple[str, str, str]:
+    """Split a field reference into (role, "canonical" or "typed", field), rejecting unknown roles and fields"""
+    parts = ref.split(".")
+    if len(parts) == 2:
+        role, kind, field = parts[0], "canonical", parts[1]
+    elif len(parts) == 3 and parts[1] == "typed":
+        role, kind, field = parts[0], "typed", parts[2]
+    else:
+        raise ValueError(f"Rule {rule_name!r}: malformed field reference {ref!r}")
+    known = EMPTY_TYPED if kind == "typed" else EMPTY_CANONICAL
+    if role not in ROLES or field not in known:
+        raise ValueError(f"Rule {rule_name!r}: unknown field reference {ref!r}")
+    return role, kind, field
+
+def compile_field_ref(ref: str, rule_name: str) -> Callable[[Dict[str, Any]], Any]:
+    """Resolve a field reference once into a getter over the shipment links"""
+    role, kind, field = parse_field_ref(ref, rule_name)
+    source = typed_of if kind == "typed" else canonical_of
+    return lambda links: source(links, role).get(field)
+
+def _import_function(path: str, rule_name: str) -> Callable:
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError(f"Rule {rule_name!r}: function must be given as 'module:function', got {path!r}")
+    return getattr(importlib.import_module(module_name), attribute)
+
+def resolve_tolerance(value: Any, rule_name: str) -> float:
+    if isinstance(value, str):
+        if not hasattr(settings, value):
+            raise ValueError(f"Rule {rule_name!r}: unknown tolerance setting {value!r}")
+        value = getattr(settings, value)
+    return float(value)
+
+def explanation_templates(spec: Dict[str, Any]) -> Tuple[str, str, str]:
+    """The (missing, pass, fail) explanations of a rule, with defaults for the ones it leaves out"""
+    name = spec["name"]
+    return (spec.get("missing", f"{name}: required data missing."),
+            spec.get("pass", f"{name} passed"),
+            spec.get("fail", f"{name} failed: {{left}} vs {{right}}"))
+
+def compile_rule(spec: Dict[str, Any]) -> ComplianceRule:
+    """Compile one rule definition into a ComplianceRule whose validate(links) returns (passed, explanation)"""
+    name = spec["name"]
+    op = spec.get("op", "present")
+    requires = tuple(spec.get("requires", ()))
+    for role in requires:
+        if role not in ROLES:
+            raise ValueError(f"Rule {name!r}: unknown document role {role!r}")
+    missing, passed_text, failed_text = explanation_templates(spec)
+
+    if op == "python":
+        function = _import_function(spec["function"], name)
+
+        def validate(links):
+            for role in requires:
+                if not links.get(role):
+                    return False, missing
+            return function(links)
+
+        # Data a python rule reads besides the documents (e.g. a reference table), for its fingerprint
+        validate.reference_data = getattr(function, "reference_data", None)
+        return ComplianceRule(name, spec.get("description", name), validate, spec)
+
+    if op != "present" and op not in COMPARISONS:
+        raise ValueError(f"Rule {name!r}: unknown op {op!r}")
+    refs = [compile_field_ref(spec[side], name) for side in ("left", "right") if side in spec]
+    if op != "present" and len(refs) != 2:
+        raise ValueError(f"Rule {name!r}: op {op!r} needs both left and right")
+    typed_refs = [compile_field_ref(ref, name) for ref in spec.get("typed", ())]
+    if typed_refs and len(typed_refs) != 2:
+        raise ValueError(f"Rule {name!r}: typed needs a [left, right] pair")
+    compare = COMPARISONS.get(op)
+    tolerance = resolve_tolerance(spec.get("tolerance", 0.0), name)
+
+    def validate(links):
+        # Short-circuit before touching any field when a required document is not linked
+        for role in requires:
+            if not links.get(role):
+                return False, missing
+        values = [ref(links) for ref in refs]
+        if not all(values):
+            return False, missing
+        left, right = (values + [None, None])[:2]
+        if compare is not None:
+            left_typed, right_typed = (typed_refs[0](links), typed_refs[1](links)) if typed_refs else (None, None)
+            if not compare(left, right, left_typed, right_typed, tolerance):
+                return False, failed_text.format(left=left, right=right)
+        return True, passed_text.format(left=left, right=right)
+
+    return ComplianceRule(name, spec.get("description", name), validate, spec)
+
+def load_rule_specs(path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Read rule definitions from a JSON file, or YAML when PyYAML is installed"""
+    path = path or settings.COMPLIANCE_RULES_PATH or DEFAULT_RULES_PATH
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ImportError(f"PyYAML is required to read {path} (pip install pyyaml)")
+            specs = yaml.safe_load(f)
+        else:
+            specs = json.load(f)
+    return specs["rules"] if isinstance(specs, dict) else specs
+
+def load_rules(path: Optional[str] = None) -> List[ComplianceRule]:
+    """Compile every rule in the rules file; a bad definition fails here rather than mid-batch"""
+    return [compile_rule(spec) for spec in load_rule_specs(path)]
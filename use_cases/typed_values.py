@@ -0,0 +1,128 @@
+import re
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+# Weight units as Gemini writes them, with their factor to kilograms
+WEIGHT_UNITS = {
+    "kg": 1.0, "kgs": 1.0, "kilo": 1.0, "kilos": 1.0, "kilogram": 1.0, "kilograms": 1.0,
+    "g": 0.001, "gm": 0.001, "gms": 0.001, "gram": 0.001, "grams": 0.001,
+    "t": 1000.0, "ton": 1000.0, "tons": 1000.0, "tonne": 1000.0, "tonnes": 1000.0, "mt": 1000.0,
+    "lb": 0.45359237, "lbs": 0.45359237,
+}
+
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "د.إ": "AED"}
+
+# Digits with "," and "." in either role: 1,234.5 (US) or 1.234,5 (European)
+_NUMBER = re.compile(r"[-+]?\d[\d.,]*|[-+]?\.\d+")
+
+# Day-first formats, tried in order after ISO 8601 (UAE documents write 15.8.23 for 15 August 2023),
+# then month-first (US) ones, which are only reached when the day-first reading is impossible (08/15/2023)
+DATE_FORMATS = [
+    "%d.%m.%y", "%d.%m.%Y", "%d/%m/%y", "%d/%m/%Y", "%d-%m-%y", "%d-%m-%Y",
+    "%d %b %Y", "%d %B %Y", "%d-%b-%Y", "%d-%b-%y", "%d %b %y", "%b %d, %Y", "%B %d, %Y", "%Y/%m/%d",
+    "%m/%d/%Y", "%m/%d/%y", "%m-%d-%Y", "%m-%d-%y",
+]
+
+def _to_float(token: str) -> float:
+    """Read a number token whichever of "," and "." is the decimal separator.
+
+    With both, the last one is the decimal separator. A lone "," followed by exactly three
+    digits groups thousands (1,200), otherwise it is decimal (12,5). Several of the same
+    separator group thousands (1.234.567); a lone "." is decimal.
+    """
+    token = token.rstrip(".,")
+    if "," in token and "." in token:
+        decimal = "," if token.rfind(",") > token.rfind(".") else "."
+        grouping = "." if decimal == "," else ","
+        return float(token.replace(grouping, "").replace(decimal, "."))
+    for separator in (",", "."):
+        parts = token.split(separator)
+        if len(parts) > 2:
+            return float("".join(parts))
+        if len(parts) == 2:
+            if separator == "," and len(parts[1]) == 3:
+                return float("".join(parts))
+            return float(".".join(parts))
+    return float(token)
+
+def _number(text: str) -> Optional[float]:
+    match = _NUMBER.search(text)
+    if not match:
+        return None
+    return _to_float(match.group(0))
+
+def parse_number(value: Any) -> Optional[float]:
+    """First number in a value such as 12, "1,200" or "12 pcs" (None when there is none)"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return _number(str(value))
+
+def parse_weight_kg(value: Any) -> Optional[float]:
+    """Parse a weight such as "1,234.5 KG", "1.234,5 kg", "980 kgs" or "1.2 t" to kilograms (a bare number is taken as kg)"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return parse_weight_kg(value.get("value", value.get("weight")))
+    text = str(value).strip().lower()
+    match = _NUMBER.search(text)
+    if not match:
+        return None
+    amount = _to_float(match.group(0))
+    unit = re.search(r"[a-z]+", text[match.end():])
+    factor = WEIGHT_UNITS.get(unit.group(0), 1.0) if unit else 1.0
+    return amount * factor
+
+def parse_amount(value: Any) -> Optional[Dict[str, Any]]:
+    """Parse an amount such as "AED 12,500.00" or "$1,200" to {"value": float, "currency": code or None}"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return {"value": float(value), "currency": None}
+    if isinstance(value, dict):
+        parsed = parse_amount(value.get("value", value.get("amount", value.get("numbers"))))
+        if parsed and value.get("currency"):
+            parsed["currency"] = str(value["currency"]).upper()
+        return parsed
+    text = str(value).strip()
+    amount = _number(text)
+    if amount is None:
+        return None
+    code = re.search(r"\b[A-Z]{3}\b", text)
+    currency = code.group(0) if code else next((c for s, c in CURRENCY_SYMBOLS.items() if s in text), None)
+    return {"value": amount, "currency": currency}
+
+def parse_date(value: Any) -> Optional[datetime]:
+    """Parse an ISO date or a day-first spelling such as "15.8.23", "15/08/2023" or "15 Aug 2023" to a datetime
+    (month-first only when the day-first reading is impossible, as in "08/15/2023")"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value
+    text = re.sub(r"\s+", " ", str(value).strip().rstrip("."))
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+def typed_fields(canonical: Dict[str, Any]) -> Dict[str, Any]:
+    """Numeric and datetime versions of the canonical fields rules and aggregations compare (None when unparseable)"""
+    amount = parse_amount(canonical.get("total_amount"))
+    return {
+        "total_weight_kg": parse_weight_kg(canonical.get("total_weight")),
+        "gross_weight_kg": parse_weight_kg(canonical.get("gross_weight")),
+        "invoice_date": parse_date(canonical.get("invoice_date")),
+        "total_amount": amount["value"] if amount else None,
+        "currency": (amount or {}).get("currency") or canonical.get("currency"),
+    }